@@ -0,0 +1,116 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+"""Microbenchmark of the per-request DAG bookkeeping done by ServiceOrchestrator.schedule.
+
+Compares the previous deepcopy-per-request runtime graph with the compiled ExecutionPlan and its
+copy-on-write RuntimeDAG view, for the ChatQnA pipeline (embedding -> retriever -> rerank -> llm),
+both when the graph is left untouched and when the rerank node is skipped at runtime.
+
+Run from the repository root:
+    python benchmarks/bench_dag_schedule.py
+"""
+
+import argparse
+import os
+import sys
+import timeit
+from copy import deepcopy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from comps.core.dag import DAG, RuntimeDAG  # noqa: E402
+
+PIPELINE = {"embedding": ["retriever"], "retriever": ["rerank"], "rerank": ["llm"], "llm": []}
+
+
+def legacy_predecessors(graph, node):
+    return [key for key in graph if node in graph[key]]
+
+
+def legacy_add_edge(graph, ind_node, dep_node):
+    # baseline add_edge: validate on a deep copy of the whole graph
+    dag = DAG()
+    test_graph = deepcopy(graph)
+    test_graph[ind_node].add(dep_node)
+    if not dag.validate(test_graph):
+        raise Exception("validation error!")
+    graph[ind_node].add(dep_node)
+
+
+def walk(runtime_graph, predecessors, add_edge, skip_rerank):
+    """Replay the graph calls schedule() and align_outputs() make for one request."""
+    result = {}
+    ind_nodes = runtime_graph.ind_nodes()
+    ready = list(ind_nodes)
+    while ready:
+        node = ready.pop()
+        result[node] = True
+        if node == "retriever" and skip_rerank:
+            for ds in reversed(runtime_graph.downstream(node)):
+                for nds in runtime_graph.downstream(ds):
+                    add_edge(node, nds)
+                runtime_graph.delete_node_if_exists(ds)
+        for d_node in runtime_graph.downstream(node):
+            if all(i in result for i in predecessors(d_node)):
+                ready.append(d_node)
+    return ind_nodes
+
+
+def legacy_request(dag, skip_rerank):
+    runtime_graph = DAG()
+    runtime_graph.graph = deepcopy(dag.graph)
+    ind_nodes = walk(
+        runtime_graph,
+        lambda n: legacy_predecessors(runtime_graph.graph, n),
+        lambda u, v: legacy_add_edge(runtime_graph.graph, u, v),
+        skip_rerank,
+    )
+    nodes_to_keep = []
+    for i in ind_nodes:
+        nodes_to_keep.append(i)
+        nodes_to_keep.extend(runtime_graph.all_downstreams(i))
+    for node in list(runtime_graph.graph.keys()):
+        if node not in nodes_to_keep:
+            runtime_graph.delete_node_if_exists(node)
+    return runtime_graph.all_leaves()
+
+
+def plan_request(dag, skip_rerank):
+    runtime_graph = RuntimeDAG(dag.execution_plan())
+    ind_nodes = walk(runtime_graph, runtime_graph.predecessors, runtime_graph.add_edge, skip_rerank)
+    if runtime_graph.modified:
+        nodes_to_keep = set(ind_nodes)
+        for i in ind_nodes:
+            nodes_to_keep.update(runtime_graph.all_downstreams(i))
+        for node in list(runtime_graph.graph.keys()):
+            if node not in nodes_to_keep:
+                runtime_graph.delete_node_if_exists(node)
+    return runtime_graph.all_leaves()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=20000, help="requests per measurement")
+    parser.add_argument("--repeat", type=int, default=5, help="measurements, the best one is reported")
+    args = parser.parse_args()
+
+    dag = DAG()
+    dag.from_dict(PIPELINE)
+    dag.execution_plan()
+
+    for skip_rerank in (False, True):
+        assert legacy_request(dag, skip_rerank) == plan_request(dag, skip_rerank)
+        label = "rerank skipped" if skip_rerank else "graph untouched"
+        timings = {}
+        for name, func in (("deepcopy", legacy_request), ("plan", plan_request)):
+            best = min(timeit.repeat(lambda: func(dag, skip_rerank), number=args.number, repeat=args.repeat))
+            timings[name] = best / args.number * 1e6
+        print(
+            f"{label:16s} deepcopy {timings['deepcopy']:7.2f} us/request   "
+            f"plan {timings['plan']:7.2f} us/request   speedup {timings['deepcopy'] / timings['plan']:.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+"""Benchmark of the phrase matching of highlight_pdf against the previous implementation.
+
+The previous loop extracted the words of every page again for every phrase and compared each phrase at
+every word position. The current one extracts and lower-cases the words of a page once, finds all the
+phrases in one pass through an index of their first words, and matches the pages of large documents in
+parallel. Phrases are word windows sampled from the documents, like cited chunks. Matches are checked
+to be identical.
+
+Run from the repository root:
+    python benchmarks/bench_highlighting.py path/to/circulars/*.pdf --phrases 10
+"""
+
+import argparse
+import glob
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import fitz  # noqa: E402
+
+from comps.core.highlighting import HIGHLIGHT_PROCESSES, get_pool, match_document, phrase_index  # noqa: E402
+
+DEFAULT_PDFS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "comps", "parsers", "input", "*.pdf")
+
+
+def legacy_match(doc, search_texts):
+    """The matching loops of highlight_pdf before the phrase index, without the annotations."""
+    found = {}
+    for idx, text in enumerate(search_texts):
+        search_phrase = text.strip()
+        if not search_phrase:
+            continue
+        phrase_words = search_phrase.split()
+        phrase_len = len(phrase_words)
+        for page_num in range(len(doc)):
+            page = doc[page_num]
+            words = page.get_text("words")
+            for i in range(len(words) - phrase_len + 1):
+                match = True
+                for j in range(phrase_len):
+                    if words[i + j][4].strip().lower() != phrase_words[j].strip().lower():
+                        match = False
+                        break
+                if match:
+                    bboxes = [tuple(words[i + j][:4]) for j in range(phrase_len)]
+                    found.setdefault(page_num, {}).setdefault(idx, []).append(bboxes)
+    return found
+
+
+def sample_phrases(doc, count, rng):
+    """`count` windows of 3 to 8 consecutive words taken from random pages."""
+    pages = [[word[4] for word in page.get_text("words")] for page in doc]
+    pages = [words for words in pages if len(words) >= 8]
+    phrases = []
+    for _ in range(count if pages else 0):
+        words = rng.choice(pages)
+        length = rng.randint(3, 8)
+        start = rng.randrange(len(words) - length + 1)
+        phrases.append(" ".join(words[start : start + length]))
+    return phrases
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("pdfs", nargs="*", help=f"PDFs to highlight, {DEFAULT_PDFS} by default")
+    parser.add_argument("--phrases", type=int, default=10, help="phrases highlighted per document")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    pdfs = args.pdfs or sorted(glob.glob(DEFAULT_PDFS))
+    rng = random.Random(args.seed)
+    if HIGHLIGHT_PROCESSES > 1:
+        # the service starts its workers on the first large document, not timed here
+        get_pool().submit(int).result()
+
+    total = {"legacy": 0.0, "current": 0.0}
+    for pdf_path in pdfs:
+        with fitz.open(pdf_path) as doc:
+            phrases = sample_phrases(doc, args.phrases, rng)
+            start = time.perf_counter()
+            legacy = legacy_match(doc, phrases)
+            legacy_time = time.perf_counter() - start
+            page_count = len(doc)
+
+        start = time.perf_counter()
+        current = match_document(pdf_path, page_count, phrase_index(phrases))
+        current_time = time.perf_counter() - start
+        current = {page_num: found for page_num, found in current.items() if found}
+        assert legacy == current, f"matches differ for {pdf_path}"
+
+        total["legacy"] += legacy_time
+        total["current"] += current_time
+        matches = sum(len(boxes) for found in current.values() for boxes in found.values())
+        print(
+            f"{os.path.basename(pdf_path)[:40]:40s} {page_count:4d} pages {matches:4d} matches   "
+            f"legacy {legacy_time:7.3f}s   current {current_time:7.3f}s   speedup {legacy_time / current_time:.2f}x"
+        )
+    if total["current"]:
+        print(
+            f"{'total':40s} {'':23s}   legacy {total['legacy']:7.3f}s   current {total['current']:7.3f}s   "
+            f"speedup {total['legacy'] / total['current']:.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
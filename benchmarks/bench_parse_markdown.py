@@ -0,0 +1,179 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+"""Benchmark of TreeParser.parse_markdown against the previous implementation.
+
+The previous parser read the markdown line by line, re-seeked the file twice per table line to peek
+ahead, recompiled its regexes per line, grew the section text by string concatenation and ran a full
+SequenceMatcher ratio for every heading. The current one reads both files once, walks the lines by
+index, joins the section text once and rejects dissimilar headings with the quick ratio bounds. The
+trees are checked to be identical.
+
+Run from the repository root, on Marker outputs (<dir>/<name>/<name>.md and toc.txt):
+    python benchmarks/bench_parse_markdown.py --output-dir comps/dataprep/out
+"""
+
+import argparse
+import os
+import re
+import sys
+import time
+from difflib import SequenceMatcher
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from comps.parsers import treeparser  # noqa: E402
+from comps.parsers.node import Node  # noqa: E402
+from comps.parsers.table import Table  # noqa: E402
+from comps.parsers.text import Text  # noqa: E402
+from comps.parsers.treeparser import TreeParser  # noqa: E402
+
+DEFAULT_OUTPUT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "comps", "dataprep", "out")
+
+
+def legacy_parse_markdown(parser, filename, rootNode, recentNodeDict):
+    """parse_markdown before the single pass rewrite."""
+    OUTPUT_DIR = treeparser.OUTPUT_DIR
+    toc_file = open(os.path.join(OUTPUT_DIR, filename, "toc.txt"), "r")
+    toc_line = toc_file.readline()
+    currNode = rootNode
+    tables = []
+    content = ""
+    previous_line = ""
+    with open(os.path.join(OUTPUT_DIR, filename, filename + ".md"), "r") as markdown_file:
+        line = markdown_file.readline()
+        while line:
+            line = re.sub(r"<span[^>]*?\/?>(</span>)?", "", line)
+            if line == "\n":
+                line = markdown_file.readline()
+                continue
+            if bool(re.match(r"^#+", line)):
+                _, heading = line.split(" ", 1)
+                if not toc_line:
+                    line = markdown_file.readline()
+                    continue
+                level, heading_toc = toc_line.split(";")
+                heading = heading.strip().replace("*", "")
+                if (SequenceMatcher(None, "contents", heading_toc.lower())).ratio() > 0.6:
+                    toc_line = toc_file.readline()
+                    level, heading_toc = toc_line.split(";")
+                elif SequenceMatcher(None, heading.lower(), heading_toc.lower()).ratio() > 0.6:
+                    node = Node(level, heading, os.path.join(OUTPUT_DIR, filename))
+                    if level > currNode.get_level():
+                        currNode.append_child(node)
+                        node.set_parent(currNode)
+                    else:
+                        parent_key = -1
+                        for key in reversed(recentNodeDict):
+                            if key < node.get_level():
+                                parent_key = key
+                                break
+                        recentNodeDict[parent_key].append_child(node)
+                        node.set_parent(recentNodeDict[parent_key])
+                        recentNodeDict[node.get_level()] = node
+                    text_obj = Text(content, currNode)
+                    currNode.append_content(text_obj)
+                    for table in tables:
+                        currNode.append_content(table)
+                    tables.clear()
+                    content = ""
+                    currNode = node
+                    toc_line = toc_file.readline()
+                else:
+                    content += line
+            elif line[0] == "|":
+                table_list = []
+                table_list.append(line)
+                while parser.peek_next_lines(markdown_file)[0] and parser.peek_next_lines(markdown_file)[0][0] == "|":
+                    line = markdown_file.readline()
+                    table_list.append(line)
+                next_line = parser.peek_next_lines(markdown_file)[1].split(">", 1)
+                if len(next_line) > 1:
+                    next_line = next_line[1]
+                else:
+                    next_line = next_line[0]
+                pattern_table_heading = re.compile(r"^(Table|Figure)\s+(\d+)", re.IGNORECASE)
+                match_table_heading_previous = pattern_table_heading.search(previous_line)
+                match_table_heading_next = pattern_table_heading.search(next_line)
+                heading = ""
+                if match_table_heading_previous:
+                    heading = previous_line
+                elif match_table_heading_next:
+                    heading = next_line
+                table_obj = Table("".join(table_list), heading, currNode)
+                tables.append(table_obj)
+            else:
+                pattern_heading = re.compile(r"^(Table|Figure)\s+(\d+)", re.IGNORECASE)
+                match_heading = pattern_heading.search(line)
+                if not match_heading:
+                    content += line
+            previous_line = line
+            line = markdown_file.readline()
+            if not line:
+                text_obj = Text(content, currNode)
+                currNode.append_content(text_obj)
+                for table in tables:
+                    currNode.append_content(table)
+    toc_file.close()
+
+
+def dump(node):
+    """Plain nested tuples of a tree, to compare the outputs."""
+    content = []
+    for item in node.get_content():
+        if isinstance(item, Text):
+            content.append(("text", item.content))
+        else:
+            content.append(("table", item.markdown_content, item.heading))
+    children = [dump(node.get_child(i)) for i in range(node.get_length_children())]
+    return node.get_level(), node.get_heading(), content, children
+
+
+def time_parse(parse, filename, repeat):
+    """Best time of `repeat` parses of `filename`, and the tree of the last one."""
+    best = float("inf")
+    for _ in range(repeat):
+        rootNode = Node("0", "root", os.path.join(treeparser.OUTPUT_DIR, filename))
+        start = time.perf_counter()
+        parse(filename, rootNode, {"0": rootNode})
+        best = min(best, time.perf_counter() - start)
+    return best, dump(rootNode)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--output-dir", default=DEFAULT_OUTPUT_DIR, help="directory of the Marker outputs")
+    parser.add_argument("--repeat", type=int, default=20, help="parses per document, the best time is kept")
+    args = parser.parse_args()
+
+    treeparser.OUTPUT_DIR = args.output_dir
+    tree_parser = TreeParser()
+    filenames = sorted(
+        name
+        for name in os.listdir(args.output_dir)
+        if os.path.exists(os.path.join(args.output_dir, name, name + ".md"))
+        and os.path.exists(os.path.join(args.output_dir, name, "toc.txt"))
+    )
+
+    total = {"legacy": 0.0, "current": 0.0}
+    for filename in filenames:
+        legacy_time, legacy_tree = time_parse(
+            lambda *a: legacy_parse_markdown(tree_parser, *a), filename, args.repeat
+        )
+        current_time, current_tree = time_parse(tree_parser.parse_markdown, filename, args.repeat)
+        assert legacy_tree == current_tree, f"trees differ for {filename}"
+        total["legacy"] += legacy_time
+        total["current"] += current_time
+        print(
+            f"{filename[:44]:44s}   legacy {legacy_time * 1000:8.2f}ms   current {current_time * 1000:8.2f}ms   "
+            f"speedup {legacy_time / current_time:.2f}x"
+        )
+    if total["current"]:
+        print(
+            f"{'total':44s}   legacy {total['legacy'] * 1000:8.2f}ms   current {total['current'] * 1000:8.2f}ms   "
+            f"speedup {total['legacy'] / total['current']:.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+"""Benchmark of the lightweight PDF parser, per page, against the previous implementation.
+
+The previous parser tested every word against every table box in Python and detected the tables of a
+page twice, with find_tables() then extract_tables(). The current one masks all words against all
+boxes with NumPy and extracts the tables it found. Outputs are checked to be identical. Use PDFs with
+many tables, e.g. annexure-heavy circulars, to see the gain.
+
+Run from the repository root:
+    python benchmarks/bench_parser_light.py path/to/circulars/*.pdf
+"""
+
+import argparse
+import glob
+import os
+import re
+import sys
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import pandas as pd  # noqa: E402
+import pdfplumber  # noqa: E402
+
+from comps.parsers.parser_light import parse_page  # noqa: E402
+
+DEFAULT_PDFS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "comps", "parsers", "input", "*.pdf")
+
+
+def legacy_parse_page(page):
+    """The page loop of extract_text_and_tables before the NumPy mask, returning plain values."""
+    page_tables = page.find_tables()
+    table_bboxes = [table.bbox for table in page_tables]
+    extracted_text = []
+    lines_dict = defaultdict(list)
+    for word in page.extract_words():
+        word_bbox = (float(word["x0"]), float(word["top"]), float(word["x1"]), float(word["bottom"]))
+        inside_table = any(
+            table_bbox[0] <= word_bbox[0] <= table_bbox[2] and table_bbox[1] <= word_bbox[1] <= table_bbox[3]
+            for table_bbox in table_bboxes
+        )
+        if not inside_table:
+            extracted_text.append(word["text"])
+        lines_dict[word["top"]].append(word["text"])
+
+    texts = []
+    page_content = " ".join(extracted_text)
+    match = re.search(r"^(.*?)(\s*\d+)\s*$", page_content)
+    if match:
+        if match.group(1).strip():
+            texts.append(match.group(1).strip())
+    else:
+        texts.append(page_content)
+
+    tables = []
+    sorted_lines = sorted(lines_dict.items(), key=lambda x: x[0])
+    for table_bbox, table in zip(table_bboxes, page.extract_tables()):
+        above_lines = [text for top, text in sorted_lines if top < table_bbox[1]]
+        heading_lines = above_lines[-2:] if above_lines else []
+        heading = " ".join(word for line in heading_lines for word in line) if heading_lines else None
+        tables.append((pd.DataFrame(table).to_markdown(index=False), heading))
+    return texts, tables
+
+
+def current_parse_page(page):
+    texts, tables = parse_page(page)
+    return [text.content for text in texts], [(table.markdown_content, table.heading) for table in tables]
+
+
+def time_pages(pdf_path, func):
+    """Seconds spent by `func` on all the pages, with a fresh document so no layout is cached."""
+    with pdfplumber.open(pdf_path) as pdf:
+        outputs, elapsed = [], 0.0
+        for page in pdf.pages:
+            start = time.perf_counter()
+            outputs.append(func(page))
+            elapsed += time.perf_counter() - start
+        return elapsed, outputs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("pdfs", nargs="*", help=f"PDFs to parse, {DEFAULT_PDFS} by default")
+    args = parser.parse_args()
+    pdfs = args.pdfs or sorted(glob.glob(DEFAULT_PDFS))
+
+    total = {"legacy": 0.0, "current": 0.0}
+    for pdf_path in pdfs:
+        legacy_time, legacy_output = time_pages(pdf_path, legacy_parse_page)
+        current_time, current_output = time_pages(pdf_path, current_parse_page)
+        assert legacy_output == current_output, f"outputs differ for {pdf_path}"
+        total["legacy"] += legacy_time
+        total["current"] += current_time
+        tables = sum(len(page_tables) for _, page_tables in current_output)
+        print(
+            f"{os.path.basename(pdf_path)[:40]:40s} {len(current_output):4d} pages {tables:4d} tables   "
+            f"legacy {legacy_time:7.2f}s   current {current_time:7.2f}s   speedup {legacy_time / current_time:.2f}x"
+        )
+    if total["current"]:
+        print(
+            f"{'total':40s} {'':21s}   legacy {total['legacy']:7.2f}s   current {total['current']:7.2f}s   "
+            f"speedup {total['legacy'] / total['current']:.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
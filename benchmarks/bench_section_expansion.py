@@ -0,0 +1,153 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+"""Benchmark of the section expansion of retrieval hits against a real RediSearch index.
+
+Writes a synthetic document with dataprep's ChunkWriter to a scratch index of a Redis Stack server, first
+created without the section fields so that they are added with FT.ALTER like on an index of an older
+release. Hits are then expanded with the retriever's SectionExpander, which reads the sections back with
+pipelined TAG queries. The merged sections are checked against the chunks written, in both modes, before
+timing the expansion of random hits. The scratch index and its chunks are deleted at the end.
+
+Run from the repository root, against Redis Stack:
+    python benchmarks/bench_section_expansion.py --redis-url redis://localhost:6379
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+# dataprep and the retriever import their modules flat, like their services
+sys.path.insert(0, os.path.join(ROOT, "comps", "dataprep"))
+sys.path.insert(0, os.path.join(ROOT, "comps", "retriever"))
+
+import numpy as np  # noqa: E402
+import redis  # noqa: E402
+from chunk_writer import CONTENT_KEY, SECTION_SEPARATOR, VECTOR_KEY, ChunkWriter  # noqa: E402
+from langchain_core.documents import Document  # noqa: E402
+from redis.commands.search.field import TextField, VectorField  # noqa: E402
+from redis.commands.search.indexDefinition import IndexDefinition, IndexType  # noqa: E402
+from section_expander import SECTION_ID_KEY, SectionExpander, count_tokens  # noqa: E402
+
+
+def write_document(writer, file_name, sections, chunks_per_section, dim, rng):
+    """Chunks of `sections` sections, their keys per section in document order."""
+    chunks, chunk_sections = [], []
+    for node_id in range(1, sections + 1):
+        path = SECTION_SEPARATOR.join([f"Chapter {node_id}", f"Part {node_id}.1"])
+        for j in range(chunks_per_section):
+            words = " ".join(f"w{rng.randrange(10_000)}" for _ in range(rng.randint(20, 60)))
+            chunks.append(f"section {node_id} chunk {j} {words}")
+            chunk_sections.append((path, node_id))
+    vectors = np.asarray([[rng.random() for _ in range(dim)] for _ in chunks], dtype=np.float32)
+    keys = writer.write(file_name, chunks, vectors, chunk_sections)
+    by_section = {}
+    for key, text, (_, node_id) in zip(keys, chunks, chunk_sections):
+        by_section.setdefault(writer.section_id(file_name, node_id), []).append((key, text))
+    return by_section
+
+
+def wait_indexed(ft):
+    while int(ft.info().get("indexing", 0)):
+        time.sleep(0.05)
+
+
+def hit(key):
+    return Document(page_content="", metadata={"id": key})
+
+
+def check(expander, by_section, plain_key):
+    section_id, chunks = next(iter(by_section.items()))
+    keys = [key for key, _ in chunks]
+    texts = [text for _, text in chunks]
+    total = sum(count_tokens(text) for text in texts)
+
+    # the whole section, once for two hits of it, at the rank of the best one
+    merged = expander.expand([hit(keys[3]), hit(keys[1])], "section", total)
+    assert len(merged) == 1, merged
+    assert merged[0].page_content == "\n".join(texts)
+    assert merged[0].metadata[SECTION_ID_KEY] == section_id
+    assert merged[0].metadata["chunk_ids"] == ",".join(keys)
+    assert merged[0].metadata["hits"] == 2
+
+    # a window of neighbours in document order, grown around the hit within the budget
+    budget = count_tokens(texts[3]) + count_tokens(texts[2]) + count_tokens(texts[4])
+    window = expander.expand([hit(keys[3])], "siblings", budget)[0]
+    ids = window.metadata["chunk_ids"].split(",")
+    assert keys[3] in ids and ids == keys[keys.index(ids[0]) : keys.index(ids[0]) + len(ids)], ids
+    assert count_tokens(window.page_content) <= budget
+    assert window.page_content == "\n".join(texts[keys.index(ids[0]) : keys.index(ids[0]) + len(ids)])
+
+    # chunks of documents ingested without sections are returned as they are
+    plain = hit(plain_key)
+    assert expander.expand([plain], "section", total) == [plain]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--redis-url", default=os.getenv("REDIS_URL", "redis://localhost:6379"))
+    parser.add_argument("--sections", type=int, default=200)
+    parser.add_argument("--chunks-per-section", type=int, default=8)
+    parser.add_argument("--dim", type=int, default=64)
+    parser.add_argument("--queries", type=int, default=200, help="expansions timed, of 5 random hits each")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    pool = redis.ConnectionPool.from_url(args.redis_url)
+    client = redis.Redis(connection_pool=pool)
+    try:
+        client.execute_command("FT._LIST")
+    except redis.ResponseError:
+        sys.exit(f"{args.redis_url} has no RediSearch module, run against Redis Stack")
+    except redis.ConnectionError as e:
+        sys.exit(f"cannot connect to {args.redis_url}: {e}")
+
+    index_name = f"bench-sections-{os.getpid()}"
+    writer = ChunkWriter(None, pool, index_name=index_name)
+    ft = client.ft(index_name)
+    try:
+        # an index of a release without the section fields, ChunkWriter adds them with FT.ALTER
+        ft.create_index(
+            (
+                TextField(CONTENT_KEY),
+                VectorField(VECTOR_KEY, "FLAT", {"TYPE": "FLOAT32", "DIM": args.dim, "DISTANCE_METRIC": "COSINE"}),
+                TextField("file_name"),
+            ),
+            definition=IndexDefinition(prefix=[writer.key_prefix], index_type=IndexType.HASH),
+        )
+        plain_key = writer.write(
+            "plain.pdf", ["a chunk of a document without sections"], np.ones((1, args.dim), dtype=np.float32)
+        )[0]
+        by_section = write_document(
+            writer, "circular-2024.07 master.pdf", args.sections, args.chunks_per_section, args.dim, rng
+        )
+        wait_indexed(ft)
+        attributes = {str(attribute[1], "utf-8") for attribute in ft.info()["attributes"]}
+        assert SECTION_ID_KEY in attributes, attributes
+
+        expander = SectionExpander(client, index_name, max_section_chunks=256)
+        check(expander, by_section, plain_key)
+        print("merged sections match the chunks written")
+
+        keys = [key for chunks in by_section.values() for key, _ in chunks]
+        for mode in ("section", "siblings"):
+            start = time.perf_counter()
+            for _ in range(args.queries):
+                expander.expand([hit(key) for key in rng.sample(keys, 5)], mode, 512)
+            elapsed = (time.perf_counter() - start) / args.queries
+            print(f"{mode:8s} {args.queries} expansions of 5 hits   {elapsed * 1000:7.2f} ms each")
+    finally:
+        try:
+            ft.dropindex(delete_documents=True)
+        except redis.ResponseError:
+            pass
+        client.delete(writer.store_key)
+
+
+if __name__ == "__main__":
+    main()
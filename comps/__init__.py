@@ -5,8 +5,10 @@ from comps.proto.docarray import (
   DocPath,
   EmbedDoc,
     EmbedMultimodalDoc,
+    EmbedBatchDoc,
     SearchedDoc,
     SearchedMultimodalDoc,
+    SearchedBatchDoc,
     TextDoc,
 )
 from comps.core.microservice import opea_microservices, register_microservice, MicroService
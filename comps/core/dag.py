@@ -2,7 +2,6 @@
 # SPDX-License-Identifier: Apache-2.0
 
 from collections import OrderedDict, defaultdict
-from copy import deepcopy
 
 
 class DAG(object):
@@ -14,6 +13,7 @@ class DAG(object):
         if node_name in graph:
             raise KeyError("node %s already exists" % node_name)
         graph[node_name] = set()
+        self._plan = None
 
     def add_node_if_not_exists(self, node_name):
         try:
@@ -30,6 +30,7 @@ class DAG(object):
         for node, edges in graph.items():
             if node_name in edges:
                 edges.remove(node_name)
+        self._plan = None
 
     def delete_node_if_exists(self, node_name):
         try:
@@ -41,19 +42,29 @@ class DAG(object):
         graph = self.graph
         if ind_node not in graph or dep_node not in graph:
             raise KeyError("one or more nodes do not exist in graph")
-        test_graph = deepcopy(graph)
-        test_graph[ind_node].add(dep_node)
-        is_valid = self.validate(test_graph)
-        if is_valid:
-            graph[ind_node].add(dep_node)
-        else:
+        # the new edge closes a cycle iff ind_node is already reachable from dep_node
+        if ind_node == dep_node or ind_node in self._reachable(dep_node):
             raise Exception("validation error!")
+        graph[ind_node].add(dep_node)
+        self._plan = None
 
     def delete_edge(self, ind_node, dep_node):
         graph = self.graph
         if dep_node not in graph.get(ind_node, []):
             raise KeyError("this edge does not exist in graph")
         graph[ind_node].remove(dep_node)
+        self._plan = None
+
+    def _reachable(self, node):
+        graph = self.graph
+        seen = set()
+        stack = [node]
+        while stack:
+            for downstream_node in graph[stack.pop()]:
+                if downstream_node not in seen:
+                    seen.add(downstream_node)
+                    stack.append(downstream_node)
+        return seen
 
     def predecessors(self, node):
         graph = self.graph
@@ -95,6 +106,13 @@ class DAG(object):
 
     def reset_graph(self):
         self.graph = OrderedDict()
+        self._plan = None
+
+    def execution_plan(self):
+        """Return the compiled ExecutionPlan of this graph, recompiling it after edits made through the DAG API."""
+        if self._plan is None:
+            self._plan = ExecutionPlan(self)
+        return self._plan
 
     def ind_nodes(self, graph=None):
         graph = graph if graph is not None else self.graph
@@ -140,3 +158,110 @@ class DAG(object):
 
     def size(self):
         return len(self.graph)
+
+
+class ExecutionPlan(object):
+    """Immutable, index-based snapshot of a DAG.
+
+    It is compiled once and shared by all requests, nodes are referred to by their position in `nodes`.
+    """
+
+    __slots__ = ("nodes", "index", "successors", "predecessors", "order", "leaves", "ind_nodes")
+
+    def __init__(self, dag: DAG):
+        graph = dag.graph
+        self.nodes = tuple(graph)
+        self.index = {node: i for i, node in enumerate(self.nodes)}
+        self.successors = tuple(tuple(self.index[d] for d in graph[node]) for node in self.nodes)
+        predecessors = [[] for _ in self.nodes]
+        for i, downstreams in enumerate(self.successors):
+            for j in downstreams:
+                predecessors[j].append(i)
+        self.predecessors = tuple(tuple(p) for p in predecessors)
+        self.order = tuple(self.index[node] for node in dag.topological_sort(graph))
+        self.leaves = tuple(i for i, downstreams in enumerate(self.successors) if not downstreams)
+        self.ind_nodes = tuple(i for i, upstreams in enumerate(self.predecessors) if not upstreams)
+
+    def to_graph(self):
+        nodes = self.nodes
+        return OrderedDict((node, {nodes[j] for j in self.successors[i]}) for i, node in enumerate(nodes))
+
+
+class RuntimeDAG(DAG):
+    """Copy-on-write view of an ExecutionPlan for a single request.
+
+    Reads are answered from the shared plan. The first access to `graph`, which every edit goes through,
+    materializes a private graph and the view behaves like a plain DAG from then on.
+    """
+
+    def __init__(self, plan: ExecutionPlan):
+        self.plan = plan
+        self._graph = None
+        self._plan = None
+
+    @property
+    def graph(self):
+        if self._graph is None:
+            self._graph = self.plan.to_graph()
+        return self._graph
+
+    @graph.setter
+    def graph(self, graph):
+        self._graph = graph
+
+    @property
+    def modified(self):
+        return self._graph is not None
+
+    def _index(self, node):
+        try:
+            return self.plan.index[node]
+        except KeyError:
+            raise KeyError("node %s is not in graph" % node)
+
+    def predecessors(self, node):
+        if self.modified:
+            return super().predecessors(node)
+        plan = self.plan
+        if node not in plan.index:
+            return []
+        return [plan.nodes[i] for i in plan.predecessors[plan.index[node]]]
+
+    def downstream(self, node) -> list:
+        if self.modified:
+            return super().downstream(node)
+        plan = self.plan
+        return [plan.nodes[i] for i in plan.successors[self._index(node)]]
+
+    def all_downstreams(self, node):
+        if self.modified:
+            return super().all_downstreams(node)
+        plan = self.plan
+        seen = set()
+        stack = [self._index(node)]
+        while stack:
+            for j in plan.successors[stack.pop()]:
+                if j not in seen:
+                    seen.add(j)
+                    stack.append(j)
+        return [plan.nodes[i] for i in plan.order if i in seen]
+
+    def all_leaves(self):
+        if self.modified:
+            return super().all_leaves()
+        return [self.plan.nodes[i] for i in self.plan.leaves]
+
+    def ind_nodes(self, graph=None):
+        if self.modified or graph is not None:
+            return super().ind_nodes(graph)
+        return [self.plan.nodes[i] for i in self.plan.ind_nodes]
+
+    def topological_sort(self, graph=None):
+        if self.modified or graph is not None:
+            return super().topological_sort(graph)
+        return [self.plan.nodes[i] for i in self.plan.order]
+
+    def size(self):
+        if self.modified:
+            return super().size()
+        return len(self.plan.nodes)
@@ -1,9 +1,13 @@
 from fastapi import FastAPI, File, UploadFile, Form, HTTPException
 from fastapi.responses import FileResponse, RedirectResponse
 import fitz  # PyMuPDF
+import asyncio
 import json
+import multiprocessing
 import os
+import threading
 import uuid
+from concurrent.futures import ProcessPoolExecutor
 
 app = FastAPI(
     title="PDF Highlighter API",
@@ -16,6 +20,13 @@ UPLOAD_FOLDER = "uploads"
 OUTPUT_FOLDER = "output"
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+# processes matching the pages of a document, and the page count from which they are used; kept small
+# by default since every request of the service shares them
+HIGHLIGHT_PROCESSES = int(os.getenv("HIGHLIGHT_PROCESSES", min(2, os.cpu_count() or 1)))
+HIGHLIGHT_PARALLEL_PAGES = int(os.getenv("HIGHLIGHT_PARALLEL_PAGES", 32))
+
+pool = None
+pool_lock = threading.Lock()
 
 COLOR_MAP = {
     "red": (1, 0, 0),
@@ -30,6 +41,63 @@ COLOR_MAP = {
     "teal": (0, 0.5, 0.5)
 }
 
+def phrase_index(search_texts):
+    """Map the first word of each phrase to its (phrase number, lower-cased words), empty phrases skipped."""
+    index = {}
+    for idx, text in enumerate(search_texts):
+        phrase_words = tuple(word.lower() for word in text.split())
+        if phrase_words:
+            index.setdefault(phrase_words[0], []).append((idx, phrase_words))
+    return index
+
+
+def find_phrases(words, index):
+    """Boxes of every occurrence of the indexed phrases in the `words` of a page, per phrase number.
+
+    One pass over the page: only the phrases starting with the current word are compared, overlapping
+    occurrences are all reported, in reading order.
+    """
+    tokens = [word[4].strip().lower() for word in words]
+    found = {}
+    for i, token in enumerate(tokens):
+        for idx, phrase_words in index.get(token, ()):
+            end = i + len(phrase_words)
+            if end <= len(tokens) and tuple(tokens[i:end]) == phrase_words:
+                found.setdefault(idx, []).append([tuple(word[:4]) for word in words[i:end]])
+    return found
+
+
+def match_pages(file_path, page_numbers, index):
+    """find_phrases on the given pages of `file_path`, words are extracted once per page."""
+    with fitz.open(file_path) as doc:
+        return {page_num: find_phrases(doc[page_num].get_text("words"), index) for page_num in page_numbers}
+
+
+def get_pool():
+    global pool
+    with pool_lock:
+        if pool is None:
+            # spawn, MuPDF is not fork safe once a document was opened
+            pool = ProcessPoolExecutor(max_workers=HIGHLIGHT_PROCESSES, mp_context=multiprocessing.get_context("spawn"))
+        return pool
+
+
+def match_document(file_path, page_count, index):
+    """Occurrences of the phrases on every page, pages matched in parallel for large documents."""
+    pages = range(page_count)
+    if HIGHLIGHT_PROCESSES <= 1 or page_count < HIGHLIGHT_PARALLEL_PAGES:
+        return match_pages(file_path, pages, index)
+    step = -(-page_count // HIGHLIGHT_PROCESSES)
+    futures = [
+        get_pool().submit(match_pages, file_path, pages[start : start + step], index)
+        for start in range(0, page_count, step)
+    ]
+    matches = {}
+    for future in futures:
+        matches.update(future.result())
+    return matches
+
+
 def highlight_pdf(file_path, search_texts, colors=None, processing_id=None):
     try:
         doc = fitz.open(file_path)
@@ -37,49 +105,39 @@ def highlight_pdf(file_path, search_texts, colors=None, processing_id=None):
         default_colors = list(COLOR_MAP.values())
         highlight_colors = colors or default_colors
 
+        page_matches = match_document(file_path, len(doc), phrase_index(search_texts))
+
         for idx, text in enumerate(search_texts):
-            search_phrase = text.strip()
-            if not search_phrase:
+            if not text.strip():
                 continue
 
             color = highlight_colors[idx % len(highlight_colors)]
-            phrase_words = search_phrase.split()
-            phrase_len = len(phrase_words)
 
             for page_num in range(len(doc)):
                 page = doc[page_num]
-                words = page.get_text("words")
                 matches = []
 
-                for i in range(len(words) - phrase_len + 1):
-                    match = True
-                    for j in range(phrase_len):
-                        if words[i + j][4].strip().lower() != phrase_words[j].strip().lower():
-                            match = False
-                            break
-
-                    if match:
-                        bboxes = [words[i + j][:4] for j in range(phrase_len)]
-                        line_positions = [b[1] for b in bboxes]
-                        unique_lines = list(set(line_positions))
-
-                        if len(unique_lines) > 1:
-                            for bbox in bboxes:
-                                rect = fitz.Rect(*bbox)
-                                annot = page.add_highlight_annot(rect)
-                                annot.set_colors(stroke=color)
-                                annot.update()
-                                matches.append(rect)
-                        else:
-                            x0 = min(b[0] for b in bboxes)
-                            y0 = min(b[1] for b in bboxes)
-                            x1 = max(b[2] for b in bboxes)
-                            y1 = max(b[3] for b in bboxes)
-                            combined_rect = fitz.Rect(x0, y0, x1, y1)
-                            annot = page.add_highlight_annot(combined_rect)
+                for bboxes in page_matches[page_num].get(idx, ()):
+                    line_positions = [b[1] for b in bboxes]
+                    unique_lines = list(set(line_positions))
+
+                    if len(unique_lines) > 1:
+                        for bbox in bboxes:
+                            rect = fitz.Rect(*bbox)
+                            annot = page.add_highlight_annot(rect)
                             annot.set_colors(stroke=color)
                             annot.update()
-                            matches.append(combined_rect)
+                            matches.append(rect)
+                    else:
+                        x0 = min(b[0] for b in bboxes)
+                        y0 = min(b[1] for b in bboxes)
+                        x1 = max(b[2] for b in bboxes)
+                        y1 = max(b[3] for b in bboxes)
+                        combined_rect = fitz.Rect(x0, y0, x1, y1)
+                        annot = page.add_highlight_annot(combined_rect)
+                        annot.set_colors(stroke=color)
+                        annot.update()
+                        matches.append(combined_rect)
 
                 if matches:
                     highlights.append({
@@ -135,8 +193,10 @@ async def process_pdf(
             color_inputs = [c.strip().lower() for c in colors.split(",")]
             parsed_colors = [COLOR_MAP.get(c, (1, 1, 0)) for c in color_inputs]
 
-        # Process PDF
-        highlight_pdf(file_path, search_terms, parsed_colors, processing_id)
+        # Process PDF, off the event loop so that other requests are served meanwhile
+        await asyncio.get_running_loop().run_in_executor(
+            None, highlight_pdf, file_path, search_terms, parsed_colors, processing_id
+        )
 
         return {
             "message": "PDF processed successfully",
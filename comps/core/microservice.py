@@ -30,6 +30,7 @@ class MicroService(HTTPService):
         ssl_keyfile: Optional[str] = None,
         ssl_certfile: Optional[str] = None,
         endpoint: Optional[str] = "/",
+        batch_endpoint: Optional[str] = None,
         input_datatype: Type[Any] = TextDoc,
         output_datatype: Type[Any] = TextDoc,
         provider: Optional[str] = None,
@@ -47,6 +48,8 @@ class MicroService(HTTPService):
         self.host = host
         self.port = port
         self.endpoint = endpoint
+        # optional endpoint taking {"queries": [input, ...]} and returning {"results": [output, ...]}
+        self.batch_endpoint = batch_endpoint
         self.input_datatype = input_datatype
         self.output_datatype = output_datatype
         self.use_remote_service = use_remote_service
@@ -136,6 +139,12 @@ class MicroService(HTTPService):
     def endpoint_path(self):
         return f"{self.protocol}://{self.host}:{self.port}{self.endpoint}"
 
+    @property
+    def batch_endpoint_path(self):
+        if self.batch_endpoint is None:
+            return None
+        return f"{self.protocol}://{self.host}:{self.port}{self.batch_endpoint}"
+
 
 def register_microservice(
     name: str,
@@ -2,27 +2,70 @@
 # SPDX-License-Identifier: Apache-2.0
 
 import asyncio
-import copy
 import json
 import os
 import re
 import time
-from typing import Dict, List
+import weakref
+from typing import Callable, Dict, List
 
 import aiohttp
-import requests
 from fastapi.responses import StreamingResponse
-from prometheus_client import Gauge, Histogram
+from prometheus_client import Counter, Gauge, Histogram
 from pydantic import BaseModel
 
 from ..proto.docarray import LLMParams
 from .constants import ServiceType
-from .dag import DAG
+from .dag import DAG, RuntimeDAG
 from .logger import CustomLogger
 
 logger = CustomLogger("comps-core-orchestrator")
 LOGFLAG = os.getenv("LOGFLAG", False)
 
+# pooled connections from the megaservice to its microservices
+HTTP_POOL_LIMIT = int(os.getenv("HTTP_POOL_LIMIT", 100))
+HTTP_POOL_LIMIT_PER_HOST = int(os.getenv("HTTP_POOL_LIMIT_PER_HOST", 32))
+HTTP_POOL_KEEPALIVE_TIMEOUT = float(os.getenv("HTTP_POOL_KEEPALIVE_TIMEOUT", 60))
+HTTP_POOL_DNS_TTL = int(os.getenv("HTTP_POOL_DNS_TTL", 300))
+
+# attach concurrent identical requests to one in-flight execution
+SINGLE_FLIGHT = os.getenv("ORCHESTRATOR_SINGLE_FLIGHT", "false").lower() in ("true", "1", "t", "y", "yes")
+
+# seconds a coalesced stream stays open without readers for responses not iterated yet
+STREAM_FANOUT_GRACE = float(os.getenv("ORCHESTRATOR_STREAM_FANOUT_GRACE", 30))
+
+# max requests per POST to a microservice batch endpoint, e.g. /v1/retrieval/batch
+BATCH_MAX_SIZE = int(os.getenv("ORCHESTRATOR_BATCH_MAX_SIZE", 32))
+
+
+# connectors of the orchestrators' pooled sessions, sampled when the metrics are scraped
+pooled_connectors = weakref.WeakSet()
+
+
+def pool_connections(idle_only: bool = False) -> int:
+    """Open, or idle, connections of the pooled sessions.
+
+    aiohttp keeps no public pool stats, so its connector bookkeeping is read defensively, at scrape time only.
+    """
+    count = 0
+    for connector in list(pooled_connectors):
+        if connector.closed:
+            continue
+        idle = sum(len(conns) for conns in getattr(connector, "_conns", {}).values())
+        count += idle if idle_only else idle + len(getattr(connector, "_acquired", ()))
+    return count
+
+
+# tasks nobody awaits, the event loop only keeps weak references to them
+background_tasks = set()
+
+
+def run_in_background(coro) -> asyncio.Task:
+    task = asyncio.ensure_future(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
 
 class OrchestratorMetrics:
     # Because:
@@ -34,6 +77,15 @@ class OrchestratorMetrics:
     inter_token_latency = Histogram("megaservice_inter_token_latency", "Inter-token latency (histogram)")
     request_latency = Histogram("megaservice_request_latency", "Whole request/reply latency (histogram)")
     request_pending = Gauge("megaservice_request_pending", "Count of currently pending requests (gauge)")
+    pool_open = Gauge("megaservice_http_pool_open_connections", "Open connections in the HTTP client pool (gauge)")
+    pool_open.set_function(pool_connections)
+    pool_idle = Gauge("megaservice_http_pool_idle_connections", "Idle keep-alive connections in the pool (gauge)")
+    pool_idle.set_function(lambda: pool_connections(idle_only=True))
+    pool_created = Counter("megaservice_http_pool_connections_created", "Connections opened by the HTTP client pool")
+    pool_reused = Counter("megaservice_http_pool_connections_reused", "Requests sent on a kept-alive pooled connection")
+    pool_waiting = Gauge("megaservice_http_pool_waiting_requests", "Requests waiting for a pooled connection (gauge)")
+    request_coalesced = Counter("megaservice_request_coalesced", "Requests served by an identical in-flight one")
+    batch_size = Histogram("megaservice_batch_size", "Requests sent per POST to a batch endpoint (histogram)")
 
     def __init__(self) -> None:
         pass
@@ -55,6 +107,191 @@ class OrchestratorMetrics:
         else:
             self.request_pending.dec()
 
+    def trace_config(self) -> aiohttp.TraceConfig:
+        """Pool metrics counted from aiohttp's public tracing hooks, the open and idle gauges are sampled."""
+
+        async def on_created(session, context, params):
+            self.pool_created.inc()
+
+        async def on_reused(session, context, params):
+            self.pool_reused.inc()
+
+        async def on_queued(session, context, params):
+            self.pool_waiting.inc()
+
+        async def on_dequeued(session, context, params):
+            self.pool_waiting.dec()
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_connection_create_end.append(on_created)
+        trace_config.on_connection_reuseconn.append(on_reused)
+        trace_config.on_connection_queued_start.append(on_queued)
+        trace_config.on_connection_queued_end.append(on_dequeued)
+        return trace_config
+
+
+class StreamFanout:
+    """Replay one stream to every request coalesced onto it.
+
+    Chunks are buffered so that each subscriber reads the whole stream at its own pace. Whichever subscriber runs
+    out of buffered chunks pulls the next one from the source. The source stays open until every response handed
+    out has been read to the end or cancelled, so a late caller still gets the whole answer when the first one
+    disconnects. Responses that are never iterated release it after `STREAM_FANOUT_GRACE` seconds without readers.
+    """
+
+    def __init__(self, response: StreamingResponse):
+        self.source = response.body_iterator
+        self.media_type = response.media_type
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.subscribers = 0
+        self.handed_out = 0  # responses returned to callers
+        self.finished = 0  # of them read to the end or cancelled
+        self.callbacks = []  # called once the source is exhausted or closed
+        self.lock = asyncio.Lock()
+
+    def add_done_callback(self, callback):
+        if self.done:
+            callback()
+        else:
+            self.callbacks.append(callback)
+
+    def _finish(self):
+        if self.done:
+            return
+        self.done = True
+        callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            callback()
+
+    async def _close(self):
+        if not self.done:
+            self._finish()
+            await self.source.aclose()
+
+    def _close_if_idle(self):
+        if not self.done and self.subscribers == 0:
+            run_in_background(self._close())
+
+    async def _pull(self, index: int):
+        async with self.lock:
+            # another subscriber may have pulled while this one was waiting for the lock
+            if index < len(self.chunks) or self.done:
+                return
+            try:
+                self.chunks.append(await self.source.__anext__())
+            except StopAsyncIteration:
+                self._finish()
+            except Exception as e:
+                self.error = e
+                self._finish()
+
+    async def subscribe(self):
+        self.subscribers += 1
+        index = 0
+        try:
+            while True:
+                if index < len(self.chunks):
+                    yield self.chunks[index]
+                    index += 1
+                elif self.done:
+                    if self.error is not None:
+                        raise self.error
+                    break
+                else:
+                    await self._pull(index)
+        finally:
+            self.subscribers -= 1
+            self.finished += 1
+            if not self.done:
+                if self.finished >= self.handed_out:
+                    await self._close()
+                elif self.subscribers == 0:
+                    asyncio.get_running_loop().call_later(STREAM_FANOUT_GRACE, self._close_if_idle)
+
+    def response(self) -> StreamingResponse:
+        self.handed_out += 1
+        return StreamingResponse(self.subscribe(), media_type=self.media_type)
+
+
+class RequestBatcher:
+    """Send the requests a node gets within one event loop iteration as a single POST to its batch endpoint.
+
+    Nodes that become ready together, e.g. several retrievers of one DAG or the retrievers of concurrent
+    requests, are dispatched in the same iteration. A lone request still goes to the regular endpoint.
+    When a batch fails, each of its requests is retried alone on the regular endpoint, so one bad request
+    only fails its own caller. Requests go through the orchestrator's pooled session, whoever submitted first.
+    """
+
+    def __init__(
+        self,
+        endpoint: str,
+        batch_endpoint: str,
+        metrics: OrchestratorMetrics,
+        get_session: Callable[[], aiohttp.ClientSession],
+    ):
+        self.endpoint = endpoint
+        self.batch_endpoint = batch_endpoint
+        self.metrics = metrics
+        self.get_session = get_session
+        self.pending = []  # [(inputs, future)]
+        self.supported = True  # cleared when the service does not expose the batch endpoint
+
+    async def submit(self, inputs: Dict) -> Dict:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((inputs, future))
+        if len(self.pending) == 1:
+            loop.call_soon(self._flush)
+        return await future
+
+    def _flush(self):
+        pending, self.pending = self.pending, []
+        for i in range(0, len(pending), BATCH_MAX_SIZE):
+            run_in_background(self._send(pending[i : i + BATCH_MAX_SIZE]))
+
+    async def _post(self, endpoint: str, inputs: Dict, missing_ok: bool = False):
+        """POST `inputs`, None when `missing_ok` and the service has no such endpoint.
+
+        Raises aiohttp.ClientResponseError on any other error status.
+        """
+        async with self.get_session().post(endpoint, json=inputs) as response:
+            if missing_ok and response.status in (404, 405):
+                return None
+            response.raise_for_status()
+            return await response.json()
+
+    async def _send_one(self, inputs: Dict, future: asyncio.Future):
+        try:
+            result = await self._post(self.endpoint, inputs)
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+        else:
+            if not future.done():
+                future.set_result(result)
+
+    async def _send(self, batch: List):
+        if len(batch) > 1 and self.supported:
+            try:
+                data = await self._post(self.batch_endpoint, {"queries": [i for i, _ in batch]}, missing_ok=True)
+                if data is None:
+                    logger.error(f"{self.batch_endpoint} not available, fall back to single requests")
+                    self.supported = False
+                else:
+                    results = data.get("results") if isinstance(data, dict) else None
+                    if not isinstance(results, list) or len(results) != len(batch):
+                        raise ValueError(f"{self.batch_endpoint} replied without one result per query")
+                    self.metrics.batch_size.observe(len(batch))
+                    for (_, future), result in zip(batch, results):
+                        if not future.done():
+                            future.set_result(result)
+                    return
+            except Exception as e:
+                logger.error(f"{self.batch_endpoint} failed, retrying its {len(batch)} requests alone: {e}")
+        await asyncio.gather(*(self._send_one(inputs, future) for inputs, future in batch))
+
 
 class ServiceOrchestrator(DAG):
     """Manage 1 or N micro services in a DAG through Python API."""
@@ -62,12 +299,44 @@ class ServiceOrchestrator(DAG):
     def __init__(self) -> None:
         self.metrics = OrchestratorMetrics()
         self.services = {}  # all services, id -> service
+        self.session = None  # pooled aiohttp session, created lazily inside the serving event loop
+        self.in_flight = {}  # request key -> task of the execution shared by identical requests
+        self.batchers = {}  # service name -> RequestBatcher, for services with a batch endpoint
         super().__init__()
 
+    def get_session(self) -> aiohttp.ClientSession:
+        """Return the long-lived pooled session shared by all requests of this orchestrator."""
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=HTTP_POOL_LIMIT,
+                limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+                keepalive_timeout=HTTP_POOL_KEEPALIVE_TIMEOUT,
+                use_dns_cache=True,
+                ttl_dns_cache=HTTP_POOL_DNS_TTL,
+            )
+            pooled_connectors.add(connector)
+            self.session = aiohttp.ClientSession(
+                connector=connector,
+                trust_env=True,
+                timeout=aiohttp.ClientTimeout(total=1000),
+                trace_configs=[self.metrics.trace_config()],
+            )
+        return self.session
+
+    async def close(self):
+        """Close the pooled session, call on service shutdown."""
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+        self.session = None
+
     def add(self, service):
         if service.name not in self.services:
             self.services[service.name] = service
             self.add_node_if_not_exists(service.name)
+            if getattr(service, "batch_endpoint", None):
+                self.batchers[service.name] = RequestBatcher(
+                    service.endpoint_path, service.batch_endpoint_path, self.metrics, self.get_session
+                )
         else:
             raise Exception(f"Service {service.name} already exists!")
         return self
@@ -80,78 +349,152 @@ class ServiceOrchestrator(DAG):
             logger.error(e)
             return False
 
+    def flight_key(self, initial_inputs: Dict | BaseModel, llm_parameters: LLMParams, kwargs: Dict) -> str:
+        """Key of a request built from its serializable fields only.
+
+        Helpers passed by the megaservice, e.g. caches, are left out so that identical requests get the same
+        key whatever objects they carry.
+        """
+        skip = object()
+
+        def normalize(value):
+            if isinstance(value, BaseModel):
+                value = value.dict(exclude={"id"})
+            if isinstance(value, dict):
+                items = ((str(k), normalize(v)) for k, v in value.items())
+                return {k: v for k, v in items if v is not skip}
+            if isinstance(value, (list, tuple)):
+                return [v for v in (normalize(v) for v in value) if v is not skip]
+            if isinstance(value, str):
+                return " ".join(value.split())
+            if value is None or isinstance(value, (bool, int, float)):
+                return value
+            return skip
+
+        return json.dumps([normalize(initial_inputs), normalize(llm_parameters), normalize(kwargs)], sort_keys=True)
+
     async def schedule(self, initial_inputs: Dict | BaseModel, llm_parameters: LLMParams = LLMParams(), **kwargs):
+        if not SINGLE_FLIGHT:
+            return await self._schedule(initial_inputs, llm_parameters, **kwargs)
+
+        key = self.flight_key(initial_inputs, llm_parameters, kwargs)
+        flight = self.in_flight.get(key)
+        if flight is None:
+            flight = asyncio.ensure_future(self._schedule_shared(initial_inputs, llm_parameters, **kwargs))
+            self.in_flight[key] = flight
+            flight.add_done_callback(lambda _: self._flight_done(key, flight))
+        else:
+            self.metrics.request_coalesced.inc()
+            if LOGFLAG:
+                logger.info("attach to an identical in-flight request")
+
+        # shielded so that a caller going away does not cancel the execution other callers wait on
+        result_dict, runtime_graph = await asyncio.shield(flight)
+        result_dict = {
+            node: response.response() if isinstance(response, StreamFanout) else response
+            for node, response in result_dict.items()
+        }
+        return result_dict, runtime_graph
+
+    def _release_flight(self, key: str, flight: asyncio.Future):
+        if self.in_flight.get(key) is flight:
+            del self.in_flight[key]
+
+    def _flight_done(self, key: str, flight: asyncio.Future):
+        """Keep coalescing onto a streamed answer until its stream is exhausted or closed."""
+        fanouts = []
+        if not flight.cancelled() and flight.exception() is None:
+            fanouts = [response for response in flight.result()[0].values() if isinstance(response, StreamFanout)]
+        fanouts = [fanout for fanout in fanouts if not fanout.done]
+        if not fanouts:
+            self._release_flight(key, flight)
+        for fanout in fanouts:
+            fanout.add_done_callback(lambda: self._release_flight(key, flight))
+
+    async def _schedule_shared(self, initial_inputs: Dict | BaseModel, llm_parameters: LLMParams, **kwargs):
+        result_dict, runtime_graph = await self._schedule(initial_inputs, llm_parameters, **kwargs)
+        for node, response in result_dict.items():
+            if isinstance(response, StreamingResponse):
+                result_dict[node] = StreamFanout(response)
+        return result_dict, runtime_graph
+
+    async def _schedule(self, initial_inputs: Dict | BaseModel, llm_parameters: LLMParams = LLMParams(), **kwargs):
         req_start = time.time()
         self.metrics.pending_update(True)
 
         result_dict = {}
-        runtime_graph = DAG()
-        runtime_graph.graph = copy.deepcopy(self.graph)
+        runtime_graph = RuntimeDAG(self.execution_plan())
         if LOGFLAG:
             logger.info(initial_inputs)
 
-        timeout = aiohttp.ClientTimeout(total=1000)
-        async with aiohttp.ClientSession(trust_env=True, timeout=timeout) as session:
-            pending = {
-                asyncio.create_task(
-                    self.execute(session, req_start, node, initial_inputs, runtime_graph, llm_parameters, **kwargs)
-                )
-                for node in self.ind_nodes()
-            }
-            ind_nodes = self.ind_nodes()
-
-            while pending:
-                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
-                for done_task in done:
-                    response, node = await done_task
-                    result_dict[node] = response
-
-                    # traverse the current node's downstream nodes and execute if all one's predecessors are finished
-                    downstreams = runtime_graph.downstream(node)
-
-                    # remove all the black nodes that are skipped to be forwarded to
-                    if not isinstance(response, StreamingResponse) and "downstream_black_list" in response:
-                        for black_node in response["downstream_black_list"]:
-                            for downstream in reversed(downstreams):
-                                try:
-                                    if re.findall(black_node, downstream):
-                                        if LOGFLAG:
-                                            logger.info(f"skip forwardding to {downstream}...")
-                                        runtime_graph.delete_edge(node, downstream)
-                                        downstreams.remove(downstream)
-                                except re.error as e:
-                                    logger.error("Pattern invalid! Operation cancelled.")
-                            if len(downstreams) == 0 and llm_parameters.stream:
-                                # turn the response to a StreamingResponse
-                                # to make the response uniform to UI
-                                def fake_stream(text):
-                                    yield "data: b'" + text + "'\n\n"
-                                    yield "data: [DONE]\n\n"
-
-                                result_dict[node] = StreamingResponse(
-                                    fake_stream(response["text"]), media_type="text/event-stream"
-                                )
-
-                    for d_node in downstreams:
-                        if all(i in result_dict for i in runtime_graph.predecessors(d_node)):
-                            inputs = self.process_outputs(runtime_graph.predecessors(d_node), result_dict)
-                            pending.add(
-                                asyncio.create_task(
-                                    self.execute(
-                                        session, req_start, d_node, inputs, runtime_graph, llm_parameters, **kwargs
-                                    )
+        session = self.get_session()
+        pending = {
+            asyncio.create_task(
+                self.execute(session, req_start, node, initial_inputs, runtime_graph, llm_parameters, **kwargs)
+            )
+            for node in runtime_graph.ind_nodes()
+        }
+        ind_nodes = runtime_graph.ind_nodes()
+
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for done_task in done:
+                response, node = await done_task
+                result_dict[node] = response
+
+                # traverse the current node's downstream nodes and execute if all one's predecessors are finished
+                downstreams = runtime_graph.downstream(node)
+
+                # remove all the black nodes that are skipped to be forwarded to
+                if not isinstance(response, StreamingResponse) and "downstream_black_list" in response:
+                    for black_node in response["downstream_black_list"]:
+                        for downstream in reversed(downstreams):
+                            try:
+                                if re.findall(black_node, downstream):
+                                    if LOGFLAG:
+                                        logger.info(f"skip forwardding to {downstream}...")
+                                    runtime_graph.delete_edge(node, downstream)
+                                    downstreams.remove(downstream)
+                            except re.error as e:
+                                logger.error("Pattern invalid! Operation cancelled.")
+                        if (
+                            len(downstreams) == 0
+                            and llm_parameters.stream
+                            and not isinstance(result_dict[node], StreamingResponse)
+                        ):
+                            # turn the response to a StreamingResponse
+                            # to make the response uniform to UI
+                            def fake_stream(text):
+                                yield "data: b'" + text + "'\n\n"
+                                yield "data: [DONE]\n\n"
+
+                            result_dict[node] = StreamingResponse(
+                                fake_stream(response["text"]), media_type="text/event-stream"
+                            )
+                            # no llm stream will release the pending request
+                            self.metrics.pending_update(False)
+
+                for d_node in downstreams:
+                    if all(i in result_dict for i in runtime_graph.predecessors(d_node)):
+                        inputs = self.process_outputs(runtime_graph.predecessors(d_node), result_dict)
+                        pending.add(
+                            asyncio.create_task(
+                                self.execute(
+                                    session, req_start, d_node, inputs, runtime_graph, llm_parameters, **kwargs
                                 )
                             )
-        nodes_to_keep = []
-        for i in ind_nodes:
-            nodes_to_keep.append(i)
-            nodes_to_keep.extend(runtime_graph.all_downstreams(i))
+                        )
+        # an unedited plan only holds nodes reachable from the independent nodes, so there is nothing to prune
+        if runtime_graph.modified:
+            nodes_to_keep = set(ind_nodes)
+            for i in ind_nodes:
+                nodes_to_keep.update(runtime_graph.all_downstreams(i))
 
-        all_nodes = list(runtime_graph.graph.keys())
+            all_nodes = list(runtime_graph.graph.keys())
 
-        for node in all_nodes:
-            if node not in nodes_to_keep:
-                runtime_graph.delete_node_if_exists(node)
+            for node in all_nodes:
+                if node not in nodes_to_keep:
+                    runtime_graph.delete_node_if_exists(node)
 
         if not llm_parameters.stream:
             self.metrics.pending_update(False)
@@ -190,17 +533,14 @@ class ServiceOrchestrator(DAG):
         inputs = self.align_inputs(inputs, cur_node, runtime_graph, llm_parameters_dict, **kwargs)
 
         if is_llm_vlm and llm_parameters.stream:
-            # Still leave to sync requests.post for StreamingResponse
+            # the stream is consumed after schedule() returns, the generator hands the connection back to the pool
             if LOGFLAG:
                 logger.info(inputs)
-            response = requests.post(
-                url=endpoint,
-                data=json.dumps(inputs),
-                headers={"Content-type": "application/json"},
-                proxies={"http": None},
-                stream=True,
-                timeout=1000,
-            )
+            try:
+                response = await session.post(endpoint, json=inputs)
+            except Exception:
+                self.metrics.pending_update(False)
+                raise
             downstream = runtime_graph.downstream(cur_node)
             if downstream:
                 assert len(downstream) == 1, "Not supported multiple stream downstreams yet!"
@@ -208,39 +548,41 @@ class ServiceOrchestrator(DAG):
                 hitted_ends = [".", "?", "!", "。", "，", "！"]
                 downstream_endpoint = self.services[downstream[0]].endpoint_path
 
-            def generate():
+            async def generate():
                 token_start = req_start
-                if response:
-                    # response.elapsed = time until first headers received
-                    buffered_chunk_str = ""
-                    is_first = True
-                    for chunk in response.iter_content(chunk_size=None):
-                        if chunk:
-                            if downstream:
-                                chunk = chunk.decode("utf-8")
-                                buffered_chunk_str += self.extract_chunk_str(chunk)
-                                is_last = chunk.endswith("[DONE]\n\n")
-                                if (buffered_chunk_str and buffered_chunk_str[-1] in hitted_ends) or is_last:
-                                    res = requests.post(
-                                        url=downstream_endpoint,
-                                        data=json.dumps({"text": buffered_chunk_str}),
-                                        proxies={"http": None},
-                                    )
-                                    res_json = res.json()
-                                    if "text" in res_json:
-                                        res_txt = res_json["text"]
-                                    else:
-                                        raise Exception("Other response types not supported yet!")
-                                    buffered_chunk_str = ""  # clear
-                                    yield from self.token_generator(
-                                        res_txt, token_start, is_first=is_first, is_last=is_last
-                                    )
-                                    token_start = time.time()
-                            else:
-                                token_start = self.metrics.token_update(token_start, is_first)
-                                yield chunk
-                            is_first = False
-                    self.metrics.request_update(req_start)
+                try:
+                    if response.ok:
+                        buffered_chunk_str = ""
+                        is_first = True
+                        async for chunk in response.content.iter_any():
+                            if chunk:
+                                if downstream:
+                                    chunk = chunk.decode("utf-8")
+                                    buffered_chunk_str += self.extract_chunk_str(chunk)
+                                    is_last = chunk.endswith("[DONE]\n\n")
+                                    if (buffered_chunk_str and buffered_chunk_str[-1] in hitted_ends) or is_last:
+                                        async with session.post(
+                                            downstream_endpoint, json={"text": buffered_chunk_str}
+                                        ) as res:
+                                            res_json = await res.json()
+                                        if "text" in res_json:
+                                            res_txt = res_json["text"]
+                                        else:
+                                            raise Exception("Other response types not supported yet!")
+                                        buffered_chunk_str = ""  # clear
+                                        for token in self.token_generator(
+                                            res_txt, token_start, is_first=is_first, is_last=is_last
+                                        ):
+                                            yield token
+                                        token_start = time.time()
+                                else:
+                                    token_start = self.metrics.token_update(token_start, is_first)
+                                    yield chunk
+                                is_first = False
+                        self.metrics.request_update(req_start)
+                finally:
+                    # also runs when the client disconnects mid-stream
+                    response.release()
                     self.metrics.pending_update(False)
 
             return (
@@ -256,6 +598,12 @@ class ServiceOrchestrator(DAG):
                 input_data = {k: v for k, v in input_data.items() if v is not None}
             else:
                 input_data = inputs
+            if cur_node in self.batchers:
+                data = await self.batchers[cur_node].submit(input_data)
+                # post process
+                data = self.align_outputs(data, cur_node, inputs, runtime_graph, llm_parameters_dict, **kwargs)
+                return data, cur_node
+
             async with session.post(endpoint, json=input_data) as response:
                 if response.content_type == "audio/wav":
                     audio_data = await response.read()
@@ -268,7 +616,7 @@ class ServiceOrchestrator(DAG):
                     # post process
                     data = self.align_outputs(data, cur_node, inputs, runtime_graph, llm_parameters_dict, **kwargs)
 
-                return data, cur_node
+            return data, cur_node
 
     def align_inputs(self, inputs, *args, **kwargs):
         """Override this method in megaservice definition."""
@@ -0,0 +1,299 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+import redis
+
+from .logger import CustomLogger
+
+logger = CustomLogger("semantic_cache")
+LOGFLAG = os.getenv("LOGFLAG", False)
+
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "false").lower() in ("true", "1", "t", "y", "yes")
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", 0.97))
+SEMANTIC_CACHE_TTL = int(os.getenv("SEMANTIC_CACHE_TTL", 86400))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", 4096))
+SEMANTIC_CACHE_MAX_ENTRIES_PER_SCOPE = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES_PER_SCOPE", 256))
+# seconds a bucket is used before fetching the entries other workers stored and checking its generation
+SEMANTIC_CACHE_REFRESH = float(os.getenv("SEMANTIC_CACHE_REFRESH", 1))
+SEMANTIC_CACHE_REDIS_URL = os.getenv("SEMANTIC_CACHE_REDIS_URL", os.getenv("REDIS_URL"))
+
+KEY_PREFIX = "answer-cache:"
+ALL_FILES = "*all*"
+
+
+def generation_key(file_name: str) -> str:
+    return f"{KEY_PREFIX}{file_name}:gen"
+
+
+def entries_key(file_name: str, scope: str) -> str:
+    return f"{KEY_PREFIX}{file_name}:{scope}:entries"
+
+
+def vectors_key(file_name: str, scope: str) -> str:
+    return f"{KEY_PREFIX}{file_name}:{scope}:vectors"
+
+
+def order_key(file_name: str, scope: str) -> str:
+    return f"{KEY_PREFIX}{file_name}:{scope}:order"
+
+
+def sequence_key(file_name: str, scope: str) -> str:
+    return f"{KEY_PREFIX}{file_name}:{scope}:seq"
+
+
+# store an entry under the next sequence number of its scope and trim the oldest entries, atomically so that
+# a sequence number is only visible with its entry; KEYS are the entries, vectors, order and sequence keys,
+# ARGV the field, the JSON entry, the packed vector, the TTL and the max entries of the scope
+WRITE_SCRIPT = """
+local seq = redis.call('incr', KEYS[4])
+redis.call('hset', KEYS[1], ARGV[1], ARGV[2])
+redis.call('hset', KEYS[2], ARGV[1], ARGV[3])
+redis.call('zadd', KEYS[3], seq, ARGV[1])
+for i = 1, 4 do
+    redis.call('expire', KEYS[i], ARGV[4])
+end
+local stale = redis.call('zrange', KEYS[3], 0, -tonumber(ARGV[5]) - 1)
+if #stale > 0 then
+    redis.call('zrem', KEYS[3], unpack(stale))
+    redis.call('hdel', KEYS[1], unpack(stale))
+    redis.call('hdel', KEYS[2], unpack(stale))
+end
+return seq
+"""
+
+
+def invalidate_file(client: redis.Redis, file_name: Optional[str] = None):
+    """Invalidate the cached answers of `file_name`, or of every file when it is None.
+
+    Dataprep calls this whenever a file is re-ingested or deleted. Entries are tagged with the generation
+    they were stored under, so bumping the counter retires them in Redis and in every megaservice process.
+    """
+    try:
+        client.incr(generation_key(file_name if file_name is not None else ALL_FILES))
+    except redis.RedisError as e:
+        logger.error(f"[ semantic cache ] fail to invalidate {file_name}: {e}")
+
+
+def make_scope(*params: Dict) -> str:
+    """Hash the request parameters that change the answer, e.g. LLM and retriever params."""
+    payload = json.dumps(params, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def _normalize(embedding) -> np.ndarray:
+    vector = np.asarray(embedding, dtype=np.float32).ravel()
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class SemanticCache:
+    """Answer cache keyed by file, request parameters and query embedding.
+
+    A lookup hits when a stored query of the same file and scope has a cosine similarity of at least
+    `threshold` with the new one. Lookups and stores only touch the in-process tier, they never wait on
+    Redis. When a Redis URL is configured, entries are also written there from the default executor so all
+    megaservice workers share them, and each (file, scope) bucket is refreshed in the background at most
+    every `refresh` seconds: entries stored by other workers since the last refresh are fetched, and the
+    bucket is reloaded only when dataprep bumped the generation of the file.
+
+    Per scope, Redis holds a hash of JSON entries, a hash of their vectors as packed float32 and a ZSET of
+    their sequence numbers, taken from a counter of the scope incremented by Redis, used to fetch the entries
+    written since the last sequence number seen and to trim the oldest ones. Unlike the clocks of the
+    workers, the counter never gives an entry a position before one already read.
+    """
+
+    def __init__(
+        self,
+        threshold: float = SEMANTIC_CACHE_THRESHOLD,
+        ttl: int = SEMANTIC_CACHE_TTL,
+        max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES,
+        max_entries_per_scope: int = SEMANTIC_CACHE_MAX_ENTRIES_PER_SCOPE,
+        redis_url: Optional[str] = SEMANTIC_CACHE_REDIS_URL,
+        refresh: float = SEMANTIC_CACHE_REFRESH,
+    ):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_entries_per_scope = max_entries_per_scope
+        self.refresh = refresh
+        self.client = redis.Redis.from_url(redis_url) if redis_url else None
+        self._write_script = self.client.register_script(WRITE_SCRIPT) if self.client is not None else None
+        # (file_name, scope) -> {"generation", "checked", "seq", "entries": {field: entry}}, least recently used
+        # first, "seq" being the last sequence number read from Redis
+        self.local = OrderedDict()
+        self.size = 0
+        # buckets with a refresh in progress
+        self.refreshing = set()
+        # refreshes and writes running in the executor, nobody awaits them
+        self.background = set()
+
+    def _set_bucket(
+        self, key, generation: str, entries: Dict[str, Dict], checked: Optional[float] = None, seq: int = 0
+    ):
+        old = self.local.pop(key, None)
+        if old:
+            self.size -= len(old["entries"])
+        if len(entries) > self.max_entries_per_scope:
+            newest = sorted(entries.values(), key=lambda entry: entry["created"])[-self.max_entries_per_scope :]
+            entries = {entry["field"]: entry for entry in newest}
+        checked = time.time() if checked is None else checked
+        self.local[key] = {"generation": generation, "checked": checked, "seq": seq, "entries": entries}
+        self.size += len(entries)
+        while self.size > self.max_entries and self.local:
+            _, evicted = self.local.popitem(last=False)
+            self.size -= len(evicted["entries"])
+
+    def _fetch(self, file_name: str, scope: str, generation: Optional[str], after: Optional[int]):
+        """Read the generation of `file_name` and the entries of the scope written after sequence number `after`.
+
+        All the entries are read when the generation is not `generation`, or when the counter of the scope
+        went back, its keys having expired. Runs in the default executor.
+        """
+        keys = (generation_key(ALL_FILES), generation_key(file_name), sequence_key(file_name, scope))
+        all_gen, file_gen, seq = self.client.mget(*keys)
+        current = f"{int(all_gen or 0)}:{int(file_gen or 0)}"
+        full = current != generation or after is None or int(seq or 0) < after
+        if full:
+            fields = self.client.zrange(order_key(file_name, scope), 0, -1, withscores=True)
+        else:
+            fields = self.client.zrangebyscore(order_key(file_name, scope), f"({after}", "+inf", withscores=True)
+        last = max((int(score) for _, score in fields), default=0 if full else after)
+        fields = [field for field, _ in fields]
+        entries = {}
+        if fields:
+            pipe = self.client.pipeline(transaction=False)
+            pipe.hmget(entries_key(file_name, scope), fields)
+            pipe.hmget(vectors_key(file_name, scope), fields)
+            metas, vectors = pipe.execute()
+            for field, meta, vector in zip(fields, metas, vectors):
+                if meta is None or vector is None:
+                    continue
+                entry = json.loads(meta)
+                if entry["generation"] == current:
+                    entry["field"] = field.decode("utf-8")
+                    entry["vector"] = np.frombuffer(vector, dtype=np.float32)
+                    entries[entry["field"]] = entry
+        return current, full, entries, last
+
+    def _apply(self, key, result):
+        generation, full, entries, seq = result
+        bucket = self.local.get(key)
+        if not full and bucket is not None and bucket["generation"] == generation:
+            entries = dict(bucket["entries"], **entries)
+        self._set_bucket(key, generation, entries, seq=seq)
+
+    def _refresh(self, file_name: str, scope: str):
+        key = (file_name, scope)
+        if self.client is None or key in self.refreshing:
+            return
+        bucket = self.local.get(key)
+        generation, after = None, None
+        if bucket is not None:
+            generation, after = bucket["generation"], bucket["seq"]
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # outside the service, e.g. scripts
+            try:
+                self._apply(key, self._fetch(file_name, scope, generation, after))
+            except redis.RedisError as e:
+                logger.error(f"[ semantic cache ] fail to refresh entries of {file_name}: {e}")
+            return
+
+        def done(future):
+            self.refreshing.discard(key)
+            try:
+                self._apply(key, future.result())
+            except redis.RedisError as e:
+                logger.error(f"[ semantic cache ] fail to refresh entries of {file_name}: {e}")
+
+        self.refreshing.add(key)
+        self._in_background(loop.run_in_executor(None, self._fetch, file_name, scope, generation, after), done)
+
+    def _in_background(self, future: asyncio.Future, callback=None):
+        self.background.add(future)
+        future.add_done_callback(self.background.discard)
+        if callback is not None:
+            future.add_done_callback(callback)
+
+    def _best(self, entries: Dict[str, Dict], query: np.ndarray) -> Optional[Dict]:
+        now = time.time()
+        fresh = [entry for entry in entries.values() if now - entry["created"] < self.ttl]
+        if not fresh:
+            return None
+        scores = np.stack([entry["vector"] for entry in fresh]) @ query
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            return None
+        return fresh[best]
+
+    def lookup(self, file_name: str, scope: str, embedding) -> Optional[Dict]:
+        """Return {"answer", "sources"} of the closest cached query, or None on a miss."""
+        key = (file_name, scope)
+        bucket = self.local.get(key)
+        if bucket is None or time.time() - bucket["checked"] > self.refresh:
+            # answers stored by other workers are found by the next lookups
+            self._refresh(file_name, scope)
+            bucket = self.local.get(key)
+        hit = None
+        if bucket is not None:
+            self.local.move_to_end(key)
+            hit = self._best(bucket["entries"], _normalize(embedding))
+        if LOGFLAG:
+            logger.info(f"[ semantic cache ] {'hit' if hit else 'miss'} for {file_name}")
+        if hit is None:
+            return None
+        return {"answer": hit["answer"], "sources": hit["sources"]}
+
+    def _write(self, file_name: str, scope: str, entry: Dict):
+        """Store `entry` in Redis and trim the oldest entries of its scope. Runs in the default executor."""
+        keys = [
+            entries_key(file_name, scope),
+            vectors_key(file_name, scope),
+            order_key(file_name, scope),
+            sequence_key(file_name, scope),
+        ]
+        meta = {name: entry[name] for name in ("answer", "sources", "created", "generation")}
+        args = [entry["field"], json.dumps(meta), entry["vector"].tobytes(), self.ttl, self.max_entries_per_scope]
+        try:
+            self._write_script(keys=keys, args=args)
+        except redis.RedisError as e:
+            logger.error(f"[ semantic cache ] fail to store entry of {file_name}: {e}")
+
+    def store(self, file_name: str, scope: str, embedding, answer: str, sources: List[Dict]):
+        key = (file_name, scope)
+        bucket = self.local.get(key)
+        if bucket is None:
+            if self.client is not None:
+                # the generation of the file is not known yet, the refresh started by lookup() is still running
+                return
+            bucket = {"generation": "0:0", "checked": time.time(), "seq": 0, "entries": {}}
+        vector = _normalize(embedding)
+        # coalesced requests store the same answer once each, keep a single entry per query
+        field = hashlib.sha1(vector.tobytes()).hexdigest()
+        entry = {
+            "field": field,
+            "answer": answer,
+            "sources": sources,
+            "created": time.time(),
+            "generation": bucket["generation"],
+            "vector": vector,
+        }
+        entries = dict(bucket["entries"], **{field: entry})
+        self._set_bucket(key, bucket["generation"], entries, bucket["checked"], bucket["seq"])
+
+        if self.client is None:
+            return
+        try:
+            self._in_background(asyncio.get_running_loop().run_in_executor(None, self._write, file_name, scope, entry))
+        except RuntimeError:
+            self._write(file_name, scope, entry)
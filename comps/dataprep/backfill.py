@@ -0,0 +1,82 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+"""Bulk ingestion of a local directory of PDFs, e.g. a monthly backfill of circulars.
+
+Files are parsed in parallel processes and share the embedding batches, like uploads to the dataprep
+service. Files already ingested are skipped, so an interrupted backfill can simply be run again.
+
+Run from comps/dataprep, next to or inside the dataprep container:
+    python backfill.py ../../ui/public/pdfs --parser-type lightweight
+"""
+
+import argparse
+import shutil
+import sys
+import time
+from pathlib import Path
+
+from config import PARSE_PROCESSES
+from ingestion import ParallelIngestor, file_registry
+from utils import create_upload_folder, encode_filename
+
+from comps import DocPath
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("directory", type=Path, help="directory holding the PDFs")
+    parser.add_argument("--parser-type", default="lightweight", choices=["lightweight", "default"])
+    parser.add_argument("--processes", type=int, default=PARSE_PROCESSES, help="parallel parsing processes")
+    parser.add_argument("--chunk-size", type=int, default=1500)
+    parser.add_argument("--chunk-overlap", type=int, default=100)
+    parser.add_argument("--recursive", action="store_true", help="also ingest PDFs of subdirectories")
+    parser.add_argument(
+        "--upload-folder",
+        default="./uploaded_files/",
+        help="folder of the dataprep service the files are copied to, so that they can be deleted later",
+    )
+    args = parser.parse_args()
+    # files ingested before the registry existed
+    file_registry.migrate_file_keys()
+
+    pattern = "**/*.pdf" if args.recursive else "*.pdf"
+    files = sorted(p for p in args.directory.glob(pattern) if p.is_file())
+    create_upload_folder(args.upload_folder)
+
+    doc_paths = []
+    skipped = 0
+    for file in files:
+        encode_file = encode_filename(file.name)
+        if file_registry.exists(encode_file):
+            skipped += 1
+            continue
+        save_path = str(Path(args.upload_folder) / encode_file)
+        shutil.copyfile(file, save_path)
+        doc_paths.append(DocPath(path=save_path, chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap))
+    print(f"{len(files)} PDFs found, {skipped} already ingested, {len(doc_paths)} to ingest")
+
+    done = 0
+    start = time.time()
+
+    def on_done(path, error, seconds):
+        nonlocal done
+        done += 1
+        status = f"failed: {error}" if error else "ok"
+        print(f"[{done}/{len(doc_paths)}] {Path(path).name} {seconds:.1f}s {status}", flush=True)
+
+    ingestor = ParallelIngestor(processes=args.processes)
+    try:
+        errors = ingestor.ingest_many(args.parser_type, doc_paths, on_done=on_done)
+    finally:
+        ingestor.shutdown()
+
+    failed = [path for path, error in errors.items() if error]
+    elapsed = time.time() - start
+    rate = len(doc_paths) / elapsed if elapsed else 0.0
+    print(f"ingested {len(doc_paths) - len(failed)} files in {elapsed:.1f}s ({rate:.2f} files/s), {len(failed)} failed")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,200 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import hashlib
+import re
+import unicodedata
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+import redis
+from config import EMBED_BATCH_SIZE, INDEX_NAME
+from redis.commands.search.field import NumericField, TagField, TextField, VectorField
+from redis.commands.search.indexDefinition import IndexDefinition, IndexType
+
+from comps import CustomLogger
+
+logger = CustomLogger("chunk_writer")
+
+# field names of the langchain Redis vectorstore, read back as-is by the retriever
+CONTENT_KEY = "content"
+VECTOR_KEY = "content_vector"
+
+# where a chunk comes from: heading path of its section, section id and position in the file
+SECTION_KEY = "section"
+SECTION_ID_KEY = "section_id"
+CHUNK_INDEX_KEY = "chunk_index"
+# joins the headings of a section path
+SECTION_SEPARATOR = " > "
+
+# hash of chunk hash -> key of a stored chunk with that text, per index and embedding model
+EMBEDDING_STORE_PREFIX = "chunk-embeddings:"
+
+
+def normalize_chunk(text: str) -> str:
+    """Text of a chunk as compared across documents: unicode compatibility forms and collapsed whitespace."""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFKC", text)).strip()
+
+
+def chunk_hash(text: str) -> str:
+    return hashlib.sha256(normalize_chunk(text).encode("utf-8")).hexdigest()[:32]
+
+
+class ChunkWriter:
+    """Embed the chunks of a file and write them to the vector index.
+
+    Created once per service so the embedder and the Redis connection pool are shared by every file.
+    The hashes and the index use the layout of langchain's Redis vectorstore (content, content_vector and
+    file_name fields), all hashes of a file go out in one pipeline.
+
+    Chunk keys are content addressed, doc:<index>:<file hash>:<chunk hash>, and an embedding store maps
+    each chunk hash to a stored chunk with the same normalized text. Re-issued documents, e.g. yearly
+    master circulars, reuse the vectors of the chunks already ingested instead of embedding them again.
+    """
+
+    def __init__(
+        self,
+        embedder,
+        redis_pool: redis.ConnectionPool,
+        index_name: str = INDEX_NAME,
+        embed_batch_size: int = EMBED_BATCH_SIZE,
+        model: str = "",
+    ):
+        self.embedder = embedder
+        self.redis_pool = redis_pool
+        self.index_name = index_name
+        self.key_prefix = f"doc:{index_name}"
+        self.embed_batch_size = embed_batch_size
+        # vectors of another embedding model must not be reused
+        model_tag = hashlib.sha1(model.encode("utf-8")).hexdigest()[:12]
+        self.store_key = f"{EMBEDDING_STORE_PREFIX}{index_name}:{model_tag}"
+
+    def section_fields(self):
+        return (TextField(SECTION_KEY), TagField(SECTION_ID_KEY), NumericField(CHUNK_INDEX_KEY))
+
+    def add_section_fields(self, ft, info):
+        """Add the section fields to an index created before they existed, FT.ALTER indexes the stored chunks."""
+        indexed = set()
+        for attribute in info.get("attributes", []):
+            attribute = [a.decode("utf-8") if isinstance(a, bytes) else a for a in attribute]
+            # [identifier, <name>, attribute, <alias>, type, <type>, ...]
+            indexed.add(dict(zip(attribute[::2], attribute[1::2])).get("identifier"))
+        for field in self.section_fields():
+            if field.name not in indexed:
+                ft.alter_schema_add(field)
+                logger.info(f"[ chunk writer ] field {field.name} added to index {self.index_name}")
+
+    def ensure_index(self, client: redis.Redis, dim: int):
+        """Create the vector index unless it exists, e.g. on first ingest or after deleting all files."""
+        ft = client.ft(self.index_name)
+        try:
+            info = ft.info()
+        except redis.ResponseError:
+            info = None
+        if info is not None:
+            self.add_section_fields(ft, info)
+            return
+        schema = (
+            TextField(CONTENT_KEY),
+            VectorField(VECTOR_KEY, "FLAT", {"TYPE": "FLOAT32", "DIM": dim, "DISTANCE_METRIC": "COSINE"}),
+            TextField("file_name"),
+        ) + self.section_fields()
+        try:
+            ft.create_index(schema, definition=IndexDefinition(prefix=[self.key_prefix], index_type=IndexType.HASH))
+            logger.info(f"[ chunk writer ] index {self.index_name} created")
+        except redis.ResponseError as e:
+            # created concurrently by another ingestion
+            if "already exists" not in str(e).lower():
+                raise
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        embeddings = []
+        for i in range(0, len(texts), self.embed_batch_size):
+            embeddings.extend(self.embedder.embed_documents(texts[i : i + self.embed_batch_size]))
+        return np.asarray(embeddings, dtype=np.float32)
+
+    def file_tag(self, file_name: str) -> str:
+        return hashlib.sha1(file_name.encode("utf-8")).hexdigest()[:16]
+
+    def chunk_key(self, file_name: str, digest: str) -> str:
+        return f"{self.key_prefix}:{self.file_tag(file_name)}:{digest}"
+
+    def section_id(self, file_name: str, node_id: int) -> str:
+        """Tag of a section, unique across files: the file tag and the id of the node in Tree.to_dict()."""
+        return f"{self.file_tag(file_name)}_{node_id}"
+
+    def embed_reusing(self, texts: List[str]) -> Tuple[np.ndarray, int]:
+        """Return the vectors of `texts` and how many of them were reused from chunks already stored.
+
+        Only texts never seen before, or whose stored chunks have all been deleted, are embedded.
+        """
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32), 0
+        digests = [chunk_hash(text) for text in texts]
+        distinct = list(dict.fromkeys(digests))
+        client = redis.Redis(connection_pool=self.redis_pool)
+        found = {}
+        try:
+            refs = client.hmget(self.store_key, distinct)
+            pipe = client.pipeline(transaction=False)
+            known = [(digest, ref) for digest, ref in zip(distinct, refs) if ref is not None]
+            for _, ref in known:
+                pipe.hget(ref, VECTOR_KEY)
+            for (digest, _), vector in zip(known, pipe.execute() if known else []):
+                # None when the referenced chunk was deleted since
+                if vector is not None:
+                    found[digest] = np.frombuffer(vector, dtype=np.float32)
+        except redis.RedisError as e:
+            logger.error(f"[ chunk writer ] fail to read the embedding store: {e}")
+
+        missing = [digest for digest in distinct if digest not in found]
+        if missing:
+            first = {}
+            for digest, text in zip(digests, texts):
+                first.setdefault(digest, text)
+            found.update(zip(missing, self.embed([first[digest] for digest in missing])))
+        reused = sum(1 for digest in digests if digest not in missing)
+        return np.stack([found[digest] for digest in digests]), reused
+
+    def write(
+        self,
+        file_name: str,
+        chunks: List[str],
+        vectors: Optional[np.ndarray] = None,
+        sections: Optional[Sequence[Tuple[str, int]]] = None,
+    ) -> List[str]:
+        """Store the chunks of `file_name` and return their keys, in order of first occurrence.
+
+        `vectors` are the embeddings of `chunks` when the caller already computed them. `sections` holds the
+        (heading path, node id) of each chunk for documents parsed into a tree; every chunk stores its
+        position in the file, so the retriever can put the chunks of a section back in order.
+        """
+        if not chunks:
+            return []
+        if vectors is None:
+            vectors = self.embed(chunks)
+        client = redis.Redis(connection_pool=self.redis_pool)
+        self.ensure_index(client, vectors.shape[1])
+
+        # a chunk repeated within the file, e.g. a running header, is stored once
+        stored = {}
+        for index, (text, vector) in enumerate(zip(chunks, vectors)):
+            stored.setdefault(chunk_hash(text), (index, text, vector))
+        keys = []
+        pipe = client.pipeline(transaction=False)
+        for digest, (index, text, vector) in stored.items():
+            key = self.chunk_key(file_name, digest)
+            keys.append(key)
+            mapping = {CONTENT_KEY: text, VECTOR_KEY: vector.tobytes(), "file_name": file_name, CHUNK_INDEX_KEY: index}
+            if sections is not None:
+                path, node_id = sections[index]
+                mapping[SECTION_KEY] = path
+                mapping[SECTION_ID_KEY] = self.section_id(file_name, node_id)
+            pipe.hset(key, mapping=mapping)
+            if sections is None:
+                # same text stored before by a parser that produced sections
+                pipe.hdel(key, SECTION_KEY, SECTION_ID_KEY)
+        # point the store at the newest copies, they outlive the older versions of the document
+        pipe.hset(self.store_key, mapping={digest: key for digest, key in zip(stored, keys)})
+        pipe.execute()
+        return keys
@@ -59,8 +59,56 @@ REDIS_URL = format_redis_conn_from_env()
 
 # Vector Index Configuration
 INDEX_NAME = os.getenv("INDEX_NAME", "rag-redis")
+# former index of the chunk ids of each file, migrated to the file registry on start
 KEY_INDEX_NAME = os.getenv("KEY_INDEX_NAME", "file-keys")
 
 TIMEOUT_SECONDS = int(os.getenv("TIMEOUT_SECONDS", 600))
 
 SEARCH_BATCH_SIZE = int(os.getenv("SEARCH_BATCH_SIZE", 10))
+# files read per FT.CURSOR READ when listing files
+LIST_BATCH_SIZE = int(os.getenv("LIST_BATCH_SIZE", 1000))
+# chunk keys removed per UNLINK command when deleting files
+DELETE_BATCH_SIZE = int(os.getenv("DELETE_BATCH_SIZE", 1000))
+
+# Chunks per embedding request, TEI rejects batches above its --max-client-batch-size (32 by default)
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", 32))
+# seconds to wait for concurrent ingestions to fill an embedding batch
+EMBED_BATCH_WAIT = float(os.getenv("EMBED_BATCH_WAIT", 0.02))
+
+# directory caching the parser output of documents, so re-chunking skips parsing; empty to disable
+PARSE_CACHE_DIR = os.getenv("PARSE_CACHE_DIR", "./parse_cache/")
+
+# processes parsing and chunking documents in parallel; without the Marker service each of them loads its own
+# copy of Marker's models, several GB, so only 2 by default
+PARSE_PROCESSES = int(
+    os.getenv(
+        "DATAPREP_PARSE_PROCESSES",
+        (os.cpu_count() or 1) if os.getenv("MARKER_SERVICE_ENDPOINT") else min(2, os.cpu_count() or 1),
+    )
+)
+# processes parsing the pages of one PDF with the lightweight parser when it is parsed in the service process;
+# the workers of the parse pool parse their pages serially
+PAGE_PROCESSES = int(os.getenv("DATAPREP_PAGE_PROCESSES", os.cpu_count() or 1))
+
+# Ingestion job queue, used by uploads with async_mode=true
+JOB_WORKERS = int(os.getenv("DATAPREP_JOB_WORKERS", PARSE_PROCESSES))
+# uploads are rejected with 429 while this many jobs are waiting
+JOB_QUEUE_MAX_DEPTH = int(os.getenv("DATAPREP_JOB_QUEUE_MAX_DEPTH", 64))
+# seconds the status of a finished job is kept
+JOB_TTL = int(os.getenv("DATAPREP_JOB_TTL", 7 * 24 * 3600))
+# seconds without a heartbeat after which the jobs of a dataprep process are requeued by the live ones
+JOB_LEASE_TTL = int(os.getenv("DATAPREP_JOB_LEASE_TTL", 60))
+# a job whose process died this many times while running it is marked failed instead of requeued
+JOB_MAX_ATTEMPTS = int(os.getenv("DATAPREP_JOB_MAX_ATTEMPTS", 2))
+
+# LLM describing the tables of ingested documents
+LLM_SERVER_HOST_IP = os.getenv("LLM_SERVER_HOST_IP")
+LLM_SERVER_PORT = os.getenv("LLM_SERVER_PORT")
+LLM_MODEL_ID = os.getenv("LLM_MODEL_ID")
+LLM_USE_MODEL_PARAM = os.getenv("LLM_USE_MODEL_PARAM", "false").lower() == "true"
+# tables of one document described at the same time
+TABLE_DESCRIPTION_CONCURRENCY = int(os.getenv("TABLE_DESCRIPTION_CONCURRENCY", 8))
+# seconds per description, the raw markdown of the table is ingested instead on timeout
+TABLE_DESCRIPTION_TIMEOUT = float(os.getenv("TABLE_DESCRIPTION_TIMEOUT", 120))
+# seconds descriptions stay cached in Redis, 0 keeps them until the cache is cleared
+TABLE_DESCRIPTION_CACHE_TTL = int(os.getenv("TABLE_DESCRIPTION_CACHE_TTL", 0))
@@ -0,0 +1,170 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import hashlib
+import time
+from typing import Dict, List, Optional, Tuple, Union
+
+import redis
+from config import DELETE_BATCH_SIZE, KEY_INDEX_NAME
+
+from comps import CustomLogger
+
+logger = CustomLogger("file_registry")
+
+FILES_KEY = "dataprep:files"
+CHUNKS_KEY_PREFIX = "dataprep:file-chunks:"
+META_KEY_PREFIX = "dataprep:file-meta:"
+# hashes of the former file-keys index, with the chunk ids of a file joined by "#"
+LEGACY_KEY_PREFIX = "file:"
+# low bits of a listing cursor: the names of the SSCAN reply already returned
+CURSOR_OFFSET_BITS = 32
+
+
+def file_content_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class FileRegistry:
+    """Ingested files, by encoded file name: the set of their chunk keys and a hash of their metadata.
+
+    `dataprep:files` holds the names of all the files, so existence checks are one SISMEMBER and
+    listings an SSCAN. `dataprep:file-chunks:<name>` is the set of chunk keys of a file and
+    `dataprep:file-meta:<name>` its chunk count, content hash, ingest time and parser type.
+    """
+
+    def __init__(self, redis_pool: redis.ConnectionPool):
+        self.redis_pool = redis_pool
+
+    def client(self) -> redis.Redis:
+        return redis.Redis(connection_pool=self.redis_pool)
+
+    def exists(self, file_name: str) -> bool:
+        return bool(self.client().sismember(FILES_KEY, file_name))
+
+    def metadata(self, file_name: str) -> Optional[Dict[str, str]]:
+        raw = self.client().hgetall(META_KEY_PREFIX + file_name)
+        return {k.decode(): v.decode() for k, v in raw.items()} if raw else None
+
+    def register(
+        self,
+        file_name: str,
+        chunk_keys: List[str],
+        content_hash: str = "",
+        parser_type: str = "",
+        pipe: Optional[redis.client.Pipeline] = None,
+    ):
+        """Record the chunks of `file_name`, replacing those of a previous ingestion."""
+        execute = pipe is None
+        if pipe is None:
+            pipe = self.client().pipeline(transaction=True)
+        chunks_key = CHUNKS_KEY_PREFIX + file_name
+        pipe.unlink(chunks_key)
+        for i in range(0, len(chunk_keys), DELETE_BATCH_SIZE):
+            pipe.sadd(chunks_key, *chunk_keys[i : i + DELETE_BATCH_SIZE])
+        meta = {"file_name": file_name, "chunks": len(chunk_keys), "ingested": time.time()}
+        meta.update(content_hash=content_hash, parser_type=parser_type)
+        pipe.hset(META_KEY_PREFIX + file_name, mapping=meta)
+        pipe.sadd(FILES_KEY, file_name)
+        if execute:
+            pipe.execute()
+
+    def chunk_keys(self, file_names: List[str]) -> List[Optional[List[str]]]:
+        """The chunk keys of each file, None for the files that are not registered."""
+        pipe = self.client().pipeline(transaction=False)
+        for file_name in file_names:
+            pipe.sismember(FILES_KEY, file_name)
+            pipe.smembers(CHUNKS_KEY_PREFIX + file_name)
+        replies = pipe.execute()
+        result = []
+        for registered, keys in zip(replies[::2], replies[1::2]):
+            result.append([key.decode() for key in keys] if registered else None)
+        return result
+
+    def unregister(self, pipe: Union[redis.Redis, redis.client.Pipeline], file_name: str):
+        """Queue the removal of `file_name` from the registry, its chunks are deleted by the caller."""
+        pipe.unlink(CHUNKS_KEY_PREFIX + file_name, META_KEY_PREFIX + file_name)
+        pipe.srem(FILES_KEY, file_name)
+
+    def scan(self, cursor: int = 0, count: int = 1000) -> Tuple[List[str], int]:
+        """One page of at most `count` file names and the cursor of the next page, 0 after the last page.
+
+        COUNT is only a hint to SSCAN, a small set comes back whole in one reply. Replies are buffered
+        up to `count` names, and the cursor of a page that ends within a reply keeps the SSCAN cursor
+        of the reply with the number of its names already returned, to read it again and skip them.
+        """
+        client = self.client()
+        scan_cursor, skip = cursor >> CURSOR_OFFSET_BITS, cursor & ((1 << CURSOR_OFFSET_BITS) - 1)
+        names = []
+        while True:
+            next_cursor, reply = client.sscan(FILES_KEY, scan_cursor, count=count)
+            take = count - len(names)
+            names.extend(reply[skip : skip + take])
+            if skip + take < len(reply):
+                cursor = (scan_cursor << CURSOR_OFFSET_BITS) | (skip + take)
+                break
+            scan_cursor, skip = next_cursor, 0
+            cursor = scan_cursor << CURSOR_OFFSET_BITS
+            if not scan_cursor or len(names) == count:
+                break
+        return [name.decode() for name in names], cursor
+
+    def clear(self):
+        client = self.client()
+        cursor = 0
+        while True:
+            cursor, names = client.sscan(FILES_KEY, cursor, count=DELETE_BATCH_SIZE)
+            keys = [prefix + name.decode() for name in names for prefix in (CHUNKS_KEY_PREFIX, META_KEY_PREFIX)]
+            if keys:
+                client.unlink(*keys)
+            if not cursor:
+                break
+        client.unlink(FILES_KEY)
+
+    def migrate_file_keys(self, index_name: str = KEY_INDEX_NAME) -> int:
+        """Move the files of the former `file-keys` index into the registry and return how many were moved.
+
+        Runs on service start, a no-op once the legacy hashes are gone.
+        """
+        client = self.client()
+        migrated = 0
+        for batch in self._legacy_batches(client):
+            pipe = client.pipeline(transaction=False)
+            for key in batch:
+                pipe.hmget(key, "file_name", "key_ids")
+            entries = pipe.execute()
+
+            pipe = client.pipeline(transaction=True)
+            for key, (file_name, key_ids) in zip(batch, entries):
+                if file_name is None:
+                    continue
+                chunk_keys = [k for k in (key_ids or b"").decode().split("#") if k]
+                self.register(file_name.decode(), chunk_keys, pipe=pipe)
+                migrated += 1
+            pipe.unlink(*batch)
+            pipe.execute()
+
+        try:
+            client.ft(index_name).dropindex(delete_documents=False)
+            logger.info(f"[ file registry ] dropped legacy index {index_name}")
+        except redis.ResponseError:
+            # already dropped, or never created
+            pass
+        if migrated:
+            logger.info(f"[ file registry ] migrated {migrated} files from index {index_name}")
+        return migrated
+
+    @staticmethod
+    def _legacy_batches(client: redis.Redis):
+        batch = []
+        for key in client.scan_iter(match=LEGACY_KEY_PREFIX + "*", count=DELETE_BATCH_SIZE, _type="HASH"):
+            batch.append(key)
+            if len(batch) == DELETE_BATCH_SIZE:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
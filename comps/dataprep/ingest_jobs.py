@@ -0,0 +1,325 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import json
+import os
+import socket
+import threading
+import time
+import traceback
+import uuid
+from typing import Callable, Dict, List, Optional
+
+import redis
+from config import JOB_LEASE_TTL, JOB_MAX_ATTEMPTS, JOB_QUEUE_MAX_DEPTH, JOB_TTL, JOB_WORKERS
+
+from comps import CustomLogger
+
+logger = CustomLogger("ingest_jobs")
+
+QUEUE_KEY = "dataprep:jobs:queue"
+JOB_KEY_PREFIX = "dataprep:job:"
+# jobs taken by the workers of one process stay in its processing list until they finish
+PROCESSING_KEY_PREFIX = "dataprep:jobs:processing:"
+# set while the process owning the processing list of the same suffix is alive
+LEASE_KEY_PREFIX = "dataprep:jobs:lease:"
+
+# push the job ids of KEYS[2..] on the queue KEYS[1] only if they all fit under ARGV[1] jobs
+SUBMIT_SCRIPT = """
+if redis.call('llen', KEYS[1]) + #KEYS - 1 > tonumber(ARGV[1]) then
+    return 0
+end
+for i = 2, #KEYS do
+    redis.call('rpush', KEYS[1], KEYS[i])
+end
+return 1
+"""
+
+# move the last job of the processing list KEYS[1] of a stopped process back to the front of the queue KEYS[2],
+# or mark it failed once it stopped processes ARGV[2] times; returns [job id, requeued] or nil when empty
+REQUEUE_SCRIPT = """
+local job_id = redis.call('rpop', KEYS[1])
+if not job_id then
+    return nil
+end
+local key = ARGV[1] .. job_id
+local attempts = tonumber(redis.call('hget', key, 'attempts') or '0')
+if attempts >= tonumber(ARGV[2]) then
+    local error = 'Worker stopped during ' .. attempts .. ' attempts'
+    redis.call('hset', key, 'status', 'failed', 'stage', '', 'error', error, 'finished', ARGV[3])
+    redis.call('expire', key, ARGV[4])
+    return {job_id, 0}
+end
+redis.call('hset', key, 'status', 'queued', 'stage', '')
+redis.call('lpush', KEYS[2], job_id)
+return {job_id, 1}
+"""
+
+# mark the job of hash KEYS[1] failed if it is still running while absent from the queue and from every
+# processing list, KEYS[2..]; ARGV holds the job id, the error, the time and the TTL of finished jobs
+FAIL_ORPHAN_SCRIPT = """
+if redis.call('hget', KEYS[1], 'status') ~= 'running' then
+    return 0
+end
+for i = 2, #KEYS do
+    if redis.call('lpos', KEYS[i], ARGV[1]) then
+        return 0
+    end
+end
+redis.call('hset', KEYS[1], 'status', 'failed', 'stage', '', 'error', ARGV[2], 'finished', ARGV[3])
+redis.call('expire', KEYS[1], ARGV[4])
+return 1
+"""
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+
+class QueueFull(Exception):
+    pass
+
+
+class JobReporter:
+    """Record the stages of one job in its Redis hash, with the time spent in each of them."""
+
+    def __init__(self, client: redis.Redis, job_id: str):
+        self.client = client
+        self.key = JOB_KEY_PREFIX + job_id
+        self.stages = {}  # stage -> seconds, in execution order
+        self.stage = None
+        self.stage_start = None
+
+    def _close_stage(self):
+        if self.stage is not None:
+            self.stages[self.stage] = round(time.time() - self.stage_start, 3)
+
+    def __call__(self, stage: str, started: Optional[float] = None, **info):
+        """Enter `stage`; extra keyword arguments, e.g. chunks=120, are stored with the job.
+
+        `started` is the time the stage began when it is reported afterwards, e.g. by a parsing process.
+        """
+        now = time.time()
+        if self.stage is not None:
+            self.stages[self.stage] = round((started or now) - self.stage_start, 3)
+        self.stage, self.stage_start = stage, started or now
+        fields = {"stage": stage, "stages": json.dumps(self.stages)}
+        fields.update({f"info:{k}": json.dumps(v) for k, v in info.items()})
+        self.client.hset(self.key, mapping=fields)
+
+    def finish(self, status: str, error: Optional[str] = None):
+        self._close_stage()
+        fields = {"status": status, "stage": "", "stages": json.dumps(self.stages), "finished": time.time()}
+        if error is not None:
+            fields["error"] = error
+        pipe = self.client.pipeline(transaction=False)
+        pipe.hset(self.key, mapping=fields)
+        pipe.expire(self.key, JOB_TTL)
+        pipe.execute()
+
+
+class IngestJobQueue:
+    """Ingestion jobs kept in a Redis list and processed by a pool of worker threads.
+
+    Jobs are submitted by the upload endpoint, which returns at once with the job ids. The queue depth is
+    bounded: `submit_many` raises QueueFull, without queuing any of the jobs, when they do not all fit
+    under `max_depth` pending jobs, so callers can back off. A job is a JSON payload handed to
+    `handler(payload, report)`, where `report(stage, **info)` marks progress.
+
+    Workers move a job id atomically from the queue to the processing list of their process and remove it
+    once the job finished, so a job is never lost when the process dies. Each process keeps a lease alive
+    while it runs; on start and every `JOB_LEASE_TTL` seconds, the jobs left in the processing lists of
+    processes whose lease expired are requeued, or marked failed after `JOB_MAX_ATTEMPTS` attempts, and
+    jobs still "running" without being in any processing list are marked failed.
+    """
+
+    def __init__(
+        self,
+        redis_pool: redis.ConnectionPool,
+        handler: Callable[[Dict, JobReporter], None],
+        workers: int = JOB_WORKERS,
+        max_depth: int = JOB_QUEUE_MAX_DEPTH,
+    ):
+        self.redis_pool = redis_pool
+        self.handler = handler
+        self.workers = workers
+        self.max_depth = max_depth
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.processing_key = PROCESSING_KEY_PREFIX + self.owner
+        self.lease_key = LEASE_KEY_PREFIX + self.owner
+        self.threads = []
+        self.stopped = threading.Event()
+        self._submit_script = None
+        self._requeue_script = None
+        self._fail_orphan_script = None
+
+    def client(self) -> redis.Redis:
+        return redis.Redis(connection_pool=self.redis_pool)
+
+    def depth(self) -> int:
+        """Number of jobs waiting for a worker."""
+        return self.client().llen(QUEUE_KEY)
+
+    def submit(self, payload: Dict) -> str:
+        return self.submit_many([payload])[0]
+
+    def submit_many(self, payloads: List[Dict]) -> List[str]:
+        """Queue all of `payloads` or, when they do not fit in the queue, none of them."""
+        client = self.client()
+        job_ids = [uuid.uuid4().hex for _ in payloads]
+        created = time.time()
+        pipe = client.pipeline(transaction=False)
+        for job_id, payload in zip(job_ids, payloads):
+            job = {"status": QUEUED, "payload": json.dumps(payload), "created": created, "stages": "{}"}
+            pipe.hset(JOB_KEY_PREFIX + job_id, mapping=job)
+        pipe.execute()
+        if self._submit_script is None:
+            self._submit_script = client.register_script(SUBMIT_SCRIPT)
+        keys = [QUEUE_KEY] + job_ids
+        if not self._submit_script(keys=keys, args=[self.max_depth], client=client):
+            client.delete(*(JOB_KEY_PREFIX + job_id for job_id in job_ids))
+            raise QueueFull(f"{self.max_depth} ingestion jobs already queued")
+        return job_ids
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        raw = self.client().hgetall(JOB_KEY_PREFIX + job_id)
+        if not raw:
+            return None
+        job = {k.decode(): v.decode() for k, v in raw.items()}
+        result = {"job_id": job_id, "status": job["status"], "stage": job.get("stage", "")}
+        result["stages"] = json.loads(job.get("stages", "{}"))
+        result.update(json.loads(job["payload"]))
+        for field in ("created", "started", "finished"):
+            if field in job:
+                result[field] = float(job[field])
+        if "started" in result:
+            result["elapsed"] = round(result.get("finished", time.time()) - result["started"], 3)
+        for field, value in job.items():
+            if field.startswith("info:"):
+                result[field[len("info:") :]] = json.loads(value)
+        if "error" in job:
+            result["error"] = job["error"]
+        result["queue_position"] = self._position(job_id) if job["status"] == QUEUED else None
+        return result
+
+    def _position(self, job_id: str) -> Optional[int]:
+        try:
+            return self.client().lpos(QUEUE_KEY, job_id)
+        except redis.ResponseError:
+            # LPOS needs Redis >= 6.0.6
+            return None
+
+    def start(self):
+        client = self.client()
+        client.set(self.lease_key, 1, ex=JOB_LEASE_TTL)
+        try:
+            self.recover(client)
+        except redis.RedisError as e:
+            logger.error(f"[ ingest jobs ] fail to recover the jobs of stopped processes: {e}")
+        heartbeat = threading.Thread(target=self._heartbeat, name="ingest-heartbeat", daemon=True)
+        heartbeat.start()
+        self.threads.append(heartbeat)
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"ingest-worker-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        logger.info(f"[ ingest jobs ] started {self.workers} workers")
+
+    def stop(self):
+        self.stopped.set()
+
+    def recover(self, client: redis.Redis):
+        """Requeue the jobs of processes that died while running them, fail those that cannot be retried.
+
+        Run on start and then every `JOB_LEASE_TTL` seconds, so the jobs of a process that restarted before
+        its previous lease expired are picked up once it does.
+        """
+        if self._requeue_script is None:
+            self._requeue_script = client.register_script(REQUEUE_SCRIPT)
+            self._fail_orphan_script = client.register_script(FAIL_ORPHAN_SCRIPT)
+        for key in client.scan_iter(match=PROCESSING_KEY_PREFIX + "*"):
+            key = key.decode()
+            owner = key[len(PROCESSING_KEY_PREFIX) :]
+            if client.exists(LEASE_KEY_PREFIX + owner):
+                continue
+            # one job per script call, each requeued or failed atomically even when several processes recover
+            while True:
+                moved = self._requeue_script(
+                    keys=[key, QUEUE_KEY], args=[JOB_KEY_PREFIX, JOB_MAX_ATTEMPTS, time.time(), JOB_TTL], client=client
+                )
+                if moved is None:
+                    break
+                job_id, requeued = moved[0].decode(), moved[1]
+                if requeued:
+                    logger.info(f"[ ingest jobs ] job {job_id} of stopped process {owner} requeued")
+                else:
+                    logger.error(f"[ ingest jobs ] job {job_id} failed, its worker stopped too many times")
+
+        # running jobs in no processing list were taken before processing lists existed, or lost. A job is
+        # marked running after it entered a processing list, so the lists listed after reading its status
+        # include it if it is alive; the script checks them, and the queue, when it fails the job.
+        for key in client.scan_iter(match=JOB_KEY_PREFIX + "*"):
+            if client.hget(key, "status") != RUNNING.encode():
+                continue
+            job_id = key.decode()[len(JOB_KEY_PREFIX) :]
+            processing_keys = [name.decode() for name in client.scan_iter(match=PROCESSING_KEY_PREFIX + "*")]
+            failed = self._fail_orphan_script(
+                keys=[key, QUEUE_KEY] + processing_keys,
+                args=[job_id, "Worker stopped during the job", time.time(), JOB_TTL],
+                client=client,
+            )
+            if failed:
+                logger.error(f"[ ingest jobs ] job {job_id} left running by a stopped worker, marked failed")
+
+    def _heartbeat(self):
+        client = self.client()
+        recovered = time.time()
+        while not self.stopped.wait(JOB_LEASE_TTL / 3):
+            try:
+                client.set(self.lease_key, 1, ex=JOB_LEASE_TTL)
+                if time.time() - recovered >= JOB_LEASE_TTL:
+                    recovered = time.time()
+                    self.recover(client)
+            except redis.RedisError as e:
+                logger.error(f"[ ingest jobs ] fail to renew the lease or recover jobs: {e}")
+
+    def _work(self):
+        client = self.client()
+        while not self.stopped.is_set():
+            try:
+                # BLMOVE needs Redis >= 6.2
+                job_id = client.blmove(QUEUE_KEY, self.processing_key, 1, "LEFT", "RIGHT")
+            except redis.RedisError as e:
+                logger.error(f"[ ingest jobs ] fail to poll the queue: {e}")
+                time.sleep(1)
+                continue
+            if job_id is None:
+                continue
+            job_id = job_id.decode()
+            self._run(client, job_id)
+            try:
+                client.lrem(self.processing_key, 1, job_id)
+            except redis.RedisError as e:
+                # requeued by the recovery of another process if this one stops before the list is cleaned up
+                logger.error(f"[ ingest jobs ] fail to remove job {job_id} from the processing list: {e}")
+
+    def _run(self, client: redis.Redis, job_id: str):
+        key = JOB_KEY_PREFIX + job_id
+        payload = client.hget(key, "payload")
+        if payload is None:
+            logger.error(f"[ ingest jobs ] job {job_id} not found")
+            return
+        pipe = client.pipeline(transaction=False)
+        pipe.hset(key, mapping={"status": RUNNING, "started": time.time()})
+        pipe.hincrby(key, "attempts", 1)
+        pipe.execute()
+        report = JobReporter(client, job_id)
+        try:
+            self.handler(json.loads(payload), report)
+        except Exception as e:
+            logger.error(f"[ ingest jobs ] job {job_id} failed: {e}")
+            logger.error(traceback.format_exc())
+            report.finish(FAILED, error=getattr(e, "detail", None) or str(e))
+        else:
+            report.finish(SUCCEEDED)
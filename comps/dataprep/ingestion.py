@@ -0,0 +1,522 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+"""Document ingestion shared by the dataprep service, its job workers and the backfill CLI.
+
+Importing this module does not register the dataprep microservice, so worker processes and scripts can
+use it next to a running service.
+"""
+
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional, Tuple
+
+import redis
+from chunk_writer import SECTION_SEPARATOR, ChunkWriter
+from config import EMBED_BATCH_SIZE, EMBED_BATCH_WAIT, EMBED_MODEL, PAGE_PROCESSES, PARSE_PROCESSES, REDIS_URL
+from fastapi import HTTPException
+from file_registry import FileRegistry, file_content_hash
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_community.embeddings import HuggingFaceBgeEmbeddings
+from langchain_huggingface import HuggingFaceEndpointEmbeddings
+from parse_cache import ParseCache
+from prometheus_client import Histogram
+from table_descriptions import TableDescriber
+from utils import get_separators
+
+from comps import CustomLogger, DocPath
+from comps.core.semantic_cache import invalidate_file
+from comps.parsers import marker_pool
+from comps.parsers.node import Node
+from comps.parsers.parser_light import iter_pages
+from comps.parsers.table import Table
+from comps.parsers.text import Text
+from comps.parsers.tree import Tree, section_path
+from comps.parsers.treeparser import OUTPUT_DIR, TreeParser
+
+logger = CustomLogger("ingestion")
+logflag = os.getenv("LOGFLAG", False)
+
+tei_embedding_endpoint = os.getenv("TEI_ENDPOINT")
+redis_pool = redis.ConnectionPool.from_url(REDIS_URL)
+file_registry = FileRegistry(redis_pool)
+parse_cache = ParseCache()
+
+# exposed on /metrics of the dataprep service, measured in the parse processes or by the Marker service
+marker_model_load = Histogram("dataprep_marker_model_load_seconds", "Seconds loading Marker's models (histogram)")
+marker_conversion = Histogram("dataprep_marker_conversion_seconds", "Seconds converting one PDF with Marker (histogram)")
+chunk_writer = None
+table_describer = None
+
+
+def check_index_existance(client):
+    if logflag:
+        logger.info(f"[ check index existence ] checking {client}")
+    try:
+        results = client.search("*")
+        if logflag:
+            logger.info(f"[ check index existence ] index of client exists: {client}")
+        return results
+    except Exception as e:
+        if logflag:
+            logger.info(f"[ check index existence ] index does not exist: {e}")
+        return None
+
+
+def create_embedder():
+    if tei_embedding_endpoint:
+        # create embeddings using TEI endpoint service
+        return HuggingFaceEndpointEmbeddings(model=tei_embedding_endpoint)
+    # create embeddings using local embedding model
+    return HuggingFaceBgeEmbeddings(model_name=EMBED_MODEL)
+
+
+def get_chunk_writer() -> ChunkWriter:
+    """Return the writer shared by all ingestions, created on service start."""
+    global chunk_writer
+    if chunk_writer is None:
+        chunk_writer = ChunkWriter(
+            EmbeddingBatcher(create_embedder()), redis_pool, model=tei_embedding_endpoint or EMBED_MODEL
+        )
+    return chunk_writer
+
+
+def no_report(stage: str, started: Optional[float] = None, **info):
+    pass
+
+
+class StageRecorder:
+    """`report` for a worker process: records the stages so that the service reports them afterwards."""
+
+    def __init__(self):
+        self.stages = []  # [(stage, start time, info)]
+
+    def __call__(self, stage: str, started: Optional[float] = None, **info):
+        self.stages.append((stage, started or time.time(), info))
+
+    def replay(self, report):
+        for stage, started, info in self.stages:
+            report(stage, started=started, **info)
+
+
+def ingest_chunks_to_redis(
+    file_name: str,
+    chunks: List,
+    report=no_report,
+    content_hash: str = "",
+    parser_type: str = "",
+    sections: Optional[List[Tuple[str, int]]] = None,
+):
+    """Embed and store `chunks`, with the (heading path, node id) of each one in `sections` when known."""
+    if logflag:
+        logger.info(f"[ ingest chunks ] file name: {file_name}")
+
+    writer = get_chunk_writer()
+    report("embed", chunks=len(chunks))
+    vectors, reused = writer.embed_reusing(chunks)
+    reuse_ratio = round(reused / len(chunks), 3) if chunks else 0.0
+    logger.info(f"[ ingest chunks ] {file_name}: reused {reused} of {len(chunks)} chunk embeddings ({reuse_ratio:.0%})")
+    report("write", reused=reused, reuse_ratio=reuse_ratio)
+    file_ids = writer.write(file_name, chunks, vectors, sections)
+    if logflag:
+        logger.info(f"[ ingest chunks ] stored {len(file_ids)} chunks, keys: {file_ids}")
+
+    # record the chunks of the file in the registry
+    report("register")
+    r = redis.Redis(connection_pool=redis_pool)
+    try:
+        # chunks of a previous ingestion that the new chunking no longer produces, keys are content addressed
+        stale = set(file_registry.chunk_keys([file_name])[0] or []) - set(file_ids)
+        pipe = r.pipeline(transaction=True)
+        file_registry.register(file_name, file_ids, content_hash=content_hash, parser_type=parser_type, pipe=pipe)
+        if stale:
+            pipe.unlink(*stale)
+        # answers cached by the megaservice were based on the previous chunks
+        invalidate_file(pipe, file_name)
+        pipe.execute()
+    except redis.RedisError as e:
+        if logflag:
+            logger.info(f"[ ingest chunks ] {e}. Fail to store chunks of file {file_name}.")
+        raise HTTPException(status_code=500, detail=f"Fail to store chunks of file {file_name}.")
+    return True
+
+
+def get_table_describer() -> TableDescriber:
+    global table_describer
+    if table_describer is None:
+        table_describer = TableDescriber(redis_pool)
+    return table_describer
+
+
+def collect_tables(node: Node) -> List[Table]:
+    """Tables of `node` and its descendants, in chunking order."""
+    tables = [item for item in node.get_content() if isinstance(item, Table)]
+    for i in range(node.get_length_children()):
+        tables.extend(collect_tables(node.get_child(i)))
+    return tables
+
+
+def chunk_node_content(node: Node, text_splitter: RecursiveCharacterTextSplitter, descriptions: Dict[int, str]):
+    content = node.get_content()
+    chunks = []
+    for item in content:
+        if isinstance(item, Text):
+            text_chunks = text_splitter.split_text(item.content)
+            chunks.extend(text_chunks)
+        if isinstance(item, Table):
+            table_description_chunks = text_splitter.split_text(descriptions[id(item)])
+            chunks.extend(table_description_chunks)
+    return chunks
+
+
+def describe_tables(node: Node) -> Dict[int, str]:
+    """Descriptions of the tables under `node`, keyed by id(table)."""
+    # describe all the tables of the tree at once instead of one LLM call after the other
+    tables = collect_tables(node)
+    return {id(table): text for table, text in zip(tables, get_table_describer().describe(tables))}
+
+
+def create_chunks(
+    node: Node, text_splitter: RecursiveCharacterTextSplitter, descriptions: Optional[Dict[int, str]] = None
+):
+    if descriptions is None:
+        descriptions = describe_tables(node)
+    node_chunks = chunk_node_content(node, text_splitter, descriptions)
+    total = node.get_length_children()
+    for i in range(total):
+        node_chunks.extend(create_chunks(node.get_child(i), text_splitter, descriptions))
+    return node_chunks
+
+
+def create_section_chunks(tree: Tree, text_splitter: RecursiveCharacterTextSplitter):
+    """create_chunks of the whole tree, plus the (heading path, node id) of the section of each chunk.
+
+    Node ids are positions in Tree.nodes(), the ids of Tree.to_dict() and of tree.json.
+    """
+    descriptions = describe_tables(tree.rootNode)
+    chunks, sections = [], []
+    for node_id, node in enumerate(tree.nodes()):
+        node_chunks = chunk_node_content(node, text_splitter, descriptions)
+        path = SECTION_SEPARATOR.join(section_path(node))
+        chunks.extend(node_chunks)
+        sections.extend((path, node_id) for _ in node_chunks)
+    return chunks, sections
+
+
+def create_chunks_lightweight(text_content: List, tables: List, text_splitter: RecursiveCharacterTextSplitter):
+    chunks = []
+    for text in text_content:
+        text_chunks = text_splitter.split_text(text.content)
+        chunks.extend(text_chunks)
+    for table_description in get_table_describer().describe(tables):
+        table_description_chunks = text_splitter.split_text(table_description)
+        chunks.extend(table_description_chunks)
+    return chunks
+
+
+def cached_or_missing(parser_type: str, path: str, content_hash: str):
+    parsed = parse_cache.load(content_hash, parser_type)
+    if parsed is not None:
+        if logflag:
+            logger.info(f"[ ingest data ] Parsed document {path} found in cache.")
+        return parsed
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail=f"Document {os.path.basename(path)} is neither cached nor uploaded.")
+    if logflag:
+        logger.info(f"[ ingest data ] Parsing document {path}.")
+    return None
+
+
+def iter_lightweight_pages(path: str, content_hash: str, processes: int = PAGE_PROCESSES):
+    """Yield the (texts, tables) of the pages of `path` as the lightweight parser produces them."""
+    parsed = cached_or_missing("lightweight", path, content_hash)
+    if parsed is not None:
+        yield parsed
+        return
+    text_content, tables = [], []
+    for page_texts, page_tables in iter_pages(path, processes):
+        text_content.extend(page_texts)
+        tables.extend(page_tables)
+        yield page_texts, page_tables
+    parse_cache.store(content_hash, "lightweight", (text_content, tables))
+
+
+def parse_document(
+    parser_type: str, path: str, content_hash: Optional[str] = None, page_processes: int = PAGE_PROCESSES
+):
+    """Parser output of the document at `path`: (text_content, tables) for the lightweight parser, the Tree otherwise.
+
+    Served from the parse cache when the document, identified by `content_hash`, was parsed before. Trees
+    are cached in their flat Tree.to_dict() form and also written to `tree.json` next to Marker's output.
+    `page_processes` processes parse the pages of a PDF with the lightweight parser.
+    """
+    if content_hash is None:
+        content_hash = file_content_hash(path)
+    if parser_type == "lightweight":
+        text_content, tables = [], []
+        for page_texts, page_tables in iter_lightweight_pages(path, content_hash, page_processes):
+            text_content.extend(page_texts)
+            tables.extend(page_tables)
+        return text_content, tables
+
+    cached = cached_or_missing(parser_type, path, content_hash)
+    if cached is not None:
+        return Tree.from_dict(cached)
+    tree = Tree(path)
+    tree_parser = TreeParser()
+    tree_parser.populate_tree(tree)
+    # the flat form is smaller and quicker to load than the pickled nodes
+    tree_parser.generate_output_tree(tree)
+    parse_cache.store(content_hash, parser_type, tree.to_dict())
+    return tree
+
+
+def parse_and_chunk(
+    parser_type: str,
+    doc_path: DocPath,
+    report=no_report,
+    content_hash: Optional[str] = None,
+    page_processes: int = PAGE_PROCESSES,
+) -> Tuple[List[str], Optional[List[Tuple[str, int]]]]:
+    """Parse the document of `doc_path` and split it into chunks, table descriptions included.
+
+    Also returns the (heading path, node id) of the section of each chunk, None for the lightweight parser
+    which has no sections. `page_processes` processes parse the pages of a PDF with the lightweight parser.
+    """
+    text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=doc_path.chunk_size,
+            chunk_overlap=doc_path.chunk_overlap,
+            add_start_index=True,
+            separators=get_separators(),
+        )
+    if content_hash is None:
+        content_hash = file_content_hash(doc_path.path)
+
+    report("parse")
+    sections = None
+    if parser_type == "lightweight":
+        chunks, tables = [], []
+        for page_texts, page_tables in iter_lightweight_pages(doc_path.path, content_hash, page_processes):
+            # the text of a page is split while the next pages are parsed
+            chunks.extend(create_chunks_lightweight(page_texts, [], text_splitter))
+            tables.extend(page_tables)
+        report("chunk", tables=len(tables))
+        chunks.extend(create_chunks_lightweight([], tables, text_splitter))
+    else:
+        tree = parse_document(parser_type, doc_path.path, content_hash, page_processes)
+        report("chunk", tables=len(collect_tables(tree.rootNode)))
+        chunks, sections = create_section_chunks(tree, text_splitter)
+
+    return chunks, sections
+
+
+def observe_marker_timings(timings: Dict[str, List[float]]):
+    for seconds in timings["model_load"]:
+        marker_model_load.observe(seconds)
+    for seconds in timings["conversion"]:
+        marker_conversion.observe(seconds)
+    if timings["conversion"]:
+        load = sum(timings["model_load"])
+        logger.info(f"[ ingest data ] marker model load {load:.1f}s, conversion {sum(timings['conversion']):.1f}s")
+
+
+def parse_worker(parser_type: str, doc_path: Dict, content_hash: Optional[str] = None):
+    """parse_and_chunk for the process pool, takes the DocPath as a dict.
+
+    Returns the chunks, their sections, the StageRecorder of the parse and chunk stages, replayed to the
+    job's reporter, and the Marker timings of the process, which the service observes in its metrics.
+    """
+    recorder = StageRecorder()
+    # already a worker of the parse pool, its pages are parsed here rather than by a pool of its own
+    chunks, sections = parse_and_chunk(parser_type, DocPath(**doc_path), recorder, content_hash, page_processes=1)
+    return chunks, sections, recorder, marker_pool.pop_timings()
+
+
+def ingest_data_to_redis(parser_type: str, doc_path: DocPath, report=no_report):
+    """Ingest document to Redis.
+
+    `report(stage, **info)` is called when each stage starts, ingestion jobs use it to track progress.
+    """
+    content_hash = file_content_hash(doc_path.path)
+    chunks, sections = parse_and_chunk(parser_type, doc_path, report, content_hash)
+    observe_marker_timings(marker_pool.pop_timings())
+    file_name = doc_path.path.split("/")[-1]
+    return ingest_chunks_to_redis(
+        file_name, chunks, report, content_hash=content_hash, parser_type=parser_type, sections=sections
+    )
+
+
+class EmbeddingBatcher:
+    """Thread-safe embedder that merges the texts of concurrent ingestions into full batches.
+
+    Callers block in `embed_documents` while a single thread sends batches of `batch_size` texts, taken
+    from the oldest requests first, waiting at most `max_wait` seconds for a batch to fill up.
+    """
+
+    def __init__(self, embedder, batch_size: int = EMBED_BATCH_SIZE, max_wait: float = EMBED_BATCH_WAIT):
+        self.embedder = embedder
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.requests = queue.Queue()
+        self.thread = threading.Thread(target=self._loop, name="embedding-batcher", daemon=True)
+        self.thread.start()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        future = Future()
+        self.requests.put((list(texts), future))
+        return future.result()
+
+    def _loop(self):
+        pending = deque()  # [texts, future, vectors] of the requests not fully embedded, oldest first
+        while True:
+            if not pending:
+                texts, future = self.requests.get()
+                pending.append([texts, future, []])
+            deadline = time.time() + self.max_wait
+            while sum(len(texts) - len(vectors) for texts, _, vectors in pending) < self.batch_size:
+                try:
+                    texts, future = self.requests.get(timeout=max(deadline - time.time(), 0))
+                except queue.Empty:
+                    break
+                pending.append([texts, future, []])
+
+            batch, owners = [], []
+            for request in pending:
+                texts, _, vectors = request
+                count = min(self.batch_size - len(batch), len(texts) - len(vectors))
+                batch.extend(texts[len(vectors) : len(vectors) + count])
+                owners.append((request, count))
+                if len(batch) == self.batch_size:
+                    break
+
+            try:
+                embeddings = self.embedder.embed_documents(batch)
+            except Exception as e:
+                for request, _ in owners:
+                    request[1].set_exception(e)
+                    pending.remove(request)
+                continue
+
+            offset = 0
+            for request, count in owners:
+                request[2].extend(embeddings[offset : offset + count])
+                offset += count
+            while pending and len(pending[0][2]) == len(pending[0][0]):
+                _, future, vectors = pending.popleft()
+                future.set_result(vectors)
+
+
+class ParallelIngestor:
+    """Parse and chunk files in a pool of processes, then embed and store them through the shared writer.
+
+    Each file is driven by a thread: parsing runs on a free CPU core, embedding goes through the
+    EmbeddingBatcher of the chunk writer so concurrent files fill the embedder's batches.
+    """
+
+    def __init__(self, processes: int = PARSE_PROCESSES):
+        self.processes = processes
+        self.pool = None
+        self.lock = threading.Lock()
+
+    def get_pool(self) -> ProcessPoolExecutor:
+        with self.lock:
+            if self.pool is None:
+                # spawn, the service process runs threads that must not be forked
+                context = multiprocessing.get_context("spawn")
+                self.pool = ProcessPoolExecutor(max_workers=self.processes, mp_context=context)
+            return self.pool
+
+    def ingest_file(
+        self, parser_type: str, doc_path: DocPath, report=no_report, content_hash: Optional[str] = None
+    ):
+        """Ingest the document of `doc_path`; with the `content_hash` of a cached document it may be gone from disk."""
+        report("parse")
+        if content_hash is None:
+            content_hash = file_content_hash(doc_path.path)
+        future = self.get_pool().submit(parse_worker, parser_type, doc_path.dict(exclude={"id"}), content_hash)
+        chunks, sections, recorder, timings = future.result()
+        recorder.replay(report)
+        observe_marker_timings(timings)
+        file_name = doc_path.path.split("/")[-1]
+        return ingest_chunks_to_redis(
+            file_name, chunks, report, content_hash=content_hash, parser_type=parser_type, sections=sections
+        )
+
+    def ingest_many(self, parser_type: str, doc_paths: List[DocPath], on_done=None) -> Dict[str, Optional[str]]:
+        """Ingest `doc_paths` in parallel and return the error of each path, None when it succeeded.
+
+        `on_done(path, error, seconds)` is called as soon as a file is finished.
+        """
+        return self.run_many([(parser_type, doc_path, None) for doc_path in doc_paths], on_done)
+
+    def run_many(self, files: List[Tuple[str, DocPath, Optional[str]]], on_done=None) -> Dict[str, Optional[str]]:
+        """ingest_many for files of different parser types, `files` holds (parser_type, doc_path, content_hash)."""
+        errors = {}
+        with ThreadPoolExecutor(max_workers=self.processes) as threads:
+            futures = {}
+            for parser_type, doc_path, content_hash in self._converted(files):
+                futures[threads.submit(self._timed_ingest, parser_type, doc_path, content_hash)] = doc_path.path
+            for future in as_completed(futures):
+                path = futures[future]
+                error, seconds = future.result()
+                errors[path] = error
+                if on_done is not None:
+                    on_done(path, error, seconds)
+        return errors
+
+    def _converted(self, files: List[Tuple[str, DocPath, Optional[str]]]):
+        """Yield `files`, those needing Marker once the service converted them in batches.
+
+        With MARKER_SERVICE_ENDPOINT set, the PDFs the tree parser has neither in the parse cache nor as
+        markdown are sent to the service's batch endpoint, MARKER_SERVICE_BATCH_SIZE at a time, while the
+        files already yielded are parsed. The parse processes then find the markdown; the PDFs of a failed
+        batch are converted by their parse process, one request each.
+        """
+        if not marker_pool.MARKER_SERVICE_ENDPOINT or len(files) < 2:
+            yield from files
+            return
+        tree_parser = TreeParser()
+        pending = []
+        for parser_type, doc_path, content_hash in files:
+            path = doc_path.path
+            if parser_type != "lightweight" and path.lower().endswith(".pdf") and os.path.exists(path):
+                if not os.path.exists(tree_parser.get_markdown_path(path)):
+                    cache_path = parse_cache.path(content_hash or file_content_hash(path), parser_type)
+                    if not os.path.exists(cache_path):
+                        pending.append((parser_type, doc_path, content_hash))
+                        continue
+            yield parser_type, doc_path, content_hash
+
+        for i in range(0, len(pending), marker_pool.MARKER_SERVICE_BATCH_SIZE):
+            batch = pending[i : i + marker_pool.MARKER_SERVICE_BATCH_SIZE]
+            items = []
+            for _, doc_path, _ in batch:
+                filename = tree_parser.get_filename(doc_path.path)
+                items.append((doc_path.path, os.path.join(OUTPUT_DIR, filename), filename))
+            try:
+                marker_pool.convert_remote_many(items)
+            except Exception as e:
+                logger.error(f"[ parallel ingest ] fail to convert {len(items)} PDFs with the Marker service: {e}")
+            observe_marker_timings(marker_pool.pop_timings())
+            yield from batch
+
+    def _timed_ingest(self, parser_type: str, doc_path: DocPath, content_hash: Optional[str] = None):
+        start = time.time()
+        try:
+            self.ingest_file(parser_type, doc_path, content_hash=content_hash)
+            error = None
+        except Exception as e:
+            logger.error(f"[ parallel ingest ] fail to ingest {doc_path.path}: {e}")
+            error = getattr(e, "detail", None) or str(e)
+        return error, time.time() - start
+
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
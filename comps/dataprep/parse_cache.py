@@ -0,0 +1,64 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import os
+import pickle
+import tempfile
+from typing import Any, Optional
+
+from config import PARSE_CACHE_DIR
+
+from comps import CustomLogger
+
+logger = CustomLogger("parse_cache")
+
+# bump when the parser output classes change, older entries are then ignored
+CACHE_VERSION = 2
+
+
+class ParseCache:
+    """On-disk cache of parser output, keyed by the hash of the document and the parser type.
+
+    Holds the (text_content, tables) of the lightweight parser or the Tree.to_dict() of the default one, so
+    re-chunking a document skips pdfplumber and Marker. Entries are written atomically, several ingestion
+    processes can share the directory. An empty `directory` disables the cache.
+
+    An entry lives in `<directory>/v<CACHE_VERSION>/<parser_type>/<hash[:2]>/<hash>.pkl`, sharded by the first
+    two characters of the content hash. Removing `<directory>/v<CACHE_VERSION>` clears the current cache,
+    directories of older versions are no longer read and can be removed at any time.
+    """
+
+    def __init__(self, directory: str = PARSE_CACHE_DIR):
+        self.directory = directory
+
+    def path(self, content_hash: str, parser_type: str) -> str:
+        return os.path.join(self.directory, f"v{CACHE_VERSION}", parser_type, content_hash[:2], f"{content_hash}.pkl")
+
+    def load(self, content_hash: str, parser_type: str) -> Optional[Any]:
+        if not self.directory or not content_hash:
+            return None
+        path = self.path(content_hash, parser_type)
+        try:
+            with open(path, "rb") as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.error(f"[ parse cache ] fail to read {path}: {e}")
+            return None
+
+    def store(self, content_hash: str, parser_type: str, parsed: Any):
+        if not self.directory or not content_hash:
+            return
+        path = self.path(content_hash, parser_type)
+        tmp_path = None
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(parsed, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.error(f"[ parse cache ] fail to write {path}: {e}")
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.unlink(tmp_path)
@@ -0,0 +1,134 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import asyncio
+import hashlib
+import json
+from typing import List, Optional
+
+import aiohttp
+import redis
+from config import (
+    LLM_MODEL_ID,
+    LLM_SERVER_HOST_IP,
+    LLM_SERVER_PORT,
+    LLM_USE_MODEL_PARAM,
+    TABLE_DESCRIPTION_CACHE_TTL,
+    TABLE_DESCRIPTION_CONCURRENCY,
+    TABLE_DESCRIPTION_TIMEOUT,
+)
+
+from comps import CustomLogger
+from comps.parsers.table import Table
+
+logger = CustomLogger("table_descriptions")
+
+CACHE_KEY_PREFIX = "table-description:"
+
+SYSTEM_PROMPT = """
+                    <s>[INST] <<SYS>>\n You are a helpful, respectful, and honest assistant. Your task is to generate a detailed and descriptive summary of the provided table data in Markdown format, based strictly on the table and its heading. <</SYS>>
+                    [INST] Your job is to create a clear, specific, and **factual** textual description. **Do not add any external information** or provide an abstract summary. Only base the description on the data from the table and its heading.
+
+                    1. Link the **columns** with the corresponding **values** in the rows, referencing the exact terms and terminology from the table.
+                    2. For each row, explain how each column's data relates to the corresponding values. Ensure the description is **step-by-step** and follows the structure of the table in a natural order.
+                    3. **Do not return the table itself.** Provide only the descriptive summary, written in **paragraphs**.
+                    4. The description should be precise, direct, and **avoid interpretation** or generalization. Stay true to the exact data given.
+
+                    Think carefully and make sure to describe every column and its respective values in detail.
+                """
+
+
+def table_text(item: Table) -> str:
+    return f"{item.heading}\n{item.markdown_content}"
+
+
+def cache_key(item: Table) -> str:
+    # the prompt and model are part of the key, changing them regenerates the descriptions
+    payload = json.dumps([SYSTEM_PROMPT, LLM_MODEL_ID, item.heading, item.markdown_content])
+    return CACHE_KEY_PREFIX + hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class TableDescriber:
+    """Describe tables with the LLM, concurrently and through a Redis cache.
+
+    Descriptions are cached by a hash of the table heading and markdown, so re-ingesting or re-chunking a
+    document never asks the LLM again. At most `concurrency` requests are in flight; a table whose
+    description fails or takes longer than `timeout` seconds is ingested as its raw markdown, uncached.
+    """
+
+    def __init__(
+        self,
+        redis_pool: redis.ConnectionPool,
+        concurrency: int = TABLE_DESCRIPTION_CONCURRENCY,
+        timeout: float = TABLE_DESCRIPTION_TIMEOUT,
+        cache_ttl: int = TABLE_DESCRIPTION_CACHE_TTL,
+    ):
+        self.redis_pool = redis_pool
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.cache_ttl = cache_ttl
+        self.url = f"http://{LLM_SERVER_HOST_IP}:{LLM_SERVER_PORT}/v1/chat/completions"
+
+    def describe(self, tables: List[Table]) -> List[str]:
+        """Return the description of each table, in order. Blocking, call it outside of an event loop."""
+        if not tables:
+            return []
+        client = redis.Redis(connection_pool=self.redis_pool)
+        keys = [cache_key(item) for item in tables]
+        try:
+            cached = client.mget(keys)
+        except redis.RedisError as e:
+            logger.error(f"[ table descriptions ] fail to read the cache: {e}")
+            cached = [None] * len(keys)
+        descriptions = {key: value.decode("utf-8") for key, value in zip(keys, cached) if value is not None}
+
+        # identical tables, e.g. repeated annexure headers, are described once
+        missing = {}
+        for key, item in zip(keys, tables):
+            if key not in descriptions:
+                missing.setdefault(key, item)
+        if missing:
+            generated = asyncio.run(self._describe_all(list(missing.values())))
+            new = {key: text for key, text in zip(missing, generated) if text is not None}
+            descriptions.update(new)
+            if new:
+                try:
+                    pipe = client.pipeline(transaction=False)
+                    for key, text in new.items():
+                        pipe.set(key, text, ex=self.cache_ttl or None)
+                    pipe.execute()
+                except redis.RedisError as e:
+                    logger.error(f"[ table descriptions ] fail to write the cache: {e}")
+            logger.info(
+                f"[ table descriptions ] {len(tables)} tables, {len(missing)} distinct uncached, "
+                f"{len(new)} generated, {len(missing) - len(new)} kept as markdown"
+            )
+        return [descriptions.get(key, table_text(item)) for key, item in zip(keys, tables)]
+
+    async def _describe_all(self, tables: List[Table]) -> List[Optional[str]]:
+        semaphore = asyncio.Semaphore(self.concurrency)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        async with aiohttp.ClientSession(timeout=timeout, trust_env=True) as session:
+            return await asyncio.gather(*(self._describe(session, semaphore, item) for item in tables))
+
+    async def _describe(self, session: aiohttp.ClientSession, semaphore: asyncio.Semaphore, item: Table) -> Optional[str]:
+        data = {
+            "messages": [
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": table_text(item)},
+            ],
+            "stream": False,
+        }
+        if LLM_USE_MODEL_PARAM and LLM_MODEL_ID:
+            data["model"] = LLM_MODEL_ID
+        headers = {"Content-Type": "application/json", "Accept": "text/event-stream"}
+        async with semaphore:
+            try:
+                async with session.post(self.url, headers=headers, json=data) as response:
+                    response_data = json.loads(await response.text())
+                return response_data["choices"][0]["message"]["content"]
+            except asyncio.TimeoutError:
+                logger.error(f"[ table descriptions ] timeout describing table {item.heading!r}")
+            except Exception as e:
+                logger.error(f"[ table descriptions ] fail to describe table {item.heading!r}: {e}")
+        return None
@@ -7,6 +7,7 @@ from typing import List, Dict, Optional
 from uuid import uuid4
 from langchain_core.prompts import PromptTemplate
 from comps import MegaServiceEndpoint, MicroService, ServiceOrchestrator, ServiceRoleType, ServiceType
+from comps.core.semantic_cache import SEMANTIC_CACHE_ENABLED, SemanticCache, make_scope
 from comps.core.utils import handle_message
 from comps.proto.api_protocol import (
     ChatCompletionRequest,
@@ -36,6 +37,10 @@ RERANK_SERVER_PORT = int(os.getenv("RERANK_SERVER_PORT", 80))
 LLM_SERVER_HOST_IP = os.getenv("LLM_SERVER_HOST_IP", "0.0.0.0")
 LLM_SERVER_PORT = int(os.getenv("LLM_SERVER_PORT", 80))
 LLM_MODEL = os.getenv("LLM_MODEL", "Intel/neural-chat-7b-v3-3")
+# retriever search_type of conversation turns, e.g. "similarity" or "hybrid" (BM25 + vector)
+CONVERSATION_SEARCH_TYPE = os.getenv("CONVERSATION_SEARCH_TYPE", "similarity")
+# retriever expand mode of conversation turns, "section" or "siblings"; empty to send the chunks as found
+CONVERSATION_EXPAND = os.getenv("CONVERSATION_EXPAND", "")
 
 def align_inputs(self, inputs, cur_node, runtime_graph, llm_parameters_dict, **kwargs):
     if self.services[cur_node].service_type == ServiceType.EMBEDDING:
@@ -66,6 +71,17 @@ def align_outputs(self, data, cur_node, inputs, runtime_graph, llm_parameters_di
     if self.services[cur_node].service_type == ServiceType.EMBEDDING:
         assert isinstance(data, list)
         next_data = {"text": inputs["inputs"], "embedding": data[0]}
+        answer_cache = kwargs.get("answer_cache", None)
+        if answer_cache is not None:
+            file_name, scope = kwargs["answer_cache_key"]
+            cached = answer_cache.lookup(file_name, scope, data[0])
+            if cached:
+                # answer from the cache, skip retriever, rerank and llm
+                next_data = {
+                    "text": cached["answer"],
+                    "selected_sources": cached["sources"],
+                    "downstream_black_list": [".*"],
+                }
     elif self.services[cur_node].service_type == ServiceType.RETRIEVER:
         if "retrieved_docs" in data:
             enhanced_docs = []
@@ -182,7 +198,7 @@ def align_outputs(self, data, cur_node, inputs, runtime_graph, llm_parameters_di
 
     return next_data
 
-def align_generator(self, gen, **kwargs):
+async def align_generator(self, gen, **kwargs):
     # store words in a buffer and concat them
     buffer = ""
     in_word = False
@@ -206,7 +222,7 @@ def align_generator(self, gen, **kwargs):
 
         return False, True
 
-    for line in gen:
+    async for line in gen:
         line = line.decode("utf-8")
         start = line.find("{")
         end = line.rfind("}") + 1
@@ -300,6 +316,7 @@ class ChatQnAService:
         ServiceOrchestrator.align_generator = align_generator
         self.megaservice = ServiceOrchestrator()
         self.endpoint = str(MegaServiceEndpoint.CHAT_QNA)
+        self.answer_cache = SemanticCache() if SEMANTIC_CACHE_ENABLED else None
 
     def add_remote_service(self):
 
@@ -317,6 +334,7 @@ class ChatQnAService:
             host=RETRIEVER_SERVICE_HOST_IP,
             port=RETRIEVER_SERVICE_PORT,
             endpoint="/v1/retrieval",
+            batch_endpoint="/v1/retrieval/batch",
             use_remote_service=True,
             service_type=ServiceType.RETRIEVER,
         )
@@ -359,6 +377,7 @@ class ChatQnAService:
             host=RETRIEVER_SERVICE_HOST_IP,
             port=RETRIEVER_SERVICE_PORT,
             endpoint="/v1/retrieval",
+            batch_endpoint="/v1/retrieval/batch",
             use_remote_service=True,
             service_type=ServiceType.RETRIEVER,
         )
@@ -397,6 +416,7 @@ class ChatQnAService:
             host=RETRIEVER_SERVICE_HOST_IP,
             port=RETRIEVER_SERVICE_PORT,
             endpoint="/v1/retrieval",
+            batch_endpoint="/v1/retrieval/batch",
             use_remote_service=True,
             service_type=ServiceType.RETRIEVER,
         )
@@ -457,10 +477,23 @@ class ChatQnAService:
             fetch_k=chat_request.fetch_k if chat_request.fetch_k else 20,
             lambda_mult=chat_request.lambda_mult if chat_request.lambda_mult else 0.5,
             score_threshold=chat_request.score_threshold if chat_request.score_threshold else 0.2,
+            expand=chat_request.expand,
+            expand_tokens=chat_request.expand_tokens,
         )
         reranker_parameters = RerankerParms(
             top_n=chat_request.top_n if chat_request.top_n else 1,
         )
+
+        answer_cache_key = None
+        if self.answer_cache is not None and chat_request.file_name:
+            answer_cache_key = (
+                chat_request.file_name,
+                make_scope(
+                    parameters.dict(exclude={"id", "stream"}),
+                    retriever_parameters.dict(exclude={"id", "file_name"}),
+                    reranker_parameters.dict(exclude={"id"}),
+                ),
+            )
         
         try:
             result_dict, runtime_graph = await self.megaservice.schedule(
@@ -468,6 +501,8 @@ class ChatQnAService:
                 llm_parameters=parameters,
                 retriever_parameters=retriever_parameters,
                 reranker_parameters=reranker_parameters,
+                answer_cache=self.answer_cache if answer_cache_key else None,
+                answer_cache_key=answer_cache_key,
             )
             
             for node, response in result_dict.items():
@@ -509,6 +544,9 @@ class ChatQnAService:
             
             response_dict = completion_response.dict()
             response_dict["sources"] = sources
+
+            if answer_cache_key:
+                self.update_answer_cache(answer_cache_key, result_dict, response, sources)
             
             print(f"DEBUG: Returning response with {len(sources)} sources")
             for i, src in enumerate(sources):
@@ -522,6 +560,14 @@ class ChatQnAService:
             traceback.print_exc()
             raise HTTPException(status_code=500, detail=str(e))
 
+    def update_answer_cache(self, answer_cache_key, result_dict, answer, sources):
+        # the embedding output only survives on a cache miss, a hit replaces it with the cached answer
+        for node, node_data in result_dict.items():
+            if self.megaservice.services[node].service_type == ServiceType.EMBEDDING and "embedding" in node_data:
+                file_name, scope = answer_cache_key
+                self.answer_cache.store(file_name, scope, node_data["embedding"], answer, sources)
+                break
+
     def start(self):
         self.service = MicroService(
             self.__class__.__name__,
@@ -534,6 +580,7 @@ class ChatQnAService:
         )
 
         self.service.add_route(self.endpoint, self.handle_request, methods=["POST"])
+        self.service.add_shutdown_event(self.megaservice.close)
 
         self.service.start()
 
@@ -640,6 +687,8 @@ class ConversationRAGService(ChatQnAService):
                 "temperature": conversation_request.temperature,
                 "stream": stream,
                 "file_name": file_name,
+                "search_type": CONVERSATION_SEARCH_TYPE,
+                "expand": CONVERSATION_EXPAND or None,
                 "k": conversation_request.top_k or 3,
                 "top_n": conversation_request.top_k or 3
             }
@@ -866,6 +915,7 @@ class ConversationRAGService(ChatQnAService):
         self.service.add_route("/api/circulars", handle_circular_update, methods=["PATCH"])
         self.service.add_route("/api/circulars", handle_circular_get, methods=["GET"])
         self.service.add_route("/api/circulars", handle_circular_post, methods=["POST"])
+        self.service.add_shutdown_event(self.megaservice.close)
         self.service.start()
 
 if __name__ == "__main__":
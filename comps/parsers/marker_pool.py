@@ -0,0 +1,125 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import json
+import os
+import threading
+import time
+from contextlib import ExitStack
+from typing import Dict, List, Optional, Tuple
+
+import requests
+
+from comps import CustomLogger
+
+logger = CustomLogger("marker_pool")
+
+# URL of the Marker conversion service, e.g. http://marker:6008/v1/marker/convert; empty to convert in process
+MARKER_SERVICE_ENDPOINT = os.getenv("MARKER_SERVICE_ENDPOINT", "")
+MARKER_SERVICE_TIMEOUT = float(os.getenv("MARKER_SERVICE_TIMEOUT", 1800))
+# PDFs sent to the Marker service in one request
+MARKER_SERVICE_BATCH_SIZE = int(os.getenv("MARKER_SERVICE_BATCH_SIZE", 8))
+
+CONFIG = {
+    "output_format": "markdown",
+    "use_llm": False,
+}
+
+
+class MarkerConverter:
+    """Marker's layout and OCR models, loaded once and reused for every PDF converted by the process.
+
+    Conversions are serialized, the models are not safe to share between threads and already use the cores.
+    """
+
+    def __init__(self):
+        # marker is only needed by the processes converting PDFs themselves, not by clients of the service
+        from marker.converters.pdf import PdfConverter
+        from marker.models import create_model_dict
+
+        start = time.time()
+        self.converter = PdfConverter(artifact_dict=create_model_dict(), config=CONFIG)
+        self.load_seconds = time.time() - start
+        record_timing("model_load", self.load_seconds)
+        logger.info(f"[ marker ] models loaded in {self.load_seconds:.1f}s")
+        self.lock = threading.Lock()
+
+    def render(self, file: str):
+        with self.lock:
+            start = time.time()
+            rendered = self.converter(file)
+        record_timing("conversion", time.time() - start)
+        return rendered
+
+    def convert(self, file: str, output_dir: str, filename: str):
+        """Write the markdown, metadata and images of `file` to `output_dir`, like marker's CLI."""
+        from marker.output import save_output
+
+        rendered = self.render(file)
+        os.makedirs(output_dir, exist_ok=True)
+        save_output(rendered, output_dir, filename)
+
+
+converter = None
+converter_lock = threading.Lock()
+# seconds spent per stage since the last pop_timings(), reported by dataprep
+timings = {"model_load": [], "conversion": []}
+timings_lock = threading.Lock()
+
+
+def get_converter() -> MarkerConverter:
+    """The converter of this process, the models are loaded by the first call."""
+    global converter
+    with converter_lock:
+        if converter is None:
+            converter = MarkerConverter()
+        return converter
+
+
+def record_timing(stage: str, seconds: float):
+    with timings_lock:
+        timings[stage].append(seconds)
+
+
+def pop_timings() -> Dict[str, List[float]]:
+    with timings_lock:
+        result = {stage: list(values) for stage, values in timings.items()}
+        for values in timings.values():
+            values.clear()
+    return result
+
+
+def convert_remote(file: str, output_dir: str, filename: str, endpoint: str = MARKER_SERVICE_ENDPOINT):
+    """Convert `file` with the Marker service and write its markdown and metadata to `output_dir`.
+
+    Images are not transferred, the tree parser only reads the markdown and the metadata.
+    """
+    convert_remote_many([(file, output_dir, filename)], endpoint)
+
+
+def convert_remote_many(items: List[Tuple[str, str, str]], endpoint: str = MARKER_SERVICE_ENDPOINT):
+    """convert_remote for several (file, output_dir, filename), sent to the service in one request."""
+    with ExitStack() as stack:
+        files = [
+            ("files", (os.path.basename(file), stack.enter_context(open(file, "rb")), "application/pdf"))
+            for file, _, _ in items
+        ]
+        response = requests.post(endpoint, files=files, timeout=MARKER_SERVICE_TIMEOUT)
+    response.raise_for_status()
+    data = response.json()
+    if data.get("model_load_seconds"):
+        record_timing("model_load", data["model_load_seconds"])
+    for (_, output_dir, filename), result in zip(items, data["results"]):
+        record_timing("conversion", result["conversion_seconds"])
+        os.makedirs(output_dir, exist_ok=True)
+        with open(os.path.join(output_dir, f"{filename}.md"), "w", encoding="utf-8") as f:
+            f.write(result["markdown"])
+        with open(os.path.join(output_dir, f"{filename}_meta.json"), "w", encoding="utf-8") as f:
+            json.dump(result["metadata"], f, indent=2)
+
+
+def convert_pdf(file: str, output_dir: str, filename: str, endpoint: Optional[str] = MARKER_SERVICE_ENDPOINT):
+    if endpoint:
+        convert_remote(file, output_dir, filename, endpoint)
+    else:
+        get_converter().convert(file, output_dir, filename)
@@ -0,0 +1,68 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+"""PDF to markdown conversion service keeping Marker's models loaded.
+
+Dataprep sends the PDFs of the default parser here when MARKER_SERVICE_ENDPOINT points to
+/v1/marker/convert, so its parse processes do not each load the models.
+"""
+
+import asyncio
+import os
+import tempfile
+import time
+from typing import List, Union
+
+from fastapi import File, UploadFile
+
+from comps import CustomLogger, opea_microservices, register_microservice
+from comps.parsers import marker_pool
+
+logger = CustomLogger("marker_service")
+
+MARKER_SERVICE_PORT = int(os.getenv("MARKER_SERVICE_PORT", 6008))
+
+
+def render_files(paths: List[str], names: List[str]):
+    from marker.output import text_from_rendered
+
+    converter = marker_pool.get_converter()
+    results = []
+    for path, name in zip(paths, names):
+        start = time.time()
+        rendered = converter.render(path)
+        seconds = time.time() - start
+        markdown, _, _ = text_from_rendered(rendered)
+        results.append(
+            {"file_name": name, "markdown": markdown, "metadata": rendered.metadata, "conversion_seconds": seconds}
+        )
+        logger.info(f"[ marker ] converted {name} in {seconds:.1f}s")
+    # the timings recorded by the pool are reset per request, a model load since the last one was paid by this one
+    timings = marker_pool.pop_timings()
+    return {"model_load_seconds": sum(timings["model_load"], 0.0), "results": results}
+
+
+@register_microservice(
+    name="opea_service@marker_converter", endpoint="/v1/marker/convert", host="0.0.0.0", port=MARKER_SERVICE_PORT
+)
+async def convert_pdfs(files: Union[UploadFile, List[UploadFile]] = File(...)):
+    """Convert a batch of PDFs to markdown, in order, with the models loaded on start."""
+    if not isinstance(files, list):
+        files = [files]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths = []
+        for i, file in enumerate(files):
+            path = os.path.join(tmp_dir, f"{i}.pdf")
+            with open(path, "wb") as f:
+                f.write(await file.read())
+            paths.append(path)
+        return await asyncio.get_running_loop().run_in_executor(
+            None, render_files, paths, [file.filename for file in files]
+        )
+
+
+if __name__ == "__main__":
+    # load the models before accepting requests
+    marker_pool.get_converter()
+    marker_pool.pop_timings()
+    opea_microservices["opea_service@marker_converter"].start()
@@ -3,6 +3,9 @@ from comps.parsers.text import Text
 from comps.parsers.table import Table
 
 class Node:
+    # a circular has thousands of nodes, slots keep them small and quick to pickle
+    __slots__ = ("__level", "__heading", "__parent", "__content", "__children", "__dir")
+
     def __init__(self, level, heading, dir):
         self.__level = level
         self.__heading = heading
@@ -20,6 +23,9 @@ class Node:
     def get_content(self):
         return self.__content
     
+    def get_parent(self):
+        return self.__parent
+
     def set_parent(self, node):
         self.__parent = node
 
@@ -35,14 +41,15 @@ class Node:
     def get_child(self, pos):
         return self.__children[pos]
     
-    def output_node_info(self):
-        with open(os.path.join(self.__dir, "output.txt"), "a") as f:
-            f.write(self.__heading + "\n")
-            for item in self.__content:
-                if isinstance(item, Text):
-                    for line in item.content:
-                        f.write(line)
-                if isinstance(item, Table):
-                    for line in item.markdown_content:
-                        f.write(line)
-            f.write("\n")
+    def output_node_info(self, f=None):
+        if f is None:
+            with open(os.path.join(self.__dir, "output.txt"), "a") as f:
+                self.output_node_info(f)
+            return
+        f.write(self.__heading + "\n")
+        for item in self.__content:
+            if isinstance(item, Text):
+                f.write(item.content)
+            if isinstance(item, Table):
+                f.write(item.markdown_content)
+        f.write("\n")
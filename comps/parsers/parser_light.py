@@ -1,65 +1,114 @@
 import pdfplumber
 import pandas as pd
+import numpy as np
+import bisect
+import multiprocessing
 import re
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from comps.parsers.table import Table
 from comps.parsers.text import Text
 
-def extract_text_and_tables(pdf_path):
+PAGES_PER_TASK = 8
+
+
+def words_outside_tables(words, table_bboxes):
+    """Mask of the words whose top-left corner is outside every table box, for all words and tables at once."""
+    if not words or not table_bboxes:
+        return np.ones(len(words), dtype=bool)
+    x0 = np.fromiter((float(word['x0']) for word in words), dtype=np.float64, count=len(words))[:, None]
+    top = np.fromiter((float(word['top']) for word in words), dtype=np.float64, count=len(words))[:, None]
+    boxes = np.asarray(table_bboxes, dtype=np.float64)
+    inside = (boxes[:, 0] <= x0) & (x0 <= boxes[:, 2]) & (boxes[:, 1] <= top) & (top <= boxes[:, 3])
+    return ~inside.any(axis=1)
+
+
+def parse_page(page):
     text_content = []
     tables = []
 
+    # tables are detected once, then extracted from the same objects
+    page_tables = page.find_tables()
+    table_bboxes = [table.bbox for table in page_tables]
+
+    lines_dict = defaultdict(list)
+    words = page.extract_words()
+    for word in words:
+        lines_dict[word["top"]].append(word["text"])
+    outside = words_outside_tables(words, table_bboxes)
+    extracted_text = [word['text'] for word, keep in zip(words, outside) if keep]
+
+    page_content = " ".join(extracted_text)
+
+    match = re.search(r'^(.*?)(\s*\d+)\s*$', page_content)
+
+    if match:
+        cleaned_content = match.group(1).strip()
+        if cleaned_content:
+            text_obj = Text(cleaned_content, None)
+            text_content.append(text_obj)
+    else:
+        text_obj = Text(page_content, None)
+        text_content.append(text_obj)
+
+    sorted_lines = sorted(lines_dict.items(), key=lambda x: x[0])
+    line_tops = [top for top, _ in sorted_lines]
+
+    for table_bbox, table in zip(table_bboxes, (table.extract() for table in page_tables)):
+        heading = None
+        # the two lines right above the table
+        above = bisect.bisect_left(line_tops, table_bbox[1])
+        heading_lines = [text for _, text in sorted_lines[max(above - 2, 0) : above]]
+
+        if heading_lines:
+            heading = " ".join(word for line in heading_lines for word in line)
+
+        df = pd.DataFrame(table)
+
+        table_md = df.to_markdown(index=False)
+
+        table_obj = Table(table_md, heading, None)
+
+        tables.append(table_obj)
+    return text_content, tables
+
+
+def parse_page_range(pdf_path, start, stop):
+    # runs in a worker process, each one opens the PDF itself
     with pdfplumber.open(pdf_path) as pdf:
-        for page in pdf.pages:
-            page_tables = page.find_tables()
-            table_bboxes = [table.bbox for table in page_tables]
-        
-            extracted_text = []
-            lines_dict = defaultdict(list)
-            words = page.extract_words()
-            for word in words:
-                word_bbox = (float(word['x0']), float(word['top']), float(word['x1']), float(word['bottom']))
-                
-                inside_table = any(
-                    table_bbox[0] <= word_bbox[0] <= table_bbox[2] and
-                    table_bbox[1] <= word_bbox[1] <= table_bbox[3]
-                    for table_bbox in table_bboxes
-                )
-
-                if not inside_table:
-                    extracted_text.append(word['text'])
-                    
-                lines_dict[word["top"]].append(word["text"])
-
-            page_content = " ".join(extracted_text)
-
-            match = re.search(r'^(.*?)(\s*\d+)\s*$', page_content)
-
-            if match:
-                cleaned_content = match.group(1).strip()
-                if cleaned_content:
-                    text_obj = Text(cleaned_content, None)
-                    text_content.append(text_obj)
-            else:
-                text_obj = Text(page_content, None)
-                text_content.append(text_obj)
-
-            sorted_lines = sorted(lines_dict.items(), key=lambda x: x[0])
-
-            for table_bbox, table in zip(table_bboxes, page.extract_tables()):
-                heading = None
-                above_lines = [text for top, text in sorted_lines if top < table_bbox[1]]
-                
-                heading_lines = above_lines[-2:] if above_lines else []
-                
-                if heading_lines:
-                    heading = " ".join(word for line in heading_lines for word in line)
-
-                df = pd.DataFrame(table)
-                
-                table_md = df.to_markdown(index=False)
-
-                table_obj = Table(table_md, heading, None)
-
-                tables.append(table_obj)
-    return text_content, tables       
\ No newline at end of file
+        return [parse_page(pdf.pages[i]) for i in range(start, stop)]
+
+
+def iter_pages(pdf_path, processes=1, pages_per_task=PAGES_PER_TASK):
+    """Yield the (texts, tables) of each page, in page order, as soon as the page and those before it are parsed.
+
+    With `processes` > 1 the pages are parsed by a pool of processes in ranges of `pages_per_task` pages.
+    """
+    with pdfplumber.open(pdf_path) as pdf:
+        page_count = len(pdf.pages)
+        if processes <= 1 or page_count <= pages_per_task:
+            for page in pdf.pages:
+                yield parse_page(page)
+                # free the layout objects of the parsed page
+                page.close()
+            return
+
+    ranges = [(start, min(start + pages_per_task, page_count)) for start in range(0, page_count, pages_per_task)]
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=min(processes, len(ranges)), mp_context=context) as pool:
+        futures = [pool.submit(parse_page_range, pdf_path, start, stop) for start, stop in ranges]
+        try:
+            for future in futures:
+                yield from future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+def extract_text_and_tables(pdf_path, processes=1):
+    text_content = []
+    tables = []
+    for page_texts, page_tables in iter_pages(pdf_path, processes):
+        text_content.extend(page_texts)
+        tables.extend(page_tables)
+    return text_content, tables
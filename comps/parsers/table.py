@@ -1,5 +1,7 @@
 class Table:
+    __slots__ = ("markdown_content", "heading", "node")
+
     def __init__(self, markdown_content, heading, node):
         self.markdown_content = markdown_content
         self.heading = heading
-        self.node = node
\ No newline at end of file
+        self.node = node
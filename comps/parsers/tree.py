@@ -1,10 +1,95 @@
+import json
 import os
 from comps.parsers.node import Node
+from comps.parsers.table import Table
+from comps.parsers.text import Text
 
 OUTPUT_DIR = "out"
 
+# bump when the layout of to_dict() changes
+TREE_FORMAT_VERSION = 1
+
 class Tree:
+    __slots__ = ("rootNode", "file")
+
     def __init__(self, file):
         self.rootNode = Node('0', "root", os.path.join(OUTPUT_DIR, os.path.splitext(os.path.basename(file))[0]))
         self.file = file
-    
\ No newline at end of file
+
+    def nodes(self):
+        """All the nodes in pre-order, the root first. A node's position is its id in to_dict()."""
+        nodes = []
+        stack = [self.rootNode]
+        while stack:
+            node = stack.pop()
+            nodes.append(node)
+            for i in range(node.get_length_children() - 1, -1, -1):
+                stack.append(node.get_child(i))
+        return nodes
+
+    def to_dict(self):
+        """Flat arrays of the tree: level, heading and parent id of each node, then the content items.
+
+        A content item is [node id, "text", content] or [node id, "table", markdown, heading], in the
+        order of the node's content.
+        """
+        nodes = self.nodes()
+        ids = {id(node): i for i, node in enumerate(nodes)}
+        parents = []
+        content = []
+        for i, node in enumerate(nodes):
+            parent = node.get_parent()
+            parents.append(-1 if parent is None else ids[id(parent)])
+            for item in node.get_content():
+                if isinstance(item, Text):
+                    content.append([i, "text", item.content])
+                elif isinstance(item, Table):
+                    content.append([i, "table", item.markdown_content, item.heading])
+        return {
+            "version": TREE_FORMAT_VERSION,
+            "file": self.file,
+            "levels": [node.get_level() for node in nodes],
+            "headings": [node.get_heading() for node in nodes],
+            "parents": parents,
+            "content": content,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        if data.get("version") != TREE_FORMAT_VERSION:
+            raise ValueError(f"Unsupported tree format version {data.get('version')}")
+        tree = cls(data["file"])
+        node_dir = os.path.join(OUTPUT_DIR, os.path.splitext(os.path.basename(tree.file))[0])
+        nodes = [tree.rootNode]
+        for level, heading, parent in zip(data["levels"][1:], data["headings"][1:], data["parents"][1:]):
+            node = Node(level, heading, node_dir)
+            # parents come before their children in pre-order
+            nodes[parent].append_child(node)
+            node.set_parent(nodes[parent])
+            nodes.append(node)
+        for item in data["content"]:
+            node = nodes[item[0]]
+            if item[1] == "text":
+                node.append_content(Text(item[2], node))
+            else:
+                node.append_content(Table(item[2], item[3], node))
+        return tree
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r") as f:
+            return cls.from_dict(json.load(f))
+
+
+def section_path(node):
+    """Headings from the top-level section down to `node`, the root excluded."""
+    path = []
+    while node is not None and node.get_parent() is not None:
+        path.append(node.get_heading())
+        node = node.get_parent()
+    path.reverse()
+    return path
@@ -1,6 +1,3 @@
-from marker.converters.pdf import PdfConverter
-from marker.models import create_model_dict
-from marker.output import output_exists, save_output
 from sortedcontainers import SortedDict
 from pdfminer.pdfparser import PDFParser, PDFSyntaxError
 from pdfminer.pdfdocument import PDFDocument, PDFNoOutlines
@@ -13,12 +10,26 @@ from comps.parsers.node import Node
 from comps.parsers.text import Text
 from comps.parsers.table import Table
 from comps.core.utils import mkdirIfNotExists
+from comps.parsers.marker_pool import convert_pdf
 
 OUTPUT_DIR = "out"
 NCERT_TOC_DIR = "../parsers/ncert_toc"
 
 logger = CustomLogger("treeparser")
 
+SPAN_PATTERN = re.compile(r'<span[^>]*?\/?>(</span>)?')
+TABLE_HEADING_PATTERN = re.compile(r'^(Table|Figure)\s+(\d+)', re.IGNORECASE)
+# minimum SequenceMatcher ratio between a markdown heading and its TOC entry
+HEADING_MATCH_RATIO = 0.6
+
+
+def similar(a, b, threshold=HEADING_MATCH_RATIO):
+    """SequenceMatcher(None, a, b).ratio() > threshold, skipping the full comparison when an upper bound fails."""
+    matcher = SequenceMatcher(None, a, b)
+    if matcher.real_quick_ratio() <= threshold or matcher.quick_ratio() <= threshold:
+        return False
+    return matcher.ratio() > threshold
+
 class TreeParser:
     def __init__(self):
         mkdirIfNotExists(OUTPUT_DIR)
@@ -26,19 +37,14 @@ class TreeParser:
     def get_filename(self, file):
         return os.path.splitext(os.path.basename(file))[0]
 
+    def get_markdown_path(self, file):
+        filename = self.get_filename(file)
+        return os.path.join(OUTPUT_DIR, filename, filename + ".md")
+
     def generate_markdown(self, file, filename):
-        if not output_exists(os.path.join(OUTPUT_DIR, filename), filename):
-            config = {
-                "output_format": "markdown",
-                "use_llm": False,
-            }
-            converter = PdfConverter(
-                artifact_dict=create_model_dict(),
-                config=config
-            )
-            rendered = converter(file)
-            os.mkdir(os.path.join(OUTPUT_DIR, filename))
-            save_output(rendered, os.path.join(OUTPUT_DIR, filename), filename)
+        if not os.path.exists(self.get_markdown_path(file)):
+            # Marker's models stay loaded in the process, or in the Marker service
+            convert_pdf(file, os.path.join(OUTPUT_DIR, filename), filename)
             logger.info("Output generated")
 
     def detect_level(self, headings):
@@ -135,116 +141,117 @@ class TreeParser:
         return line, line_2
 
     def parse_markdown(self, filename, rootNode, recentNodeDict):
-        toc_file = None
-
+        # single pass over the lines in memory, same tree as reading the file line by line
         if "grade" in filename:
-            toc_file = open(os.path.join(NCERT_TOC_DIR, f"{filename}.txt"), "r")
+            toc_path = os.path.join(NCERT_TOC_DIR, f"{filename}.txt")
         else:
-            toc_file = open(os.path.join(OUTPUT_DIR, filename, "toc.txt"), "r")
-        toc_line = toc_file.readline()
-                
+            toc_path = os.path.join(OUTPUT_DIR, filename, "toc.txt")
+        with open(toc_path, "r") as toc_file:
+            toc_lines = toc_file.readlines()
+        with open(os.path.join(OUTPUT_DIR, filename, filename + ".md"), 'r') as markdown_file:
+            lines = markdown_file.readlines()
+
+        toc_pos = 0
+        toc_line = toc_lines[0] if toc_lines else ""
+
         currNode = rootNode
 
         tables = []
 
-        content = ""
+        content = []
 
         previous_line = ""
 
-        with open(os.path.join(OUTPUT_DIR, filename, filename + ".md"), 'r') as markdown_file:
-            line = markdown_file.readline()
-            while line:
-                line = re.sub(r'<span[^>]*?\/?>(</span>)?', '', line)
-                if line == "\n":
-                    line = markdown_file.readline()
+        i = 0
+        total = len(lines)
+        while i < total:
+            line = SPAN_PATTERN.sub('', lines[i])
+            i += 1
+            if line == "\n":
+                continue
+            if line.startswith('#'):
+                _, heading = line.split(" ", 1)
+                if not toc_line:
                     continue
-                if bool(re.match(r'^#+', line)):
-                    _, heading = line.split(" ", 1)
-                    if not toc_line:
-                        line = markdown_file.readline()
-                        continue
+                level, heading_toc = toc_line.split(";")
+                heading = heading.strip().replace("*", "")
+                if similar("contents", heading_toc.lower()):
+                    toc_pos += 1
+                    toc_line = toc_lines[toc_pos] if toc_pos < len(toc_lines) else ""
                     level, heading_toc = toc_line.split(";")
-                    heading = heading.strip().replace("*", "")
-                    if (SequenceMatcher(None, "contents", heading_toc.lower())).ratio() > 0.6:
-                        toc_line = toc_file.readline()
-                        level, heading_toc = toc_line.split(";")
-                    elif SequenceMatcher(None, heading.lower(), heading_toc.lower()).ratio() > 0.6:
-                        node = Node(level, heading, os.path.join(OUTPUT_DIR, filename))
-                        if level > currNode.get_level():
-                            currNode.append_child(node)
-                            node.set_parent(currNode)
-                        else:
-                            parent_key = -1
-                            for key in reversed(recentNodeDict):
-                                if key < node.get_level():
-                                    parent_key = key
-                                    break
-                            recentNodeDict[parent_key].append_child(node)
-                            node.set_parent(recentNodeDict[parent_key])
-                            recentNodeDict[node.get_level()] = node
-                        text_obj = Text(content, currNode)
-                        currNode.append_content(text_obj)
-                        for table in tables:
-                            currNode.append_content(table)
-                        tables.clear()
-                        content = ""
-                        currNode = node
-                        toc_line = toc_file.readline()  
+                elif similar(heading.lower(), heading_toc.lower()):
+                    node = Node(level, heading, os.path.join(OUTPUT_DIR, filename))
+                    if level > currNode.get_level():
+                        currNode.append_child(node)
+                        node.set_parent(currNode)
                     else:
-                        content += line    
-                elif line[0] == '|':
-                    table_list = []
-                    table_list.append(line)
-                    while self.peek_next_lines(markdown_file)[0] and self.peek_next_lines(markdown_file)[0][0] == '|':
-                        line = markdown_file.readline()
-                        table_list.append(line)
-                    next_line = self.peek_next_lines(markdown_file)[1].split('>', 1)
-                    if len(next_line) > 1:
-                        next_line = next_line[1]
-                    else:
-                        next_line = next_line[0]
-                    pattern_table_heading = re.compile(r'^(Table|Figure)\s+(\d+)', re.IGNORECASE) 
-                    match_table_heading_previous = pattern_table_heading.search(previous_line)
-                    match_table_heading_next = pattern_table_heading.search(next_line)
-                    heading = ""
-                    if match_table_heading_previous:
-                        heading = previous_line
-                    elif match_table_heading_next:
-                        heading = next_line
-                    table_obj = Table("".join(table_list), heading, currNode)
-                    tables.append(table_obj)
-                else:
-                    pattern_heading = re.compile(r'^(Table|Figure)\s+(\d+)', re.IGNORECASE)
-                    match_heading = pattern_heading.search(line)
-                    if not match_heading:
-                        content += line
-                previous_line = line
-                line = markdown_file.readline()
-                if not line:
-                    text_obj = Text(content, currNode)
+                        parent_key = -1
+                        for key in reversed(recentNodeDict):
+                            if key < node.get_level():
+                                parent_key = key
+                                break
+                        recentNodeDict[parent_key].append_child(node)
+                        node.set_parent(recentNodeDict[parent_key])
+                        recentNodeDict[node.get_level()] = node
+                    text_obj = Text("".join(content), currNode)
                     currNode.append_content(text_obj)
                     for table in tables:
                         currNode.append_content(table)
-
-        if toc_file.readline():
+                    tables.clear()
+                    content = []
+                    currNode = node
+                    toc_pos += 1
+                    toc_line = toc_lines[toc_pos] if toc_pos < len(toc_lines) else ""
+                else:
+                    content.append(line)
+            elif line[0] == '|':
+                table_list = [line]
+                while i < total and lines[i][0] == '|':
+                    line = lines[i]
+                    i += 1
+                    table_list.append(line)
+                # the second line after the table, the first one is usually blank
+                next_line = lines[i + 1] if i + 1 < total else ""
+                next_line = next_line.split('>', 1)
+                if len(next_line) > 1:
+                    next_line = next_line[1]
+                else:
+                    next_line = next_line[0]
+                heading = ""
+                if TABLE_HEADING_PATTERN.search(previous_line):
+                    heading = previous_line
+                elif TABLE_HEADING_PATTERN.search(next_line):
+                    heading = next_line
+                table_obj = Table("".join(table_list), heading, currNode)
+                tables.append(table_obj)
+            else:
+                if not TABLE_HEADING_PATTERN.search(line):
+                    content.append(line)
+            previous_line = line
+            if i == total:
+                text_obj = Text("".join(content), currNode)
+                currNode.append_content(text_obj)
+                for table in tables:
+                    currNode.append_content(table)
+
+        if toc_pos + 1 < len(toc_lines):
             logger.warning("PDF not parsed accurately")
 
-    def traverse_tree_text(self, node):
+    def traverse_tree_text(self, node, f=None):
         if node == None:
             return
         
-        node.output_node_info()
+        node.output_node_info(f)
 
         total = node.get_length_children()
 
         for i in range(total):
-            self.traverse_tree_text(node.get_child(i))
+            self.traverse_tree_text(node.get_child(i), f)
         
     def generate_output_text(self, tree):
         filename = self.get_filename(tree.file)
         with open(os.path.join(OUTPUT_DIR, filename, "output.txt"), "w") as f:
-            f.write("")
-        self.traverse_tree_text(tree.rootNode)
+            self.traverse_tree_text(tree.rootNode, f)
 
     def traverse_tree_json(self, node):
         if node == None:
@@ -280,6 +287,14 @@ class TreeParser:
         with open(os.path.join(OUTPUT_DIR, filename, "output.json"), "w") as outfile: 
             json.dump(data, outfile)
 
+    def generate_output_tree(self, tree):
+        """Write the flat form of the tree to `tree.json`, Tree.load() reads it back without re-parsing."""
+        tree.save(self.get_tree_path(tree))
+
+    def get_tree_path(self, tree):
+        filename = self.get_filename(tree.file)
+        return os.path.join(OUTPUT_DIR, filename, "tree.json")
+
     def populate_tree(self, tree):
         rootNode = tree.rootNode
         file = tree.file
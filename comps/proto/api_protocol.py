@@ -116,6 +116,9 @@ class RetrievalRequest(BaseModel):
     fetch_k: int = 20
     lambda_mult: float = 0.5
     score_threshold: float = 0.2
+    # "section" or "siblings": replace the hits by their enclosing sections, within expand_tokens words
+    expand: Optional[str] = None
+    expand_tokens: Optional[int] = None
 
     # define
     request_type: Literal["retrieval"] = "retrieval"
@@ -261,6 +264,8 @@ class ChatCompletionRequest(BaseModel):
     fetch_k: int = 20
     lambda_mult: float = 0.5
     score_threshold: float = 0.2
+    expand: Optional[str] = None
+    expand_tokens: Optional[int] = None
     retrieved_docs: Union[List[RetrievalResponseData], List[Dict[str, Any]]] = Field(default_factory=list)
 
     # reranking
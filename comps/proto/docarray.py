@@ -37,6 +37,9 @@ class EmbedDoc(BaseDoc):
     lambda_mult: float = 0.5
     score_threshold: float = 0.2
     constraints: Optional[Union[Dict[str, Any], List[Dict[str, Any]], None]] = None
+    # "section" or "siblings": replace the hits by their enclosing sections, within expand_tokens words
+    expand: Optional[str] = None
+    expand_tokens: Optional[int] = None
 
 
 class EmbedMultimodalDoc(EmbedDoc):
@@ -50,6 +53,12 @@ class EmbedMultimodalDoc(EmbedDoc):
         default=None,
     )
 
+
+class EmbedBatchDoc(BaseDoc):
+    # several queries answered in one retriever round-trip, e.g. /v1/retrieval/batch
+    queries: DocList[EmbedDoc]
+
+
 class SearchedDoc(BaseDoc):
     retrieved_docs: DocList[TextDoc]
     initial_query: str
@@ -63,6 +72,11 @@ class SearchedMultimodalDoc(SearchedDoc):
     metadata: List[Dict[str, Any]]
 
 
+class SearchedBatchDoc(BaseDoc):
+    # results in the order of EmbedBatchDoc.queries
+    results: DocList[SearchedMultimodalDoc]
+
+
 class LLMParams(BaseDoc):
     model: Optional[str] = None
     max_tokens: int = 1024
@@ -99,6 +113,8 @@ class RetrieverParms(BaseDoc):
     fetch_k: int = 20
     lambda_mult: float = 0.5
     score_threshold: float = 0.2
+    expand: Optional[str] = None
+    expand_tokens: Optional[int] = None
 
 
 
@@ -0,0 +1,153 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+import redis
+from langchain_core.documents import Document
+from redis.commands.search.query import Query
+
+from comps import CustomLogger
+from comps.core.semantic_cache import ALL_FILES, generation_key
+
+logger = CustomLogger("file_vector_cache")
+
+
+class FileVectors:
+    """The chunks of one file: a contiguous matrix of normalized embeddings plus their texts and metadata."""
+
+    def __init__(self, generation: str, matrix: Optional[np.ndarray], texts: List[str], metadatas: List[Dict]):
+        self.generation = generation
+        # None when the file has too many chunks to be cached, searches go to Redis
+        self.matrix = matrix
+        self.texts = texts
+        self.metadatas = metadatas
+        self.checked = time.time()
+        self.nbytes = (matrix.nbytes if matrix is not None else 0) + sum(len(t) for t in texts)
+
+    def search(self, query: np.ndarray, k: int) -> List[Document]:
+        if k <= 0 or not len(self.texts):
+            return []
+        # cosine similarity, the distance metric of the langchain Redis vector field
+        scores = self.matrix @ query
+        if k < len(scores):
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top], kind="stable")]
+        else:
+            top = np.argsort(-scores, kind="stable")
+        docs = []
+        for i in top:
+            # the cosine distance RediSearch reports, 1 - similarity
+            metadata = dict(self.metadatas[i], vector_distance=float(1.0 - scores[i]))
+            docs.append(Document(page_content=self.texts[i], metadata=metadata))
+        return docs
+
+
+class FileVectorCache:
+    """In-process KNN over the chunks of recently queried files.
+
+    Chat turns are scoped to a single file of a few dozen chunks, so the first turn loads all of them from
+    Redis and the following ones are answered with one dot product. Files are evicted least recently used
+    first once the cached matrices and texts exceed `max_bytes`. Entries are tagged with the generation
+    counters dataprep bumps on every ingest and delete, checked at most every `revalidate` seconds.
+    """
+
+    def __init__(self, vector_db, index_name: str, max_bytes: int, max_chunks: int, revalidate: float):
+        self.vector_db = vector_db
+        self.client = vector_db.client
+        self.index_name = index_name
+        self.max_bytes = max_bytes
+        self.max_chunks = max_chunks
+        self.revalidate = revalidate
+        self.files = OrderedDict()  # file_name -> FileVectors, least recently used first
+        self.nbytes = 0
+        self.loading = {}  # file_name -> future of the load in progress
+
+    def _generation(self, file_name: str) -> str:
+        all_gen, file_gen = self.client.mget(generation_key(ALL_FILES), generation_key(file_name))
+        return f"{int(all_gen or 0)}:{int(file_gen or 0)}"
+
+    def _load(self, file_name: str) -> FileVectors:
+        generation = self._generation(file_name)
+        # same filter as the Redis KNN query so both paths see the same chunks
+        query = Query(f"@file_name:{file_name}").no_content().paging(0, self.max_chunks).dialect(2)
+        result = self.client.ft(self.index_name).search(query)
+        if result.total > self.max_chunks:
+            logger.info(f"[ file vector cache ] {file_name} has {result.total} chunks, not cached")
+            return FileVectors(generation, None, [], [])
+
+        schema = self.vector_db._schema
+        fields = [schema.content_key, schema.content_vector_key] + list(schema.metadata_keys)
+        pipe = self.client.pipeline(transaction=False)
+        for doc in result.docs:
+            pipe.hmget(doc.id, fields)
+
+        vectors, texts, metadatas = [], [], []
+        for doc, values in zip(result.docs, pipe.execute()):
+            content, vector = values[0], values[1]
+            if content is None or vector is None:
+                # deleted since the search
+                continue
+            texts.append(content.decode("utf-8"))
+            vectors.append(np.frombuffer(vector, dtype=schema.vector_dtype))
+            metadata = {"id": doc.id}
+            for key, value in zip(fields[2:], values[2:]):
+                if value is not None:
+                    metadata[key] = value.decode("utf-8")
+            metadatas.append(metadata)
+
+        matrix = np.ascontiguousarray(np.vstack(vectors), dtype=np.float32) if vectors else np.empty((0, 0), np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix /= np.where(norms == 0, 1, norms)
+        return FileVectors(generation, matrix, texts, metadatas)
+
+    def _put(self, file_name: str, entry: FileVectors):
+        old = self.files.pop(file_name, None)
+        if old is not None:
+            self.nbytes -= old.nbytes
+        if entry.nbytes > self.max_bytes:
+            return
+        self.files[file_name] = entry
+        self.nbytes += entry.nbytes
+        while self.nbytes > self.max_bytes:
+            _, evicted = self.files.popitem(last=False)
+            self.nbytes -= evicted.nbytes
+
+    async def _get(self, file_name: str) -> FileVectors:
+        entry = self.files.get(file_name)
+        loop = asyncio.get_running_loop()
+        if entry is not None:
+            self.files.move_to_end(file_name)
+            if time.time() - entry.checked < self.revalidate:
+                return entry
+            if await loop.run_in_executor(None, self._generation, file_name) == entry.generation:
+                entry.checked = time.time()
+                return entry
+
+        # concurrent first turns on the same file share one load
+        load = self.loading.get(file_name)
+        if load is None:
+            load = self.loading[file_name] = loop.run_in_executor(None, self._load, file_name)
+            load.add_done_callback(lambda _: self.loading.pop(file_name, None))
+        entry = await asyncio.shield(load)
+        self._put(file_name, entry)
+        return entry
+
+    async def search(self, file_name: str, embedding, k: int) -> Optional[List[Document]]:
+        """Return the `k` chunks of `file_name` closest to `embedding`, or None to search Redis instead."""
+        query = np.asarray(embedding, dtype=np.float32)
+        if query.ndim != 1:
+            return None
+        try:
+            entry = await self._get(file_name)
+        except redis.RedisError as e:
+            logger.error(f"[ file vector cache ] fail to load {file_name}: {e}")
+            return None
+        if entry.matrix is None or (entry.matrix.size and entry.matrix.shape[1] != query.shape[0]):
+            return None
+        norm = np.linalg.norm(query)
+        return entry.search(query / norm if norm else query, k)
@@ -69,6 +69,26 @@ REDIS_URL = format_redis_conn_from_env()
 
 # Vector Index Configuration
 INDEX_NAME = os.getenv("INDEX_NAME", "rag-redis")
+# Seconds a non-empty FT.INFO document count of the index is trusted
+INDEX_INFO_TTL = float(os.getenv("INDEX_INFO_TTL", 30))
+
+# In-process vector search over the chunks of recently queried files
+FILE_VECTOR_CACHE_ENABLED = get_boolean_env_var("FILE_VECTOR_CACHE_ENABLED", True)
+FILE_VECTOR_CACHE_MAX_BYTES = int(os.getenv("FILE_VECTOR_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+# files with more chunks are always searched in Redis
+FILE_VECTOR_CACHE_MAX_CHUNKS = int(os.getenv("FILE_VECTOR_CACHE_MAX_CHUNKS", 4096))
+# seconds a cached file is used before checking whether dataprep re-ingested or deleted it
+FILE_VECTOR_CACHE_REVALIDATE = float(os.getenv("FILE_VECTOR_CACHE_REVALIDATE", 1))
+
+# search_type="hybrid": reciprocal rank fusion of BM25 and KNN results, score = sum(weight / (HYBRID_RRF_K + rank))
+HYBRID_RRF_K = int(os.getenv("HYBRID_RRF_K", 60))
+# weight of the full-text ranking, the vector ranking has weight 1
+HYBRID_TEXT_WEIGHT = float(os.getenv("HYBRID_TEXT_WEIGHT", 1.0))
+
+# expand="section"|"siblings": words per expanded hit when the request sets no expand_tokens
+SECTION_EXPAND_TOKENS = int(os.getenv("SECTION_EXPAND_TOKENS", 512))
+# chunks read per section, larger sections are only merged around their hits
+SECTION_MAX_CHUNKS = int(os.getenv("SECTION_MAX_CHUNKS", 256))
 
 
 current_file_path = os.path.abspath(__file__)
@@ -1,19 +1,43 @@
 # Copyright (C) 2024 Intel Corporation
 # SPDX-License-Identifier: Apache-2.0
 
+import asyncio
 import os
+import re
 import time
-from typing import Union
+from typing import List, Optional, Union
 
+import redis
+from file_vector_cache import FileVectorCache
 from langchain_community.embeddings import HuggingFaceBgeEmbeddings
 from langchain_community.vectorstores import Redis
+from langchain_core.documents import Document
 from langchain_huggingface import HuggingFaceEndpointEmbeddings
-from redis_config import EMBED_MODEL, INDEX_NAME, INDEX_SCHEMA, REDIS_URL
+from redis.commands.search.query import Query
+from redis.commands.search.result import Result
+from redis_config import (
+    EMBED_MODEL,
+    FILE_VECTOR_CACHE_ENABLED,
+    FILE_VECTOR_CACHE_MAX_BYTES,
+    FILE_VECTOR_CACHE_MAX_CHUNKS,
+    FILE_VECTOR_CACHE_REVALIDATE,
+    HYBRID_RRF_K,
+    HYBRID_TEXT_WEIGHT,
+    INDEX_INFO_TTL,
+    INDEX_NAME,
+    INDEX_SCHEMA,
+    REDIS_URL,
+    SECTION_EXPAND_TOKENS,
+    SECTION_MAX_CHUNKS,
+)
+from section_expander import SectionExpander
 
 from comps import (
     CustomLogger,
+    EmbedBatchDoc,
     EmbedDoc,
     EmbedMultimodalDoc,
+    SearchedBatchDoc,
     SearchedDoc,
     SearchedMultimodalDoc,
     ServiceType,
@@ -39,6 +63,244 @@ tei_embedding_endpoint = os.getenv("TEI_EMBEDDING_ENDPOINT")
 bridge_tower_embedding = os.getenv("BRIDGE_TOWER_EMBEDDING")
 
 
+class IndexStatus:
+    """Cached document count of the vector index, read with FT.INFO.
+
+    A non-empty count is trusted for `ttl` seconds. An empty or missing index is re-checked on every request,
+    so files ingested by dataprep are searchable right away; FT.INFO is O(1) in the size of the index. A
+    search failing because dataprep dropped the index meanwhile clears the count through `index_missing`.
+    """
+
+    def __init__(self, client, index_name: str, ttl: float = INDEX_INFO_TTL):
+        self.client = client
+        self.index_name = index_name
+        self.ttl = ttl
+        self.num_docs = 0
+        self.checked = 0.0
+
+    def refresh(self):
+        try:
+            self.num_docs = int(self.client.ft(self.index_name).info()["num_docs"])
+        except redis.ResponseError as e:
+            # unknown index: nothing ingested yet, or dropped by dataprep
+            if logflag:
+                logger.info(f"[ index status ] {self.index_name}: {e}")
+            self.num_docs = 0
+        self.checked = time.time()
+
+    async def has_data(self) -> bool:
+        if not self.num_docs or time.time() - self.checked > self.ttl:
+            await asyncio.get_running_loop().run_in_executor(None, self.refresh)
+        return self.num_docs > 0
+
+    def index_missing(self, error: redis.ResponseError) -> bool:
+        """True when `error` comes from a search of the index after it was dropped, the count is then reset."""
+        message = str(error).lower()
+        # "Unknown Index name" before RediSearch 2.8, "No such index" since
+        if "unknown index name" not in message and "no such index" not in message:
+            return False
+        logger.info(f"[ index status ] {self.index_name} dropped, searches return nothing until it is re-created")
+        self.num_docs = 0
+        return True
+
+
+def query_embedding(input):
+    if isinstance(input, EmbedDoc) or isinstance(input, EmbedMultimodalDoc):
+        return input.embedding
+    # for RetrievalRequest, ChatCompletionRequest
+    if isinstance(input.embedding, EmbeddingResponse):
+        embeddings = input.embedding.data
+        embedding_data_input = []
+        for emb in embeddings:
+            # each emb is EmbeddingResponseData
+            embedding_data_input.append(emb.embedding)
+        return embedding_data_input
+    return input.embedding
+
+
+def query_text(input) -> str:
+    # EmbedDoc carries the query in `text`, RetrievalRequest and ChatCompletionRequest in `input`
+    text = getattr(input, "text", None) or getattr(input, "input", None) or ""
+    return " ".join(text) if isinstance(text, list) else text
+
+
+async def similarity_search(input, embedding, k: int) -> List[Document]:
+    if input.file_name and file_cache is not None:
+        search_res = await file_cache.search(input.file_name, embedding, k)
+        if search_res is not None:
+            return search_res
+    return await asyncio.get_running_loop().run_in_executor(None, knn_search, embedding, k, input.file_name)
+
+
+def full_text_query(text: str) -> str:
+    """Turn a question into a RediSearch OR query over the chunk text.
+
+    Tokens with inner punctuation, e.g. circular numbers like DOR.No.BP.BC.12/21.04.048/2023-24, section
+    numbers or amounts, become exact phrases of the parts the RediSearch tokenizer indexes them as.
+    """
+    terms = []
+    for word in text.split():
+        parts = [part for part in re.split(r"\W+", word) if part]
+        if len(parts) == 1:
+            term = parts[0]
+        elif parts:
+            term = '"' + " ".join(parts) + '"'
+        else:
+            continue
+        if term not in terms:
+            terms.append(term)
+    return "|".join(terms)
+
+
+# The helpers below are the only users of the private API of langchain_community's Redis vectorstore
+# (_schema, _prepare_query, _collect_metadata), the pieces its own similarity_search_by_vector is built
+# from, checked against langchain_community 0.4.2. They let the similarity, pipelined and full-text paths
+# return the same documents, the KNN ones with their distance.
+def content_key() -> str:
+    return vector_db._schema.content_key
+
+
+def metadata_keys() -> List[str]:
+    return list(vector_db._schema.metadata_keys)
+
+
+def knn_query(embedding, k: int, file_name: Optional[str]) -> tuple:
+    """(query, params) of the KNN search of vector_db.similarity_search_by_vector, the distance returned too."""
+    redis_filter = f"@file_name:{file_name}" if file_name else "*"
+    return vector_db._prepare_query(embedding, k=k, filter=redis_filter, with_metadata=True, with_distance=True)
+
+
+def result_document(result) -> Document:
+    """Langchain document of a FT.SEARCH result, with the metadata the public search returns.
+
+    KNN results also carry their cosine `vector_distance`, as a float like the file cache's.
+    """
+    metadata = {"id": result.id}
+    metadata.update(vector_db._collect_metadata(result))
+    # the KNN score is yielded as "distance", as "vector_distance" by older langchain_community releases
+    distance = getattr(result, "distance", None) or getattr(result, "vector_distance", None)
+    if distance is not None:
+        metadata["vector_distance"] = float(distance)
+    return Document(page_content=getattr(result, content_key()), metadata=metadata)
+
+
+def knn_search(embedding, k: int, file_name: Optional[str]) -> List[Document]:
+    results = vector_db.client.ft(INDEX_NAME).search(*knn_query(embedding, k, file_name))
+    return [result_document(result) for result in results.docs]
+
+
+def full_text_search(input, k: int) -> List[Document]:
+    terms = full_text_query(query_text(input))
+    if not terms:
+        return []
+    query_str = f"@{content_key()}:({terms})"
+    if input.file_name:
+        query_str = f"(@file_name:{input.file_name}) {query_str}"
+    query = (
+        Query(query_str)
+        .scorer("BM25")
+        .return_fields(content_key(), *metadata_keys())
+        .paging(0, k)
+        .dialect(2)
+    )
+    return [result_document(result) for result in vector_db.client.ft(INDEX_NAME).search(query).docs]
+
+
+async def hybrid_search(input, embedding) -> List[Document]:
+    """Fuse a BM25 full-text query and a KNN query, both of `fetch_k` candidates, with reciprocal rank fusion."""
+    loop = asyncio.get_running_loop()
+    text_res, vector_res = await asyncio.gather(
+        loop.run_in_executor(None, full_text_search, input, input.fetch_k),
+        similarity_search(input, embedding, input.fetch_k),
+    )
+    scores, docs = {}, {}
+    for weight, search_res in ((HYBRID_TEXT_WEIGHT, text_res), (1.0, vector_res)):
+        for rank, doc in enumerate(search_res):
+            key = doc.metadata.get("id", doc.page_content)
+            scores[key] = scores.get(key, 0.0) + weight / (HYBRID_RRF_K + rank + 1)
+            docs.setdefault(key, doc)
+    ranked = sorted(scores, key=scores.get, reverse=True)[: input.k]
+    return [docs[key] for key in ranked]
+
+
+async def search(input) -> List[Document]:
+    embedding_data_input = query_embedding(input)
+    if input.search_type == "similarity":
+        search_res = await similarity_search(input, embedding_data_input, input.k)
+    elif input.search_type == "hybrid":
+        search_res = await hybrid_search(input, embedding_data_input)
+    elif input.search_type == "similarity_distance_threshold":
+        if input.distance_threshold is None:
+            raise ValueError("distance_threshold must be provided for " + "similarity_distance_threshold retriever")
+        search_res = await vector_db.asimilarity_search_by_vector(
+            embedding=input.embedding, k=input.k, distance_threshold=input.distance_threshold
+        )
+    elif input.search_type == "similarity_score_threshold":
+        docs_and_similarities = await vector_db.asimilarity_search_with_relevance_scores(
+            query=input.text, k=input.k, score_threshold=input.score_threshold
+        )
+        search_res = [doc for doc, _ in docs_and_similarities]
+    elif input.search_type == "mmr":
+        search_res = await vector_db.amax_marginal_relevance_search(
+            query=input.text, k=input.k, fetch_k=input.fetch_k, lambda_mult=input.lambda_mult
+        )
+    else:
+        raise ValueError(f"{input.search_type} not valid")
+    return await expand_sections(input, search_res)
+
+
+async def expand_sections(input, search_res: List[Document]) -> List[Document]:
+    """Replace the hits by their enclosing sections when the request sets `expand`."""
+    expand = getattr(input, "expand", None)
+    if not expand:
+        return search_res
+    max_tokens = getattr(input, "expand_tokens", None) or SECTION_EXPAND_TOKENS
+    return await asyncio.get_running_loop().run_in_executor(
+        None, section_expander.expand, search_res, expand, max_tokens
+    )
+
+
+def pipelined_similarity_search(inputs: List[EmbedDoc]) -> List[List[Document]]:
+    """Run the KNN queries of `inputs` as one pipelined batch of FT.SEARCH commands, results in order."""
+    pipe = vector_db.client.pipeline(transaction=False)
+    for input in inputs:
+        pipe.ft(INDEX_NAME).search(*knn_query(input.embedding, input.k, input.file_name))
+    return [[result_document(result) for result in Result(raw, True).docs] for raw in pipe.execute()]
+
+
+async def search_batch(queries: List[EmbedDoc]) -> List[List[Document]]:
+    """Results of `queries` in order, plain similarity queries pipelined to Redis in one batch."""
+    batch_res = [[] for _ in queries]
+    knn, others = [], []
+    for i, query in enumerate(queries):
+        # file-scoped queries are answered by the in-process file cache when it is enabled
+        if query.search_type == "similarity" and not (query.file_name and file_cache is not None):
+            knn.append(i)
+        else:
+            others.append(i)
+    loop = asyncio.get_running_loop()
+    knn_res, others_res = await asyncio.gather(
+        loop.run_in_executor(None, pipelined_similarity_search, [queries[i] for i in knn]),
+        asyncio.gather(*(search(queries[i]) for i in others)),
+    )
+    for i, search_res in zip(knn + others, list(knn_res) + list(others_res)):
+        batch_res[i] = search_res
+    # the other queries were expanded by search()
+    expanded = await asyncio.gather(*(expand_sections(queries[i], batch_res[i]) for i in knn))
+    for i, search_res in zip(knn, expanded):
+        batch_res[i] = search_res
+    return batch_res
+
+
+def searched_doc(input, search_res: List[Document]) -> SearchedMultimodalDoc:
+    metadata_list = []
+    retrieved_docs = []
+    for r in search_res:
+        metadata_list.append(r.metadata)
+        retrieved_docs.append(TextDoc(text=r.page_content))
+    return SearchedMultimodalDoc(retrieved_docs=retrieved_docs, initial_query=input.text, metadata=metadata_list)
+
+
 @register_microservice(
     name="opea_service@retriever_redis",
     service_type=ServiceType.RETRIEVER,
@@ -54,53 +316,20 @@ async def retrieve(
         logger.info(input)
     start = time.time()
     # check if the Redis index has data
-    if vector_db.client.keys() == []:
-        search_res = []
-    else:
-        if isinstance(input, EmbedDoc) or isinstance(input, EmbedMultimodalDoc):
-            embedding_data_input = input.embedding
-        else:
-            # for RetrievalRequest, ChatCompletionRequest
-            if isinstance(input.embedding, EmbeddingResponse):
-                embeddings = input.embedding.data
-                embedding_data_input = []
-                for emb in embeddings:
-                    # each emb is EmbeddingResponseData
-                    embedding_data_input.append(emb.embedding)
-            else:
-                embedding_data_input = input.embedding
-
+    search_res = []
+    if await index_status.has_data():
         # if the Redis index has data, perform the search
-        if input.search_type == "similarity":
-            redis_filter = f"@file_name:{input.file_name}" if input.file_name else "*"
-            search_res = await vector_db.asimilarity_search_by_vector(embedding=embedding_data_input, k=input.k, filter=redis_filter)
-        elif input.search_type == "similarity_distance_threshold":
-            if input.distance_threshold is None:
-                raise ValueError("distance_threshold must be provided for " + "similarity_distance_threshold retriever")
-            search_res = await vector_db.asimilarity_search_by_vector(
-                embedding=input.embedding, k=input.k, distance_threshold=input.distance_threshold
-            )
-        elif input.search_type == "similarity_score_threshold":
-            docs_and_similarities = await vector_db.asimilarity_search_with_relevance_scores(
-                query=input.text, k=input.k, score_threshold=input.score_threshold
-            )
-            search_res = [doc for doc, _ in docs_and_similarities]
-        elif input.search_type == "mmr":
-            search_res = await vector_db.amax_marginal_relevance_search(
-                query=input.text, k=input.k, fetch_k=input.fetch_k, lambda_mult=input.lambda_mult
-            )
-        else:
-            raise ValueError(f"{input.search_type} not valid")
+        try:
+            search_res = await search(input)
+        except redis.ResponseError as e:
+            if not index_status.index_missing(e):
+                raise
 
     # return different response format
-    retrieved_docs = []
     if isinstance(input, EmbedDoc) or isinstance(input, EmbedMultimodalDoc):
-        metadata_list = []
-        for r in search_res:
-            metadata_list.append(r.metadata)
-            retrieved_docs.append(TextDoc(text=r.page_content))
-        result = SearchedMultimodalDoc(retrieved_docs=retrieved_docs, initial_query=input.text, metadata=metadata_list)
+        result = searched_doc(input, search_res)
     else:
+        retrieved_docs = []
         for r in search_res:
             retrieved_docs.append(RetrievalResponseData(text=r.page_content, metadata=r.metadata))
         if isinstance(input, RetrievalRequest):
@@ -116,6 +345,38 @@ async def retrieve(
     return result
 
 
+@register_microservice(
+    name="opea_service@retriever_redis",
+    service_type=ServiceType.RETRIEVER,
+    endpoint="/v1/retrieval/batch",
+    host="0.0.0.0",
+    port=7000,
+)
+async def retrieve_batch(input: EmbedBatchDoc) -> SearchedBatchDoc:
+    """Answer several queries in one round-trip.
+
+    Plain similarity queries, the ones sent by the megaservice, go to Redis as one pipelined batch unless
+    the file cache answers them; the other ones are run concurrently. Results are in the order of `input.queries`.
+    """
+    if logflag:
+        logger.info(input)
+    start = time.time()
+    queries = list(input.queries)
+    batch_res = [[] for _ in queries]
+    if queries and await index_status.has_data():
+        try:
+            batch_res = await search_batch(queries)
+        except redis.ResponseError as e:
+            if not index_status.index_missing(e):
+                raise
+
+    result = SearchedBatchDoc(results=[searched_doc(query, res) for query, res in zip(queries, batch_res)])
+    statistics_dict["opea_service@retriever_redis"].append_latency(time.time() - start, None)
+    if logflag:
+        logger.info(result)
+    return result
+
+
 if __name__ == "__main__":
     # Create vectorstore
     if tei_embedding_endpoint:
@@ -132,4 +393,16 @@ if __name__ == "__main__":
         embeddings = HuggingFaceBgeEmbeddings(model_name=EMBED_MODEL)
         vector_db = Redis(embedding=embeddings, index_name=INDEX_NAME, redis_url=REDIS_URL)
 
+    index_status = IndexStatus(vector_db.client, INDEX_NAME)
+    section_expander = SectionExpander(vector_db.client, INDEX_NAME, SECTION_MAX_CHUNKS)
+    file_cache = None
+    if FILE_VECTOR_CACHE_ENABLED:
+        file_cache = FileVectorCache(
+            vector_db,
+            INDEX_NAME,
+            max_bytes=FILE_VECTOR_CACHE_MAX_BYTES,
+            max_chunks=FILE_VECTOR_CACHE_MAX_CHUNKS,
+            revalidate=FILE_VECTOR_CACHE_REVALIDATE,
+        )
+
     opea_microservices["opea_service@retriever_redis"].start()
@@ -0,0 +1,152 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import re
+from typing import Dict, List, Optional, Tuple
+
+import redis
+from langchain_core.documents import Document
+from redis.commands.search.query import Query
+from redis.commands.search.result import Result
+
+from comps import CustomLogger
+
+logger = CustomLogger("section_expander")
+
+# fields written by dataprep's ChunkWriter for documents parsed into a tree
+SECTION_KEY = "section"
+SECTION_ID_KEY = "section_id"
+CHUNK_INDEX_KEY = "chunk_index"
+
+EXPAND_MODES = ("section", "siblings")
+
+# punctuation and whitespace are separators in RediSearch queries, TAG values containing them are escaped
+TAG_SPECIAL_CHARS = re.compile(r"[,.<>{}\[\]\\\"':;!@#$%^&*()\-+=~|/\s]")
+
+
+def escape_tag(value: str) -> str:
+    return TAG_SPECIAL_CHARS.sub(lambda match: "\\" + match.group(0), value)
+
+
+def count_tokens(text: str) -> int:
+    # whitespace separated words, close enough to tokenizer counts to budget a prompt
+    return len(text.split())
+
+
+class SectionExpander:
+    """Turn KNN hits into the sections of the document they come from.
+
+    Hits of the same section collapse into one document, placed at the rank of the best hit. With mode
+    "section" the document is the whole section when it fits in `max_tokens`; otherwise, and with mode
+    "siblings", it is the hits merged with their neighbouring chunks of the section, in document order,
+    grown one chunk at a time on alternate sides while the budget allows. Hits of documents ingested
+    without sections, e.g. by the lightweight parser, are returned unchanged.
+    """
+
+    def __init__(self, client: redis.Redis, index_name: str, max_section_chunks: int):
+        self.client = client
+        self.index_name = index_name
+        self.max_section_chunks = max_section_chunks
+
+    def _hit_sections(self, docs: List[Document]) -> List[Tuple[Optional[str], Optional[str], Optional[int]]]:
+        """(section path, section id, chunk index) of each hit, read from its hash."""
+        pipe = self.client.pipeline(transaction=False)
+        for doc in docs:
+            pipe.hmget(doc.metadata.get("id", ""), SECTION_KEY, SECTION_ID_KEY, CHUNK_INDEX_KEY)
+        sections = []
+        for path, section_id, index in pipe.execute():
+            if section_id is None or index is None:
+                sections.append((None, None, None))
+            else:
+                sections.append((path.decode("utf-8") if path else "", section_id.decode("utf-8"), int(index)))
+        return sections
+
+    def _section_chunks(self, section_ids: List[str]) -> Dict[str, List[Tuple[int, str, str]]]:
+        """(chunk index, key, text) of the chunks of each section, in document order."""
+        pipe = self.client.pipeline(transaction=False)
+        for section_id in section_ids:
+            query = (
+                Query(f"@{SECTION_ID_KEY}:{{{escape_tag(section_id)}}}")
+                .return_fields("content", CHUNK_INDEX_KEY)
+                .paging(0, self.max_section_chunks)
+                .dialect(2)
+            )
+            pipe.ft(self.index_name).search(query)
+        chunks = {}
+        for section_id, raw in zip(section_ids, pipe.execute()):
+            chunks[section_id] = sorted(
+                (int(getattr(doc, CHUNK_INDEX_KEY)), doc.id, doc.content) for doc in Result(raw, True).docs
+            )
+        return chunks
+
+    def _window(self, chunks: List[Tuple[int, str, str]], hits: List[int], max_tokens: int) -> Tuple[int, int]:
+        """Bounds [start, stop) of the chunks to merge around `hits`, positions in `chunks` best hit first."""
+        tokens = [count_tokens(text) for _, _, text in chunks]
+        start, stop = hits[0], hits[0] + 1
+        # take the other hits when the span covering them fits
+        low, high = min(hits), max(hits) + 1
+        if sum(tokens[low:high]) <= max_tokens:
+            start, stop = low, high
+        used = sum(tokens[start:stop])
+        grown = True
+        while grown:
+            grown = False
+            if start > 0 and used + tokens[start - 1] <= max_tokens:
+                start -= 1
+                used += tokens[start]
+                grown = True
+            if stop < len(chunks) and used + tokens[stop] <= max_tokens:
+                used += tokens[stop]
+                stop += 1
+                grown = True
+        return start, stop
+
+    def expand(self, docs: List[Document], mode: str, max_tokens: int) -> List[Document]:
+        if mode not in EXPAND_MODES:
+            raise ValueError(f"expand must be one of {EXPAND_MODES}, not {mode}")
+        if not docs:
+            return docs
+        try:
+            sections = self._hit_sections(docs)
+            groups = {}  # section id -> positions of its hits in docs, best first
+            for i, (_, section_id, _) in enumerate(sections):
+                if section_id is not None:
+                    groups.setdefault(section_id, []).append(i)
+            section_chunks = self._section_chunks(list(groups)) if groups else {}
+        except redis.RedisError as e:
+            logger.error(f"[ section expander ] fail to read sections, hits returned as is: {e}")
+            return docs
+
+        expanded, emitted = [], set()
+        for doc, (path, section_id, _) in zip(docs, sections):
+            if section_id is None:
+                expanded.append(doc)
+                continue
+            if section_id in emitted:
+                continue
+            emitted.add(section_id)
+            chunks = section_chunks.get(section_id) or []
+            positions = {index: position for position, (index, _, _) in enumerate(chunks)}
+            hits = [positions[sections[i][2]] for i in groups[section_id] if sections[i][2] in positions]
+            if not hits:
+                # chunks deleted since the search
+                expanded.append(doc)
+                continue
+            total = sum(count_tokens(text) for _, _, text in chunks)
+            if mode == "section" and total <= max_tokens and len(chunks) < self.max_section_chunks:
+                start, stop = 0, len(chunks)
+            else:
+                start, stop = self._window(chunks, hits, max_tokens)
+            metadata = dict(doc.metadata)
+            metadata.update(
+                {
+                    SECTION_KEY: path,
+                    SECTION_ID_KEY: section_id,
+                    # a flat string like the other metadata values read from the chunk hashes
+                    "chunk_ids": ",".join(key for _, key, _ in chunks[start:stop]),
+                    "hits": len(groups[section_id]),
+                }
+            )
+            text = "\n".join(text for _, _, text in chunks[start:stop])
+            expanded.append(Document(page_content=text, metadata=metadata))
+        return expanded
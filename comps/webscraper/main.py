@@ -19,6 +19,8 @@ server_host_ip = os.getenv("SERVER_HOST_IP", "localhost")
 server_port = os.getenv("SERVER_PORT", "8000")
 dataprep_host_ip = os.getenv("DATAPREP_HOST_IP", "localhost")
 dataprep_port = os.getenv("DATAPREP_PORT", "8003")
+# queue circulars as dataprep jobs instead of waiting for their ingestion
+dataprep_async = os.getenv("DATAPREP_ASYNC_INGEST", "true").lower() in ("true", "1", "t", "y", "yes")
 
 NEO4J_URI = os.getenv("NEO4J_URI", "neo4j://localhost:7687")
 NEO4J_USER = os.getenv("NEO4J_USER", "neo4j")
@@ -170,11 +172,13 @@ class WebScraperService:
 
             with open(pdf_local_path, 'rb') as f:
                 files = {'files': (pdf_local_path.name, f)}
-                data = {'parser_type': getattr(self, 'parser_type', 'lightweight')}
+                data = {'parser_type': getattr(self, 'parser_type', 'lightweight'), 'async_mode': str(dataprep_async).lower()}
                 response = requests.post(url, files=files, data=data)
 
-            if response.status_code == 200:
-                logger.info(f"Successfully sent {pdf_local_path.name} to DataPrep: {response.status_code}")
+            # queued uploads are answered with 202 and the ids of their ingestion jobs
+            if response.status_code in [200, 202]:
+                jobs = response.json().get("jobs", []) if response.status_code == 202 else []
+                logger.info(f"Successfully sent {pdf_local_path.name} to DataPrep: {response.status_code} {jobs}")
             else:
                 logger.error(f"Failed to send {pdf_local_path.name} to DataPrep: {response.status_code} {response.text}")
         except FileNotFoundError: